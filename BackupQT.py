@@ -1,35 +1,53 @@
-from PyQt5.QtCore import Qt
+import time
+# Taken before the Qt imports so the startup report includes them
+START_TIME = time.perf_counter()
+
+from PyQt5.QtCore import Qt, QDateTime, QTimer
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QLineEdit, QPushButton,
     QVBoxLayout, QHBoxLayout, QFileDialog, QMenuBar, QAction, QGroupBox,
-    QDialog, QProgressBar, QMessageBox, QCheckBox, QComboBox, QGridLayout
+    QDialog, QProgressBar, QMessageBox, QCheckBox, QComboBox, QGridLayout,
+    QPlainTextEdit, QInputDialog, QSpinBox, QDateTimeEdit, QListWidget, QListWidgetItem,
+    QAbstractItemView
 )
 
 
 import sys
-import subprocess
 import os
-import json
-from dirsync import sync
+import app_settings
+from startup import StartupTimer, STARTUP_TARGET_MS, preload_modules
+# The engine, workers, catalog, jobs and pack store are imported by the
+# handlers that use them, so the window can appear before they are loaded
 # Import help texts
 from help_texts import HELP_LOG_TITLE, HELP_LOG_TEXT, HELP_ACTIONS_TITLE, HELP_ACTIONS_TEXT
 
-# BASE_DIR is the directory where this script is located
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-SETTINGS_FILE = os.path.join(BASE_DIR, "settings.json")
 
 
 
+# Settings changes are written this long after the last one
+SETTINGS_SAVE_DELAY_MS = 500
+# Start loading the backup engine this long after the window is shown
+PRELOAD_DELAY_MS = 200
+
 
 class BackupApp(QWidget):
-    def __init__(self):
+    def __init__(self, startup=None):
         super().__init__()
+        self.startup = startup
         self.create_log = False  # Ensure attribute exists before any method uses it
         self.log_dir = ""
         self.mirror = False
         self.selected_action = "Sync"  # Default value
+        self.settings_problems = []
         self.settings = self.load_settings()
+        self.mark("settings")
+        # Repeated setting changes (typing, resizing) are collected into one write
+        self.save_timer = QTimer(self)
+        self.save_timer.setSingleShot(True)
+        self.save_timer.setInterval(SETTINGS_SAVE_DELAY_MS)
+        self.save_timer.timeout.connect(self.write_settings)
         self.create_log = self.settings.get("create_log", False)
+        self.verify = self.settings.get("verify", False)
         self.log_dir = self.settings.get("log_dir", "")
         self.mirror = self.settings.get("mirror", False)
         self.selected_action = self.settings.get("selected_action", "Sync")
@@ -40,51 +58,67 @@ class BackupApp(QWidget):
         # Set combo_action after UI is initialized
         if hasattr(self, "combo_action"):
             self.combo_action.setCurrentText(self.selected_action)
+        if self.settings_problems:
+            self.status_label.setText("Some settings were reset: " + "; ".join(self.settings_problems))
+        self.mark("widgets")
+
+    def mark(self, name):
+        if self.startup is not None:
+            self.startup.mark(name)
 
     def load_settings(self):
-        default_settings = {
-            "window_size": [1200, 600],
-            "source_dir": "",
-            "destination_dir": "",
-            "create_log": False,
-            "log_dir": "",
-            "mirror": False,
-            "selected_action": "Sync"
-        }
-        if os.path.exists(SETTINGS_FILE):
-            try:
-                with open(SETTINGS_FILE, "r") as f:
-                    settings = json.load(f)
-            except Exception:
-                settings = default_settings
-        else:
-            settings = default_settings
-            with open(SETTINGS_FILE, "w") as f:
-                json.dump(settings, f, indent=4)
-        # Ensure selected_action is present
-        if "selected_action" not in settings:
-            settings["selected_action"] = "Sync"
-        return settings
-    
+        return app_settings.load_settings(problems=self.settings_problems)
+
+
     def save_settings(self):
         # Get current action from combo_action if available
         selected_action = "Sync"
         if hasattr(self, "combo_action"):
             selected_action = self.combo_action.currentText()
-        settings = {
+        # Start from the loaded settings so keys without a widget (e.g. copy_workers) are kept
+        settings = dict(self.settings)
+        settings.update({
             "window_size": [self.width(), self.height()],
             "source_dir": self.entry_source.text(),
             "destination_dir": self.entry_destination.text(),
             "create_log": getattr(self, "create_log", False),
+            "verify": getattr(self, "verify", False),
             "log_dir": getattr(self, "log_dir", ""),
             "mirror": getattr(self, "mirror", False),
             "selected_action": selected_action
-        }
-        with open(SETTINGS_FILE, "w") as f:
-            json.dump(settings, f, indent=4)
+        })
+        self.settings = settings
+        self.save_timer.start()
+
+    def flush_settings(self):
+        # Write the settings now if a save is pending (on close)
+        if not self.save_timer.isActive():
+            return
+        self.save_timer.stop()
+        self.write_settings()
+
+    def write_settings(self):
+        # save_timer's timeout; a single-shot timer is no longer active here
+        try:
+            app_settings.save_settings(self.settings)
+        except OSError as e:
+            self.status_label.setText(f"Could not save settings: {e}")
 
     def closeEvent(self, event):
+        # Let a running backup stop between files before the window goes away
+        catalog_worker = getattr(self, "catalog_worker", None)
+        if catalog_worker is not None and catalog_worker.isRunning():
+            # Indexing cannot be cancelled; wait for it without opening the restore dialog
+            catalog_worker.done.disconnect()
+        for worker in (getattr(self, "worker", None), getattr(self, "plan_worker", None),
+                       getattr(self, "jobs_worker", None), getattr(self, "watch_worker", None),
+                       getattr(self, "restore_worker", None), catalog_worker):
+            if worker is not None and worker.isRunning():
+                if hasattr(worker, "cancel"):
+                    worker.cancel()
+                worker.wait()
         self.save_settings()
+        self.flush_settings()
         event.accept()
 
     def init_ui(self):
@@ -115,10 +149,28 @@ class BackupApp(QWidget):
         settings_action = QAction("Settings", self)
         settings_action.triggered.connect(lambda: self.menu_settings())
         file_menu.addAction(settings_action)
+
+        restore_action = QAction("Restore...", self)
+        restore_action.triggered.connect(self.restore)
+        file_menu.addAction(restore_action)
     
         exit_action = QAction("Exit", self)
         exit_action.triggered.connect(self.close)
         file_menu.addAction(exit_action)
+
+        # Jobs menu: named profiles stored in settings.json (see jobs.py)
+        jobs_menu = menubar.addMenu("Jobs")
+        save_job_action = QAction("Save Current Settings as Job...", self)
+        save_job_action.triggered.connect(self.save_job)
+        jobs_menu.addAction(save_job_action)
+        self.load_job_menu = jobs_menu.addMenu("Load Job")
+        self.load_job_menu.aboutToShow.connect(self.fill_load_job_menu)
+        self.delete_job_menu = jobs_menu.addMenu("Delete Job")
+        self.delete_job_menu.aboutToShow.connect(self.fill_delete_job_menu)
+        jobs_menu.addSeparator()
+        run_jobs_action = QAction("Run All Jobs", self)
+        run_jobs_action.triggered.connect(self.run_all_jobs)
+        jobs_menu.addAction(run_jobs_action)
     
         # Widget creation
         #Source and Destination Labels and Entries
@@ -147,6 +199,18 @@ class BackupApp(QWidget):
         self.button_backup.setToolTip("Start the backup process")
         self.button_backup.clicked.connect(self.backup)
 
+        # Create Preview (dry run) button
+        self.button_preview = QPushButton("Preview")
+        self.button_preview.setFixedWidth(120)
+        self.button_preview.setToolTip("Show what the selected action would create, update and delete, without changing anything")
+        self.button_preview.clicked.connect(self.preview)
+
+        # Create Watch button (continuous backup of changes)
+        self.button_watch = QPushButton("Watch")
+        self.button_watch.setFixedWidth(120)
+        self.button_watch.setToolTip("Run the backup once, then keep backing up files as they change until stopped")
+        self.button_watch.clicked.connect(self.toggle_watch)
+
         # Create Cancel button
         self.button_cancel = QPushButton("Quit") 
         # Object name for Styling
@@ -157,6 +221,14 @@ class BackupApp(QWidget):
         self.button_cancel.clicked.connect(self.close)
     
         self.status_label = QLabel("")
+        # Live metrics of the running or last backup (see metrics.py)
+        self.stats_label = QLabel("")
+        self.stats_label.setObjectName("stats_label")
+        self.stats_label.setToolTip("Where the last backup spent its time: slowest phases, "
+                                    "per-file copy latency, files queued for the copy threads "
+                                    "and throughput")
+        # Time the GUI thread spent handling progress updates of the current run
+        self.gui_update_seconds = 0.0
     
         layout = QVBoxLayout()
         layout.setMenuBar(menubar)
@@ -189,6 +261,8 @@ class BackupApp(QWidget):
         # Create a horizontal layout for Backup and Cancel buttons
         button_row = QHBoxLayout()
         button_row.addWidget(self.button_backup)
+        button_row.addWidget(self.button_preview)
+        button_row.addWidget(self.button_watch)
         button_row.addWidget(self.button_cancel)
 
         # Center the button row in the group box
@@ -197,6 +271,10 @@ class BackupApp(QWidget):
         # Create widgets first
         self.checkbox_log = QCheckBox("Create log file")
         self.checkbox_log.setChecked(self.create_log)
+        self.checkbox_verify = QCheckBox("Verify copies")
+        self.checkbox_verify.setChecked(self.verify)
+        self.checkbox_verify.setToolTip("Hash files while copying and check the destination matches. "
+                                        "Unchanged files are checked against cached hashes.")
         label_actions = QLabel("Backup Actions:")
         label_actions.setObjectName("label_actions")
         self.combo_action = QComboBox()
@@ -211,6 +289,7 @@ class BackupApp(QWidget):
         log_action_row.addWidget(self.checkbox_log, 0, 0, alignment=Qt.AlignRight)
         log_action_row.addWidget(label_actions, 0, 1, alignment=Qt.AlignRight)
         log_action_row.addWidget(self.combo_action, 0, 2, alignment=Qt.AlignLeft)
+        log_action_row.addWidget(self.checkbox_verify, 1, 0, alignment=Qt.AlignRight)
         group_layout.addLayout(log_action_row)
 
         # Disable if no log file path is set
@@ -224,6 +303,10 @@ class BackupApp(QWidget):
             self.create_log = bool(state)
             self.save_settings()
         self.checkbox_log.stateChanged.connect(on_log_checkbox_changed)
+        def on_verify_checkbox_changed(state):
+            self.verify = bool(state)
+            self.save_settings()
+        self.checkbox_verify.stateChanged.connect(on_verify_checkbox_changed)
 
         group_layout.addLayout(log_action_row)
         group_layout.addSpacing(25)
@@ -232,7 +315,10 @@ class BackupApp(QWidget):
         group_box.setLayout(group_layout)
         layout.addWidget(group_box)
 
-        layout.addWidget(self.status_label)
+        status_row = QHBoxLayout()
+        status_row.addWidget(self.status_label, 1)
+        status_row.addWidget(self.stats_label)
+        layout.addLayout(status_row)
 
         self.setLayout(layout)
 
@@ -251,11 +337,7 @@ class BackupApp(QWidget):
         self.current_destination_label.setText(f"Current Destination: {self.entry_destination.text()}")
 
 
-    def backup(self):
-        source_folder = self.entry_source.text()
-        destination_folder = self.entry_destination.text()
-
-
+    def validate_folders(self, source_folder, destination_folder):
         # Validate paths with dialog
         if not os.path.exists(source_folder) or not os.path.isdir(source_folder):
             msg = QMessageBox(self)
@@ -264,7 +346,7 @@ class BackupApp(QWidget):
             msg.setText("The source folder path is invalid or does not exist.\n\nPlease select a valid source folder.")
             msg.setStandardButtons(QMessageBox.Ok)
             msg.exec_()
-            return
+            return False
         if not os.path.exists(destination_folder) or not os.path.isdir(destination_folder):
             msg = QMessageBox(self)
             msg.setWindowTitle("Invalid Destination Folder")
@@ -272,6 +354,15 @@ class BackupApp(QWidget):
             msg.setText("The destination folder path is invalid or does not exist.\n\nPlease select a valid destination folder.")
             msg.setStandardButtons(QMessageBox.Ok)
             msg.exec_()
+            return False
+        return True
+
+    def backup(self):
+        from backup_engine import format_bytes, format_duration
+        from backup_worker import BackupWorker
+        source_folder = self.entry_source.text()
+        destination_folder = self.entry_destination.text()
+        if not self.validate_folders(source_folder, destination_folder):
             return
 
         # Check log file path availability if logging is enabled
@@ -306,90 +397,471 @@ class BackupApp(QWidget):
             log_writable = False
 
         action = self.combo_action.currentText()
-        if action == "Sync":
-            # Use dirsync to mirror source to destination
-            try:
-                sync(source_folder, destination_folder, 'sync')
-                self.status_label.setText("Sync completed successfully.")
-                # Write log file if enabled, path is set, and log_writable
-                if getattr(self, 'create_log', False) and self.log_dir and log_writable:
-                    try:
-                        with open(self.log_dir, 'w', encoding='utf-8') as logf:
-                            logf.write(f"Sync completed from {source_folder} to {destination_folder}\n")
-                    except Exception as e:
-                        self.status_label.setText(f"Could not write log file: {e}")
-                        return
-            except Exception as e:
-                self.status_label.setText(f"Sync failed: {e}")
-
-        elif action == "Copy":
-            # Custom file-by-file copy (no delete at destination)
-            files_to_copy = []
-            for dirpath, dirnames, filenames in os.walk(source_folder):
-                for f in filenames:
-                    src_fp = os.path.join(dirpath, f)
-                    rel_path = os.path.relpath(src_fp, source_folder)
-                    dst_fp = os.path.join(destination_folder, rel_path)
-                    files_to_copy.append((src_fp, dst_fp))
-
-            total_files = len(files_to_copy)
-            if total_files == 0:
+
+        # Run the backup on a worker thread; the UI only receives throttled progress
+        log_path = None
+        if getattr(self, 'create_log', False) and self.log_dir and log_writable:
+            log_path = self.log_dir
+        self.worker = BackupWorker(action, source_folder, destination_folder, self.settings,
+                                   log_path, self)
+
+        # Progress dialog
+        progress_dialog = QDialog(self)
+        progress_dialog.setWindowFlags(progress_dialog.windowFlags() & ~Qt.WindowContextHelpButtonHint)
+        progress_dialog.setWindowTitle("Backup Progress")
+        progress_dialog.setWindowModality(Qt.ApplicationModal)
+        progress_dialog.setFixedSize(400, 160)
+        vbox = QVBoxLayout(progress_dialog)
+        label = QLabel("Starting backup...")
+        vbox.addWidget(label)
+        progress_bar = QProgressBar()
+        # Indeterminate until the number of files is known
+        progress_bar.setMinimum(0)
+        progress_bar.setMaximum(0)
+        vbox.addWidget(progress_bar)
+        rate_label = QLabel("")
+        vbox.addWidget(rate_label)
+        cancel_btn = QPushButton("Cancel")
+        cancel_btn.setFixedWidth(120)
+        vbox.addWidget(cancel_btn, alignment=Qt.AlignRight)
+        self.progress_dialog = progress_dialog
+
+        def on_cancel():
+            cancel_btn.setEnabled(False)
+            label.setText("Cancelling...")
+            self.worker.cancel()
+
+        def on_progress(done, total, rate, eta, limit):
+            start = time.perf_counter()
+            progress_bar.setMaximum(total)
+            progress_bar.setValue(done)
+            eta_text = format_duration(eta) if eta >= 0 else "--"
+            limit_text = f" (limit {format_bytes(limit)}/s)" if limit else ""
+            rate_label.setText(f"{done} of {total} files, {format_bytes(rate)}/s{limit_text}, ETA {eta_text}")
+            self.gui_update_seconds += time.perf_counter() - start
+
+        def on_stats_text(text):
+            self.stats_label.setText(f"{text} | GUI {self.gui_update_seconds * 1000:.0f}ms")
+
+        cancel_btn.clicked.connect(on_cancel)
+        # Closing the dialog with the title bar button also cancels
+        progress_dialog.rejected.connect(self.worker.cancel)
+        self.worker.status.connect(label.setText)
+        self.worker.progress.connect(on_progress)
+        self.worker.stats_text.connect(on_stats_text)
+        self.gui_update_seconds = 0.0
+        self.worker.done.connect(self.backup_finished)
+        self.button_backup.setEnabled(False)
+        progress_dialog.show()
+        self.worker.start()
+
+    def backup_finished(self, worker):
+        from backup_engine import format_bytes
+        self.progress_dialog.hide()
+        self.progress_dialog.deleteLater()
+        self.button_backup.setEnabled(True)
+        self.stats_label.setText(worker.metrics.summary())
+        if worker.profile_file:
+            self.stats_label.setToolTip(f"Profile written to {worker.profile_file}")
+
+        if worker.action in ("Sync", "Copy", "Archive"):
+            action = worker.action
+            if worker.error is not None:
+                self.status_label.setText(f"{action} failed: {worker.error}")
+                return
+            stats = worker.stats
+            if stats.files_done == 0 and not (stats.cancelled or stats.deleted or stats.errors):
                 self.status_label.setText("No files to backup.")
                 return
+            errors = stats.errors
 
-            # Progress dialog
-            progress_dialog = QDialog(self)
-            progress_dialog.setWindowFlags(progress_dialog.windowFlags() & ~Qt.WindowContextHelpButtonHint)
-            progress_dialog.setWindowTitle("Backup Progress")
-            progress_dialog.setWindowModality(Qt.ApplicationModal)
-            progress_dialog.setFixedSize(400, 120)
-            vbox = QVBoxLayout(progress_dialog)
-            label = QLabel("Copying files...")
-            vbox.addWidget(label)
-            progress_bar = QProgressBar()
-            progress_bar.setMinimum(0)
-            progress_bar.setMaximum(total_files)
-            vbox.addWidget(progress_bar)
-            progress_dialog.show()
-            QApplication.processEvents()
-
-            import shutil
-            errors = []
-            for i, (src_fp, dst_fp) in enumerate(files_to_copy, 1):
-                dst_dir = os.path.dirname(dst_fp)
-                if not os.path.exists(dst_dir):
-                    os.makedirs(dst_dir, exist_ok=True)
-                try:
-                    shutil.copy2(src_fp, dst_fp)
-                except Exception as e:
-                    errors.append(f"{src_fp} -> {dst_fp}: {e}")
-                progress_bar.setValue(i)
-                QApplication.processEvents()
+            # The log file is written by the worker while copying
+            if worker.log_error is not None:
+                self.status_label.setText(f"Could not write log file: {worker.log_error}")
+                return
 
-            progress_dialog.close()
+            summary = (f"Copied {stats.copied} files, skipped {stats.skipped} unchanged "
+                       f"({format_bytes(stats.bytes_skipped)} saved).")
+            if action == "Sync":
+                summary += f" Deleted {stats.deleted} files."
+            if action == "Archive":
+                summary += (f" Archived {stats.archived} replaced or deleted files "
+                            f"({format_bytes(stats.bytes_deduplicated)} deduplicated).")
+                if stats.segments:
+                    summary += (f" Packed {format_bytes(stats.bytes_packed)} into "
+                                f"{stats.segments} segments.")
+            if self.settings.get("verify", False):
+                summary += f" Verified {stats.verified} files."
+            if stats.cancelled:
+                self.status_label.setText(f"{action} cancelled by user. {summary}")
+            elif errors:
+                self.status_label.setText(f"{action} completed with errors. See log. {summary}")
+            else:
+                self.status_label.setText(f"{action} completed successfully. {summary}")
 
-            # Write log file if enabled, path is set, and log_writable
-            if getattr(self, 'create_log', False) and self.log_dir and log_writable:
-                try:
-                    with open(self.log_dir, 'w', encoding='utf-8') as logf:
-                        for i, (src_fp, dst_fp) in enumerate(files_to_copy, 1):
-                            if i <= len(errors):
-                                logf.write(f"ERROR: {errors[i-1]}\n")
-                            else:
-                                logf.write(f"Copied: {src_fp} -> {dst_fp}\n")
-                except Exception as e:
-                    self.status_label.setText(f"Could not write log file: {e}")
-                    return
+    def preview(self):
+        from backup_engine import plan_unavailable
+        from backup_worker import PlanWorker
+        action = self.combo_action.currentText()
+        problem = plan_unavailable(action, self.settings)
+        if problem:
+            self.status_label.setText(problem)
+            return
+        source_folder = self.entry_source.text()
+        destination_folder = self.entry_destination.text()
+        if not self.validate_folders(source_folder, destination_folder):
+            return
+        self.plan_worker = PlanWorker(action, source_folder, destination_folder,
+                                      dict(self.settings), parent=self)
+        self.plan_worker.done.connect(self.preview_finished)
+        self.button_preview.setEnabled(False)
+        self.status_label.setText(f"Planning {action.lower()} (dry run)...")
+        self.plan_worker.start()
 
-            if errors:
-                self.status_label.setText(f"Copy completed with errors. See log.")
-            else:
-                self.status_label.setText("Copy completed successfully.")
+    def preview_finished(self, worker):
+        self.button_preview.setEnabled(True)
+        if worker.error is not None:
+            self.status_label.setText(f"Preview failed: {worker.error}")
+            return
+        counts = worker.counts
+        ops = ("create", "update", "delete", "mkdir", "rmdir", "same", "error")
+        if worker.action == "Copy":
+            ops = tuple(op for op in ops if op not in ("delete", "rmdir"))
+        summary = ", ".join(f"{op} {counts.get(op, 0)}" for op in ops)
+        self.status_label.setText(f"Dry run: {summary}")
 
-        elif action == "Archive":
-            self.status_label.setText("Archive action not yet implemented.")
+        dlg = QDialog(self)
+        dlg.setWindowTitle(f"{worker.action} Preview (dry run)")
+        dlg.resize(int(self.width() * 0.8), int(self.height() * 0.8))
+        vbox = QVBoxLayout(dlg)
+        vbox.addWidget(QLabel(summary))
+        text = QPlainTextEdit()
+        text.setReadOnly(True)
+        lines = [f"{op:<7} {rel_path}" for op, rel_path in worker.ops]
+        shown = sum(n for op, n in counts.items() if op != "same")
+        if shown > len(lines):
+            lines.append(f"... and {shown - len(lines)} more")
+        text.setPlainText("\n".join(lines) if lines else "Nothing to do; the destination is up to date.")
+        vbox.addWidget(text)
+        close_btn = QPushButton("Close")
+        close_btn.setFixedWidth(120)
+        close_btn.clicked.connect(dlg.accept)
+        vbox.addWidget(close_btn, alignment=Qt.AlignRight)
+        dlg.exec_()
+
+    def toggle_watch(self):
+        worker = getattr(self, "watch_worker", None)
+        if worker is not None and worker.isRunning():
+            self.button_watch.setEnabled(False)
+            self.status_label.setText("Stopping watch...")
+            worker.cancel()
+            return
+        source_folder = self.entry_source.text()
+        destination_folder = self.entry_destination.text()
+        if not self.validate_folders(source_folder, destination_folder):
+            return
+        self.save_settings()
+        from backup_worker import WatchWorker
+        self.watch_worker = WatchWorker(dict(self.settings), self)
+        self.watch_worker.status.connect(self.status_label.setText)
+        self.watch_worker.result.connect(self.watch_result)
+        self.watch_worker.done.connect(self.watch_finished)
+        self.button_watch.setText("Stop Watch")
+        self.button_backup.setEnabled(False)
+        self.watch_worker.start()
+
+    def watch_result(self, result):
+        # Shown until the worker reports it is watching again
+        self.watch_last = (f"Last run {time.strftime('%H:%M:%S')}: {result['status']}, "
+                           f"{result.get('copied', 0)} copied, {result.get('deleted', 0)} deleted")
+        self.button_watch.setToolTip(self.watch_last)
+        self.stats_label.setText(self.watch_worker.metrics.summary())
+
+    def watch_finished(self, worker):
+        self.button_watch.setText("Watch")
+        self.button_watch.setEnabled(True)
+        self.button_backup.setEnabled(True)
+        if worker.error is not None:
+            self.status_label.setText(f"Watch failed: {worker.error}")
+        elif worker.last_result is not None and "error" in worker.last_result:
+            self.status_label.setText(f"Watch stopped: {worker.last_result['error']}")
+        else:
+            self.status_label.setText("Watch stopped. " + getattr(self, "watch_last", ""))
+
+    def restore(self):
+        # Index the destination first (off the GUI thread), then browse it
+        destination_folder = self.entry_destination.text()
+        if not destination_folder or not os.path.isdir(destination_folder):
+            self.status_label.setText("Select the destination folder to restore from.")
+            return
+        worker = getattr(self, "restore_worker", None)
+        if worker is not None and worker.isRunning():
+            self.status_label.setText("A restore is already running.")
+            return
+        self.status_label.setText("Indexing the destination for restore...")
+        from backup_worker import CatalogWorker
+        self.catalog_worker = CatalogWorker(destination_folder, self)
+        self.catalog_worker.done.connect(self.show_restore_dialog)
+        self.catalog_worker.start()
+
+    def show_restore_dialog(self, worker):
+        from backup_engine import format_bytes
+        from backup_worker import RestoreWorker
+        from catalog import Catalog
+        if worker.error is not None:
+            self.status_label.setText(f"Could not index the destination: {worker.error}")
+            return
+        self.status_label.setText("")
+        destination_folder = worker.destination_folder
+        catalog = Catalog(destination_folder)
+
+        dlg = QDialog(self)
+        dlg.setWindowFlags(dlg.windowFlags() & ~Qt.WindowContextHelpButtonHint)
+        dlg.setWindowTitle(f"Restore from {destination_folder}")
+        dlg.resize(800, 500)
+        vbox = QVBoxLayout(dlg)
+
+        time_row = QHBoxLayout()
+        time_row.addWidget(QLabel("Show the destination as it was at:"))
+        time_edit = QDateTimeEdit(QDateTime.currentDateTime())
+        time_edit.setCalendarPopup(True)
+        time_edit.setDisplayFormat("yyyy-MM-dd HH:mm:ss")
+        time_row.addWidget(time_edit)
+        time_row.addStretch()
+        vbox.addLayout(time_row)
+
+        search_row = QHBoxLayout()
+        search_edit = QLineEdit()
+        search_edit.setPlaceholderText("Search, e.g. Footage/*.mov")
+        search_btn = QPushButton("Search")
+        search_btn.setFixedWidth(120)
+        search_row.addWidget(search_edit)
+        search_row.addWidget(search_btn)
+        vbox.addLayout(search_row)
+
+        folder_row = QHBoxLayout()
+        folder_label = QLabel("")
+        up_btn = QPushButton("Up")
+        up_btn.setFixedWidth(120)
+        folder_row.addWidget(folder_label)
+        folder_row.addWidget(up_btn)
+        vbox.addLayout(folder_row)
+
+        listing = QListWidget()
+        listing.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        listing.setToolTip("Double-click a folder to open it. Select files and folders to restore.")
+        vbox.addWidget(listing)
+
+        button_row = QHBoxLayout()
+        restore_btn = QPushButton("Restore Selected...")
+        restore_btn.setFixedWidth(160)
+        close_btn = QPushButton("Close")
+        close_btn.setFixedWidth(120)
+        button_row.addStretch()
+        button_row.addWidget(restore_btn)
+        button_row.addWidget(close_btn)
+        vbox.addLayout(button_row)
+
+        # Current folder, or the search pattern while showing search results
+        state = {"folder": "", "search": None}
+
+        def at():
+            return time_edit.dateTime().toSecsSinceEpoch()
+
+        def add_file(entry, name):
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["mtime_ns"] / 1e9))
+            item = QListWidgetItem(f"{name}    {format_bytes(entry['size'])}    {when}    [{entry['kind']}]")
+            item.setData(Qt.UserRole, ("file", entry))
+            listing.addItem(item)
+
+        def show():
+            listing.clear()
+            if state["search"]:
+                entries = catalog.search(state["search"], at())
+                folder_label.setText(f"{len(entries)} files match {state['search']}")
+                for entry in entries:
+                    add_file(entry, entry["path"])
+                return
+            subfolders, files = catalog.list_dir(state["folder"], at())
+            folder_label.setText(os.sep + state["folder"])
+            for path in subfolders:
+                item = QListWidgetItem(os.path.basename(path) + os.sep)
+                item.setData(Qt.UserRole, ("folder", path))
+                listing.addItem(item)
+            for entry in files:
+                add_file(entry, os.path.basename(entry["path"]))
+
+        def open_item(item):
+            kind, value = item.data(Qt.UserRole)
+            if kind == "folder":
+                state.update(folder=value, search=None)
+                show()
+
+        def up():
+            state.update(folder=os.path.dirname(state["folder"]), search=None)
+            show()
+
+        def search():
+            state["search"] = search_edit.text().strip() or None
+            show()
+
+        def restore_selected():
+            items = listing.selectedItems()
+            if not items:
+                return
+            target_folder = QFileDialog.getExistingDirectory(dlg, "Restore Into")
+            if not target_folder:
+                return
+            entries = []
+            for item in items:
+                kind, value = item.data(Qt.UserRole)
+                entries.extend(catalog.subtree(value, at()) if kind == "folder" else [value])
+            # Folder listings restore relative to the folder shown; search
+            # results keep their full paths
+            strip = state["folder"] if state["search"] is None else ""
+            self.restore_worker = RestoreWorker(destination_folder, entries, target_folder,
+                                                strip, self)
+            self.restore_worker.progress.connect(
+                lambda done, total: self.status_label.setText(f"Restoring: {done}/{total} files"))
+            self.restore_worker.done.connect(self.restore_finished)
+            restore_btn.setEnabled(False)
+            self.restore_worker.done.connect(lambda worker: restore_btn.setEnabled(True))
+            self.status_label.setText(f"Restoring {len(entries)} files to {target_folder}...")
+            self.restore_worker.start()
+
+        time_edit.dateTimeChanged.connect(lambda value: show())
+        search_btn.clicked.connect(search)
+        search_edit.returnPressed.connect(search)
+        up_btn.clicked.connect(up)
+        listing.itemDoubleClicked.connect(open_item)
+        restore_btn.clicked.connect(restore_selected)
+        close_btn.clicked.connect(dlg.accept)
+        show()
+        dlg.exec_()
+        catalog.close()
+
+    def restore_finished(self, worker):
+        if worker.error is not None:
+            self.status_label.setText(f"Restore failed: {worker.error}")
+        elif worker.errors:
+            self.status_label.setText(f"Restored {worker.files_done - len(worker.errors)} files, "
+                                      f"{len(worker.errors)} failed: {worker.errors[0]}")
+        elif worker.cancel_event.is_set():
+            self.status_label.setText(f"Restore cancelled after {worker.files_done} files.")
+        else:
+            self.status_label.setText(f"Restored {worker.files_done} files to {worker.target_folder}.")
+
+    def save_job(self):
+        name, ok = QInputDialog.getText(self, "Save Job", "Job name:")
+        name = name.strip()
+        if not ok or not name:
+            return
+        self.save_settings()
+        from jobs import job_from_settings
+        job = job_from_settings(name, self.settings)
+        # A job with the same name is replaced in place
+        jobs = list(self.settings.get("jobs", []))
+        names = [j.get("name") for j in jobs]
+        if name in names:
+            jobs[names.index(name)] = job
+        else:
+            jobs.append(job)
+        self.settings["jobs"] = jobs
+        self.save_settings()
+        self.status_label.setText(f"Saved job \"{name}\".")
+
+    def fill_load_job_menu(self):
+        self.load_job_menu.clear()
+        for job in self.settings.get("jobs", []):
+            action = self.load_job_menu.addAction(job.get("name", ""))
+            action.triggered.connect(lambda checked, job=job: self.load_job(job))
+        if not self.settings.get("jobs"):
+            self.load_job_menu.addAction("(no jobs saved)").setEnabled(False)
+
+    def fill_delete_job_menu(self):
+        self.delete_job_menu.clear()
+        for job in self.settings.get("jobs", []):
+            action = self.delete_job_menu.addAction(job.get("name", ""))
+            action.triggered.connect(lambda checked, job=job: self.delete_job(job))
+        if not self.settings.get("jobs"):
+            self.delete_job_menu.addAction("(no jobs saved)").setEnabled(False)
+
+    def load_job(self, job):
+        # Put the job's values into the main window; Backup then runs it
+        self.entry_source.setText(job.get("source_dir", ""))
+        self.entry_destination.setText(job.get("destination_dir", ""))
+        self.combo_action.setCurrentText(job.get("action", "Sync"))
+        self.create_log = job.get("create_log", False)
+        self.log_dir = job.get("log_dir", "")
+        self.checkbox_log.setEnabled(bool(self.log_dir))
+        self.checkbox_log.setChecked(self.create_log)
+        self.verify = job.get("verify", False)
+        self.checkbox_verify.setChecked(self.verify)
+        self.status_label.setText(f"Loaded job \"{job.get('name', '')}\".")
+
+    def delete_job(self, job):
+        self.settings["jobs"] = [j for j in self.settings.get("jobs", []) if j is not job]
+        self.save_settings()
+        self.status_label.setText(f"Deleted job \"{job.get('name', '')}\".")
+
+    def run_all_jobs(self):
+        jobs = self.settings.get("jobs", [])
+        if not jobs:
+            self.status_label.setText("No jobs saved. Use Jobs > Save Current Settings as Job first.")
+            return
+        self.save_settings()
+        from backup_worker import JobsWorker
+        self.jobs_worker = JobsWorker(list(jobs), dict(self.settings), self)
+
+        dlg = QDialog(self)
+        dlg.setWindowFlags(dlg.windowFlags() & ~Qt.WindowContextHelpButtonHint)
+        dlg.setWindowTitle("Running Jobs")
+        dlg.setWindowModality(Qt.ApplicationModal)
+        dlg.resize(500, 120 + 24 * len(jobs))
+        vbox = QVBoxLayout(dlg)
+        vbox.addWidget(QLabel("Jobs on different disks run at the same time."))
+        job_labels = {}
+        grid = QGridLayout()
+        for row, job in enumerate(jobs):
+            name = job.get("name", "")
+            grid.addWidget(QLabel(name), row, 0)
+            job_labels[name] = QLabel("waiting")
+            grid.addWidget(job_labels[name], row, 1)
+        vbox.addLayout(grid)
+        cancel_btn = QPushButton("Cancel")
+        cancel_btn.setFixedWidth(120)
+        vbox.addWidget(cancel_btn, alignment=Qt.AlignRight)
+        self.jobs_dialog = dlg
+
+        def on_cancel():
+            cancel_btn.setEnabled(False)
+            self.jobs_worker.cancel()
+
+        def on_job_status(name, text):
+            if name in job_labels:
+                job_labels[name].setText(text)
+
+        cancel_btn.clicked.connect(on_cancel)
+        dlg.rejected.connect(self.jobs_worker.cancel)
+        self.jobs_worker.job_status.connect(on_job_status)
+        self.jobs_worker.done.connect(self.jobs_finished)
+        self.button_backup.setEnabled(False)
+        self.status_label.setText(f"Running {len(jobs)} jobs...")
+        dlg.show()
+        self.jobs_worker.start()
+
+    def jobs_finished(self, worker):
+        self.jobs_dialog.hide()
+        self.jobs_dialog.deleteLater()
+        self.button_backup.setEnabled(True)
+        counts = {}
+        for result in worker.results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+        summary = ", ".join(f"{n} {status}" for status, n in counts.items())
+        self.status_label.setText(f"Jobs finished: {summary}.")
 
     def menu_settings(self):
+        from pack_store import COMPRESSIONS, check_compression
         dlg = QDialog(self)
         dlg.setWindowTitle("Settings")
         dlg.setModal(True)
@@ -408,7 +880,7 @@ class BackupApp(QWidget):
         browse_btn.setFixedWidth(120)
         browse_btn.setToolTip("Select the log file location")
         def browse():
-            path, _ = QFileDialog.getSaveFileName(dlg, "Select Log File", entry.text(), "Text Files (*.txt);;All Files (*)")
+            path, _ = QFileDialog.getSaveFileName(dlg, "Select Log File", entry.text(), "JSON Lines (*.jsonl);;Text Files (*.txt);;All Files (*)")
             if path:
                 entry.setText(path)
         browse_btn.clicked.connect(browse)
@@ -417,6 +889,39 @@ class BackupApp(QWidget):
         log_row.addWidget(browse_btn)
         layout.addLayout(log_row)
 
+        # Bandwidth limit and priority (time-of-day schedules are set in settings.json)
+        throttle_row = QHBoxLayout()
+        throttle_row.addWidget(QLabel("Bandwidth limit (MB/s, 0 = none):"))
+        limit_spin = QSpinBox()
+        limit_spin.setRange(0, 100000)
+        limit_spin.setValue(int(self.settings.get("bandwidth_limit_mb", 0) or 0))
+        limit_spin.setToolTip("Total copy rate for all workers together")
+        throttle_row.addWidget(limit_spin)
+        throttle_row.addWidget(QLabel("Priority:"))
+        priority_combo = QComboBox()
+        priority_combo.addItems(["Normal", "Low", "Idle"])
+        priority_combo.setCurrentText(self.settings.get("io_priority", "normal").capitalize())
+        priority_combo.setToolTip("Low and Idle lower the CPU and disk priority of the copy threads")
+        throttle_row.addWidget(priority_combo)
+        layout.addLayout(throttle_row)
+
+        # Archive storage: snapshot folders, or small files packed into tar segments
+        archive_row = QHBoxLayout()
+        archive_row.addWidget(QLabel("Archive storage:"))
+        format_combo = QComboBox()
+        format_combo.addItems(["Snapshots", "Packed"])
+        format_combo.setCurrentText(self.settings.get("archive_format", "snapshots").capitalize())
+        format_combo.setToolTip("Packed stores small files in a few large tar files, which is much "
+                                "faster on USB and network drives; big media files are copied as they are")
+        archive_row.addWidget(format_combo)
+        archive_row.addWidget(QLabel("Compression:"))
+        compression_combo = QComboBox()
+        compression_combo.addItems(list(COMPRESSIONS))
+        compression_combo.setCurrentText(self.settings.get("pack_compression", "none"))
+        compression_combo.setToolTip("zstd and lz4 need the zstandard and lz4 packages")
+        archive_row.addWidget(compression_combo)
+        layout.addLayout(archive_row)
+
         # OK/Cancel buttons
         btn_row = QHBoxLayout()
         ok_btn = QPushButton("OK")
@@ -429,6 +934,15 @@ class BackupApp(QWidget):
 
         def accept():
             self.log_dir = entry.text()
+            self.settings["bandwidth_limit_mb"] = limit_spin.value()
+            self.settings["io_priority"] = priority_combo.currentText().lower()
+            try:
+                check_compression(compression_combo.currentText())
+            except ValueError as e:
+                QMessageBox.warning(dlg, "Compression Not Available", str(e))
+                return
+            self.settings["archive_format"] = format_combo.currentText().lower()
+            self.settings["pack_compression"] = compression_combo.currentText()
             self.save_settings()
             # Enable/disable log checkbox in main window
             if hasattr(self, 'checkbox_log'):
@@ -469,14 +983,45 @@ class BackupApp(QWidget):
         msg.exec_()
         
 
-if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    # Load stylesheet from external file
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Backup GUI")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="print startup timings as JSON on stderr once the window is shown")
+    parser.add_argument("--startup-target", type=float, default=STARTUP_TARGET_MS, metavar="MS",
+                        help=f"startup time to compare against (default: {STARTUP_TARGET_MS})")
+    parser.add_argument("--quit", action="store_true",
+                        help="with --startup-report, exit after the report; "
+                             "the exit code is 1 when startup took longer than the target")
+    # Qt takes its own options (-style and so on) from the rest
+    args, qt_args = parser.parse_known_args(argv[1:])
+    startup = StartupTimer(START_TIME)
+    startup.mark("imports")
+    app = QApplication(argv[:1] + qt_args)
+    startup.mark("qapplication")
+    # Load stylesheet from external file, next to this script
     try:
-        with open("style.qss", "r") as f:
+        with open(os.path.join(app_settings.BASE_DIR, "style.qss"), "r") as f:
             app.setStyleSheet(f.read())
     except Exception as e:
         print(f"Could not load stylesheet: {e}")
-    window = BackupApp()
+    startup.mark("stylesheet")
+    window = BackupApp(startup)
     window.show()
-    sys.exit(app.exec_())
\ No newline at end of file
+    startup.mark("show")
+
+    def first_event():
+        # Runs once the event loop has drawn the window
+        startup.mark("first_event")
+        if args.startup_report:
+            report = startup.print_report(args.startup_target)
+            if args.quit:
+                app.exit(1 if report["over_target"] else 0)
+                return
+        QTimer.singleShot(PRELOAD_DELAY_MS, preload_modules)
+    QTimer.singleShot(0, first_event)
+    return app.exec_()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,194 @@
+# app_settings.py
+#
+# settings.json handling shared by the GUI and the command line. Nothing in
+# here imports Qt, or the backup engine: the GUI loads settings before its
+# window appears, so this module only uses the standard library (and
+# throttle.py's schedule parser, which does too).
+#
+# Loaded settings are validated (values of the wrong type or out of range
+# fall back to the defaults, bandwidth_schedule entries that cannot be parsed
+# are dropped) and cached until the file changes on disk.
+# Writes go to a temporary file that replaces settings.json, so a crash
+# mid-write never leaves a truncated file, and are skipped when nothing changed.
+
+import copy
+import json
+import os
+import tempfile
+
+from throttle import parse_schedule
+
+# BASE_DIR is the directory where this script is located
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SETTINGS_FILE = os.path.join(BASE_DIR, "settings.json")
+
+# The engine defaults (backup_engine.DEFAULT_COPY_WORKERS and friends) are
+# repeated as literals so loading settings does not import the engine
+DEFAULT_SETTINGS = {
+    "window_size": [1200, 600],
+    "source_dir": "",
+    "destination_dir": "",
+    "create_log": False,
+    "log_dir": "",
+    "mirror": False,
+    "selected_action": "Sync",
+    "copy_workers": 4,
+    "large_file_workers": 1,
+    "copy_buffer_mb": 8,
+    "verify": False,
+    # Bandwidth limit and priority, see throttle.py
+    "bandwidth_limit_mb": 0,
+    "bandwidth_schedule": [],
+    "io_priority": "normal",
+    # Archive storage: "snapshots" or "packed" (see pack_store.py)
+    "archive_format": "snapshots",
+    "pack_compression": "none",
+    "pack_workers": 2,
+    # Watch mode, see watch.py
+    "watch_debounce_seconds": 5,
+    "watch_max_delay_seconds": 60,
+    "watch_poll_seconds": 60,
+    # Metrics and profiling, see metrics.py: a metrics file (".prom" for
+    # Prometheus text, JSON otherwise) and "cprofile" or "tracemalloc"
+    "metrics_file": "",
+    "profile": "",
+    "profile_file": "",
+    # Named job profiles, see jobs.py
+    "jobs": []
+}
+# Allowed values of the settings that are one of a fixed set
+CHOICES = {
+    "selected_action": ("Sync", "Copy", "Archive"),
+    "io_priority": ("normal", "low", "idle"),
+    "archive_format": ("snapshots", "packed"),
+    "pack_compression": ("none", "gzip", "zstd", "lz4"),
+    "profile": ("", "cprofile", "tracemalloc"),
+}
+# Thread counts must be whole numbers of at least 1; other numbers must not be negative
+THREAD_COUNTS = ("copy_workers", "large_file_workers", "pack_workers")
+# Mode of a newly created settings.json (existing files keep theirs)
+FILE_MODE = 0o644
+
+# {path: (mtime_ns, size, text, settings)} of the last file read or written
+cache = {}
+
+
+def is_valid(value, default):
+    if isinstance(default, bool):
+        return isinstance(value, bool)
+    if isinstance(default, (int, float)):
+        return isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+    return isinstance(value, type(default))
+
+
+def validate_settings(settings):
+    # Replace invalid values with their defaults, in place. Returns one
+    # message per value replaced.
+    problems = []
+
+    def reset(key, reason):
+        problems.append(f"{key}: {reason}, using {DEFAULT_SETTINGS[key]!r}")
+        settings[key] = copy.deepcopy(DEFAULT_SETTINGS[key])
+
+    for key, default in DEFAULT_SETTINGS.items():
+        value = settings.get(key, default)
+        if not is_valid(value, default):
+            reset(key, f"{value!r} is not valid")
+        elif key in CHOICES and value not in CHOICES[key]:
+            reset(key, f"{value!r} is not one of {', '.join(map(repr, CHOICES[key]))}")
+        elif key in THREAD_COUNTS and (not isinstance(value, int) or value < 1):
+            reset(key, f"{value!r} is not a whole number of at least 1")
+        elif key == "copy_buffer_mb" and value <= 0:
+            reset(key, "must be more than 0")
+    size = settings["window_size"]
+    if len(size) != 2 or not all(isinstance(n, int) and n > 0 for n in size):
+        reset("window_size", f"{size!r} is not [width, height]")
+    schedule = []
+    for entry in settings["bandwidth_schedule"]:
+        try:
+            parse_schedule([entry])
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            problems.append(f"bandwidth_schedule: dropped {entry!r} ({type(e).__name__}: {e})")
+            continue
+        schedule.append(entry)
+    settings["bandwidth_schedule"] = schedule
+    jobs = [job for job in settings["jobs"] if isinstance(job, dict) and isinstance(job.get("name"), str)]
+    if len(jobs) != len(settings["jobs"]):
+        problems.append(f"jobs: dropped {len(settings['jobs']) - len(jobs)} jobs without a name")
+        settings["jobs"] = jobs
+    return problems
+
+
+def load_settings(path=SETTINGS_FILE, create=True, problems=None):
+    # Read settings from path, falling back to the defaults. When the file is
+    # missing and create is set, the defaults are written out. Messages about
+    # invalid values are appended to problems, if given. Returns a copy the
+    # caller may change freely.
+    try:
+        st = os.stat(path)
+    except OSError:
+        st = None
+    if st is not None:
+        cached = cache.get(path)
+        if cached is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+            return copy.deepcopy(cached[3])
+    default_settings = copy.deepcopy(DEFAULT_SETTINGS)
+    text = None
+    if st is not None:
+        try:
+            with open(path, "r") as f:
+                text = f.read()
+            settings = json.loads(text)
+            if not isinstance(settings, dict):
+                raise ValueError("not a JSON object")
+        except Exception as e:
+            if problems is not None:
+                problems.append(f"{os.path.basename(path)} could not be read ({e}), using the defaults")
+            settings = default_settings
+            text = None
+    else:
+        settings = default_settings
+        if create:
+            save_settings(settings, path)
+    # Fill in any keys missing from older settings files
+    for key, value in default_settings.items():
+        settings.setdefault(key, value)
+    found = validate_settings(settings)
+    if problems is not None:
+        problems.extend(found)
+    if text is not None and not found:
+        cache[path] = (st.st_mtime_ns, st.st_size, text, copy.deepcopy(settings))
+    return settings
+
+
+def save_settings(settings, path=SETTINGS_FILE):
+    # Atomic write; does nothing when the file already holds these settings.
+    # Returns whether the file was written.
+    text = json.dumps(settings, indent=4)
+    cached = cache.get(path)
+    if cached is not None and cached[2] == text:
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        if st is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+            return False
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except OSError:
+        mode = FILE_MODE
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp_fp = tempfile.mkstemp(dir=folder, prefix=".settings-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        # mkstemp creates the file readable by its owner only
+        os.chmod(tmp_fp, mode)
+        os.replace(tmp_fp, path)
+    except BaseException:
+        if os.path.exists(tmp_fp):
+            os.remove(tmp_fp)
+        raise
+    st = os.stat(path)
+    cache[path] = (st.st_mtime_ns, st.st_size, text, copy.deepcopy(settings))
+    return True
@@ -0,0 +1,94 @@
+# archive_store.py
+#
+# Versioned store used by the Archive action. Before a destination file is
+# replaced or deleted it is moved into the store:
+#
+#   <destination>/.backup_archive/objects/ab/abcdef...   one file per distinct content
+#   <destination>/.backup_archive/snapshots/<timestamp>[-NN]/<rel_path>
+#
+# Every run gets a snapshot folder of its own; a run starting in the same
+# second as an earlier one adds a -02, -03, ... suffix.
+#
+# Snapshot entries are hardlinks to the objects, so a multi-GB file that is
+# archived many times with the same content only takes its space once. With
+# a manifest, when each archived version had been backed up is recorded in it
+# for the restore catalog.
+
+import errno
+import os
+import shutil
+import time
+
+from hashing import hash_file
+
+ARCHIVE_DIR_NAME = ".backup_archive"
+SNAPSHOT_TIME_FORMAT = "%Y-%m-%d_%H%M%S"
+# os.link errors meaning the filesystem cannot hardlink here (FAT/exFAT,
+# another device, too many links), as opposed to a real failure
+NO_HARDLINK_ERRNOS = {errno.EPERM, errno.EXDEV, errno.EOPNOTSUPP, errno.EMLINK,
+                      getattr(errno, "ENOTSUP", errno.EOPNOTSUPP)}
+
+
+class ArchiveStore:
+    def __init__(self, destination, manifest=None):
+        self.root = os.path.join(destination, ARCHIVE_DIR_NAME)
+        self.manifest = manifest
+        self.objects_dir = os.path.join(self.root, "objects")
+        # One snapshot directory per run, created on first use (snapshot())
+        self.snapshot_dir = None
+        self.archived = 0
+        self.bytes_archived = 0
+        self.bytes_deduplicated = 0
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def snapshot(self):
+        # This run's snapshot directory. Created with os.mkdir, which fails
+        # if it exists, so two runs never share one.
+        if self.snapshot_dir is None:
+            snapshots = os.path.join(self.root, "snapshots")
+            os.makedirs(snapshots, exist_ok=True)
+            base = time.strftime(SNAPSHOT_TIME_FORMAT)
+            name = base
+            n = 1
+            while True:
+                try:
+                    os.mkdir(os.path.join(snapshots, name))
+                    break
+                except FileExistsError:
+                    n += 1
+                    name = f"{base}-{n:02d}"
+            self.snapshot_dir = os.path.join(snapshots, name)
+        return self.snapshot_dir
+
+    def archive(self, dst_fp, rel_path):
+        # Move dst_fp out of the way into the store. Afterwards dst_fp no longer
+        # exists, so a new copy never writes into an archived inode.
+        size = os.path.getsize(dst_fp)
+        digest = hash_file(dst_fp)
+        snapshot_dir = self.snapshot()
+        if self.manifest is not None:
+            self.manifest.put_archived(os.path.basename(snapshot_dir), rel_path)
+        obj = self.object_path(digest)
+        if os.path.exists(obj):
+            os.remove(dst_fp)
+            self.bytes_deduplicated += size
+        else:
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            os.replace(dst_fp, obj)
+        snap_fp = os.path.join(snapshot_dir, rel_path)
+        os.makedirs(os.path.dirname(snap_fp), exist_ok=True)
+        try:
+            os.link(obj, snap_fp)
+        except OSError as e:
+            if e.errno not in NO_HARDLINK_ERRNOS:
+                # FileExistsError in particular: snap_fp may be a link to
+                # another object, and copying onto it would overwrite that
+                raise
+            # Filesystems without hardlinks get a full copy, into a new file only
+            with open(obj, "rb") as fsrc, open(snap_fp, "xb") as fdst:
+                shutil.copyfileobj(fsrc, fdst)
+            shutil.copystat(obj, snap_fp)
+        self.archived += 1
+        self.bytes_archived += size
@@ -0,0 +1,273 @@
+# backup_cli.py
+#
+# Headless entry point for cron jobs and servers without a display. Runs the
+# same engine as the GUI, never imports Qt, and prints one JSON line with the
+# run's statistics.
+#
+#   python backup_cli.py                        use settings.json as saved by the GUI
+#   python backup_cli.py --action Copy --source /data --destination /mnt/backup --verify
+#   python backup_cli.py --dry-run              print the action's plan as JSON lines, change nothing
+#   python backup_cli.py --all-jobs             run every job profile, one JSON line per job
+#   python backup_cli.py --watch                keep running, backing up changes as they happen
+#   python backup_cli.py --list Footage --at "2025-08-01 18:00"
+#                                               what the Footage folder in the destination held then
+#   python backup_cli.py --restore Footage --at 2025-08-01 --to /tmp/restored
+#   python backup_cli.py --metrics-file run.prom --profile cprofile
+#                                               where the time went (see metrics.py)
+#   python backup_cli.py --watch --metrics-port 9464
+#                                               Prometheus endpoint at http://127.0.0.1:9464/metrics
+
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+import app_settings
+from backup_engine import dry_run, plan_unavailable
+from catalog import Catalog, parse_time
+from jobs import ACTIONS, find_job, check_job, run_job, run_jobs
+from metrics import Metrics, MetricsServer, PROFILE_MODES
+from throttle import PRIORITIES
+from watch import watch
+
+# Exit codes
+EXIT_OK = 0
+EXIT_ERRORS = 1        # the run finished but some files failed
+EXIT_USAGE = 2         # bad arguments or folders
+EXIT_FAILED = 3        # the run stopped with an exception
+EXIT_CANCELLED = 130   # interrupted (Ctrl+C / SIGTERM)
+
+STATUS_EXIT_CODES = {
+    "ok": EXIT_OK,
+    "errors": EXIT_ERRORS,
+    "usage": EXIT_USAGE,
+    "failed": EXIT_FAILED,
+    "cancelled": EXIT_CANCELLED,
+}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Run a backup without the GUI.")
+    parser.add_argument("--settings", default=app_settings.SETTINGS_FILE,
+                        help="settings file to read (default: settings.json next to this script)")
+    parser.add_argument("--action", choices=ACTIONS, help="overrides selected_action")
+    parser.add_argument("--source", help="overrides source_dir")
+    parser.add_argument("--destination", help="overrides destination_dir")
+    parser.add_argument("--log", help="log file path; overrides log_dir and enables logging")
+    parser.add_argument("--no-log", action="store_true", help="do not write a log file")
+    parser.add_argument("--workers", type=int, help="overrides copy_workers")
+    parser.add_argument("--verify", dest="verify", action="store_true", default=None,
+                        help="verify copies by hash")
+    parser.add_argument("--no-verify", dest="verify", action="store_false")
+    parser.add_argument("--limit-mb", type=float,
+                        help="bandwidth limit in MB/s, 0 = none; overrides bandwidth_limit_mb")
+    parser.add_argument("--priority", choices=PRIORITIES, help="overrides io_priority")
+    parser.add_argument("--job", action="append",
+                        help="run the named job from settings.json (repeatable)")
+    parser.add_argument("--all-jobs", action="store_true",
+                        help="run every job in settings.json; jobs on different disks run at once")
+    parser.add_argument("--watch", action="store_true",
+                        help="after a full run, keep backing up changed files until interrupted")
+    parser.add_argument("--metrics-file",
+                        help="write run metrics here (.prom: Prometheus text, otherwise JSON); "
+                             "overrides metrics_file")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve live metrics at http://127.0.0.1:PORT/metrics while running")
+    parser.add_argument("--profile", choices=PROFILE_MODES,
+                        help="capture a cProfile or tracemalloc report of the run")
+    parser.add_argument("--profile-file", help="where to write the profile (default: temp folder)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="print what the action would do, one JSON line per operation "
+                             "(not available for packed Archive)")
+    browse = parser.add_mutually_exclusive_group()
+    browse.add_argument("--list", metavar="FOLDER",
+                        help="list a destination folder (\"\" for the top), one JSON line per entry")
+    browse.add_argument("--search", metavar="GLOB",
+                        help="find destination files whose path matches GLOB, e.g. \"Footage/*.mov\"")
+    browse.add_argument("--versions", metavar="PATH", help="list every stored version of one file")
+    browse.add_argument("--restore", metavar="PATH",
+                        help="restore a file or folder from the destination into --to")
+    parser.add_argument("--at", help="time for --list, --search and --restore, "
+                                     "\"YYYY-MM-DD [HH:MM[:SS]]\" (default: now)")
+    parser.add_argument("--to", help="folder to restore into")
+    return parser.parse_args(argv)
+
+
+def build_settings(args):
+    problems = []
+    settings = app_settings.load_settings(args.settings, create=False, problems=problems)
+    # stdout is kept for the JSON results
+    for problem in problems:
+        print(f"settings: {problem}", file=sys.stderr)
+    if args.action:
+        settings["selected_action"] = args.action
+    if args.source:
+        settings["source_dir"] = args.source
+    if args.destination:
+        settings["destination_dir"] = args.destination
+    if args.log:
+        settings["log_dir"] = args.log
+        settings["create_log"] = True
+    if args.no_log:
+        settings["create_log"] = False
+    if args.workers is not None:
+        settings["copy_workers"] = args.workers
+    if args.verify is not None:
+        settings["verify"] = args.verify
+    if args.limit_mb is not None:
+        settings["bandwidth_limit_mb"] = args.limit_mb
+    if args.priority:
+        settings["io_priority"] = args.priority
+    if args.metrics_file:
+        settings["metrics_file"] = args.metrics_file
+    if args.profile:
+        settings["profile"] = args.profile
+    if args.profile_file:
+        settings["profile_file"] = args.profile_file
+    return settings
+
+
+def print_result(result):
+    print(json.dumps(result), flush=True)
+
+
+def exit_code(result):
+    return STATUS_EXIT_CODES.get(result.get("status"), EXIT_FAILED)
+
+
+def browse(args, settings, cancel_event):
+    # --list, --search, --versions and --restore, on the destination's catalog
+    destination_folder = settings["destination_dir"]
+    result = {"destination": destination_folder}
+    try:
+        at = parse_time(args.at) if args.at else None
+    except ValueError as e:
+        result.update(status="usage", error=str(e))
+        print_result(result)
+        return EXIT_USAGE
+    if args.restore is not None and not args.to:
+        result.update(status="usage", error="--restore needs --to")
+        print_result(result)
+        return EXIT_USAGE
+    if not destination_folder or not os.path.isdir(destination_folder):
+        result.update(status="usage",
+                      error=f"The destination folder does not exist: {destination_folder}")
+        print_result(result)
+        return EXIT_USAGE
+    start = time.monotonic()
+    catalog = Catalog(destination_folder)
+    try:
+        result["indexed"] = catalog.refresh()
+        if args.list is not None:
+            folder = os.path.normpath(args.list) if args.list else ""
+            subfolders, files = catalog.list_dir(folder, at)
+            for path in subfolders:
+                print_result({"path": path, "kind": "folder"})
+            for entry in files:
+                print_result(entry)
+            result["entries"] = len(subfolders) + len(files)
+        elif args.search is not None:
+            entries = catalog.search(args.search, at)
+            for entry in entries:
+                print_result(entry)
+            result["entries"] = len(entries)
+        elif args.versions is not None:
+            entries = catalog.versions(os.path.normpath(args.versions))
+            for entry in entries:
+                print_result(entry)
+            result["entries"] = len(entries)
+        else:
+            path = os.path.normpath(args.restore) if args.restore else ""
+            entries = catalog.subtree(path, at)
+            errors = catalog.restore(entries, args.to, strip=path, cancel_event=cancel_event)
+            for error in errors:
+                print_result({"error": error})
+            result.update(restored=len(entries) - len(errors), errors=len(errors))
+            if not entries:
+                result.update(status="usage", error=f"Nothing to restore at {path or 'the top'}")
+    finally:
+        catalog.close()
+    result["seconds"] = round(time.monotonic() - start, 3)
+    if "status" not in result:
+        if cancel_event.is_set():
+            result["status"] = "cancelled"
+        else:
+            result["status"] = "errors" if result.get("errors") else "ok"
+    print_result(result)
+    return exit_code(result)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    settings = build_settings(args)
+
+    # Ctrl+C and SIGTERM stop the run between files, like the GUI's Cancel button
+    cancel_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: cancel_event.set())
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, lambda signum, frame: cancel_event.set())
+
+    if any(value is not None for value in (args.list, args.search, args.versions, args.restore)):
+        return browse(args, settings, cancel_event)
+
+    if args.job or args.all_jobs:
+        names = [job.get("name") for job in settings.get("jobs", [])] if args.all_jobs else args.job
+        jobs = []
+        for name in names:
+            job = find_job(settings, name)
+            if job is None:
+                print_result({"job": name, "status": "usage", "error": f"No job named {name}"})
+                return EXIT_USAGE
+            jobs.append(job)
+        # Command-line overrides apply to every job, except for keys the job sets itself
+        results = run_jobs(jobs, settings, cancel_event, on_result=lambda job, r: print_result(r))
+        return max((exit_code(r) for r in results), default=EXIT_OK)
+
+    if args.dry_run:
+        result = {"action": settings["selected_action"], "source": settings["source_dir"],
+                  "destination": settings["destination_dir"]}
+        error = check_job(settings) or plan_unavailable(settings["selected_action"], settings)
+        if error:
+            result.update(status="usage", error=error)
+            print_result(result)
+            return EXIT_USAGE
+        start = time.monotonic()
+        counts = dry_run(settings["source_dir"], settings["destination_dir"], cancel_event,
+                         lambda op, rel_path: print_result({"op": op, "path": rel_path}),
+                         settings["selected_action"], settings)
+        result.update(status="cancelled" if cancel_event.is_set() else "ok", dry_run=True,
+                      plan=counts, seconds=round(time.monotonic() - start, 3))
+        print_result(result)
+        return exit_code(result)
+
+    metrics = None
+    server = None
+    if args.metrics_port is not None:
+        metrics = Metrics()
+        try:
+            server = MetricsServer(metrics, args.metrics_port)
+        except OSError as e:
+            print_result({"status": "usage", "error": f"Cannot serve metrics on port "
+                                                      f"{args.metrics_port}: {e}"})
+            return EXIT_USAGE
+    try:
+        if args.watch:
+            # One JSON line per run; stopping with Ctrl+C/SIGTERM is the normal end
+            result = watch(settings, cancel_event, print_result, metrics=metrics)
+            if result["status"] == "cancelled":
+                return EXIT_OK
+            return exit_code(result)
+
+        result = run_job(settings, cancel_event, metrics=metrics)
+        print_result(result)
+        return exit_code(result)
+    finally:
+        if server is not None:
+            server.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1010 @@
+# backup_engine.py
+#
+# Backup logic that does not depend on Qt. BackupQT.py drives it from the GUI.
+
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from archive_store import ArchiveStore, ARCHIVE_DIR_NAME
+from fastcopy import (
+    copy_file, CopyInterrupted, DEFAULT_BUFFER_SIZE, PARTIAL_SUFFIX, CHECKPOINT_SUFFIX
+)
+from hashing import new_hasher, hash_file, drop_cache, VerifyError
+from metrics import NULL_METRICS
+from pack_store import (
+    PackStore, pack_segment, PACK_DIR_NAME, PACK_FILE_LIMIT, SEGMENT_BYTES, DEFAULT_PACK_WORKERS
+)
+from throttle import Throttle
+
+# Manifest stored in the root of every Copy destination
+MANIFEST_NAME = ".backup_manifest.db"
+# Restore catalog (see catalog.py), also in the destination root
+CATALOG_NAME = ".backup_catalog.db"
+# Bookkeeping entries in a destination root that are never treated as backed-up
+# files. Also skipped at the source root, so backing up a backup destination
+# (backup drive to offsite drive) never copies them over the target's own.
+DESTINATION_EXCLUDE = {MANIFEST_NAME, MANIFEST_NAME + "-journal", ARCHIVE_DIR_NAME, PACK_DIR_NAME,
+                       CATALOG_NAME, CATALOG_NAME + "-journal"}
+# Commit the manifest every this many files, or this many seconds, so an
+# interrupted run keeps its progress and the next one skips finished files
+MANIFEST_COMMIT_EVERY = 500
+MANIFEST_COMMIT_SECONDS = 5.0
+# Parallel copy defaults; overridden by "copy_workers" / "large_file_workers" in settings.json
+DEFAULT_COPY_WORKERS = 4
+DEFAULT_LARGE_FILE_WORKERS = 1
+# Buffer for the buffered copy fallback; overridden by "copy_buffer_mb" in settings.json
+DEFAULT_BUFFER_MB = DEFAULT_BUFFER_SIZE // (1024 * 1024)
+# Files at least this big go to the large-file pool
+LARGE_FILE_SIZE = 256 * 1024 * 1024
+# Space a file takes in a tar segment besides its data (header and padding)
+TAR_HEADER_BYTES = 1024
+# Scanned paths handed to the pack index at once, for packed Archive's deletion check
+SEEN_BATCH = 1000
+
+
+class Manifest:
+    # Per-destination record of the source size, mtime and inode of every
+    # file that was copied there, keyed by the path relative to the destination,
+    # and when it was (seconds since the epoch, for the restore catalog).
+    def __init__(self, destination):
+        self.path = os.path.join(destination, MANIFEST_NAME)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, "
+            "backed_up_at REAL) WITHOUT ROWID"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(files)")]
+        if "backed_up_at" not in columns:
+            # Manifests from before backed_up_at; their rows keep NULL
+            self.conn.execute("ALTER TABLE files ADD COLUMN backed_up_at REAL")
+        # When each version moved into an Archive snapshot had been backed up,
+        # and when it was moved
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS archived ("
+            "snapshot TEXT, path TEXT, backed_up_at REAL, archived_at REAL, "
+            "PRIMARY KEY (snapshot, path)) WITHOUT ROWID"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(archived)")]
+        if "archived_at" not in columns:
+            self.conn.execute("ALTER TABLE archived ADD COLUMN archived_at REAL")
+        # Hash cache for verify mode, keyed by absolute path of source or destination
+        # files; an entry is only valid while size and mtime still match.
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT"
+            ") WITHOUT ROWID"
+        )
+        self.pending = 0
+        self.last_commit = time.monotonic()
+
+    def get(self, rel_path):
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, inode FROM files WHERE path = ?", (rel_path,)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def put(self, rel_path, st):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, backed_up_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (rel_path, st.st_size, st.st_mtime_ns, st.st_ino, time.time()),
+        )
+        self.pending += 1
+        if (self.pending >= MANIFEST_COMMIT_EVERY
+                or time.monotonic() - self.last_commit >= MANIFEST_COMMIT_SECONDS):
+            self.commit()
+
+    def get_hash(self, path, st):
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, digest FROM hashes WHERE path = ?", (path,)
+        ).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        return None
+
+    def put_hash(self, path, st, digest):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO hashes (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+            (path, st.st_size, st.st_mtime_ns, digest),
+        )
+        self.pending += 1
+
+    def delete(self, rel_path):
+        self.conn.execute("DELETE FROM files WHERE path = ?", (rel_path,))
+        self.pending += 1
+
+    def put_archived(self, snapshot, rel_path):
+        # Called by ArchiveStore as rel_path's current version moves into snapshot
+        self.conn.execute(
+            "INSERT OR REPLACE INTO archived (snapshot, path, backed_up_at, archived_at) "
+            "VALUES (?, ?, (SELECT backed_up_at FROM files WHERE path = ?), ?)",
+            (snapshot, rel_path, rel_path, time.time()),
+        )
+        self.pending += 1
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+        self.last_commit = time.monotonic()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+class CopyStats:
+    def __init__(self):
+        self.copied = 0
+        self.skipped = 0
+        self.bytes_copied = 0
+        self.bytes_skipped = 0
+        self.errors = []
+        self.cancelled = False
+        # Number of files copied with each fastcopy method, e.g. {"reflink": 12}
+        self.methods = {}
+        # Verify mode only: files whose destination hash was checked, and how
+        # many of those had to be read because the hash cache was stale
+        self.verified = 0
+        self.hashed = 0
+        self.verify_failures = 0
+        # Sync and Archive: destination files removed (Archive moves them into its store)
+        self.deleted = 0
+        # Archive action only
+        self.archived = 0
+        self.bytes_deduplicated = 0
+        # Packed Archive only: segments written and the bytes packed into them
+        self.segments = 0
+        self.bytes_packed = 0
+
+    def as_dict(self):
+        return {
+            "copied": self.copied,
+            "skipped": self.skipped,
+            "bytes_copied": self.bytes_copied,
+            "bytes_skipped": self.bytes_skipped,
+            "errors": len(self.errors),
+            "cancelled": self.cancelled,
+            "deleted": self.deleted,
+            "archived": self.archived,
+            "bytes_deduplicated": self.bytes_deduplicated,
+            "segments": self.segments,
+            "bytes_packed": self.bytes_packed,
+            "methods": dict(self.methods),
+            "verified": self.verified,
+            "hashed": self.hashed,
+        }
+
+    @property
+    def files_done(self):
+        # A file that failed verification was already counted as skipped
+        return self.copied + self.skipped + len(self.errors) - self.verify_failures
+
+
+def format_bytes(num):
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if num < 1024 or unit == "TB":
+            return f"{num:.0f} {unit}" if unit == "B" else f"{num:.1f} {unit}"
+        num /= 1024
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+def iter_files(root, cancel_event=None, exclude=(), on_error=None):
+    # Yield the path, relative to root, of every file under root. Uses an
+    # explicit stack of directories so memory grows with the tree's breadth,
+    # not its file count. Like os.walk, symlinked directories are not followed
+    # and unreadable directories are skipped; on_error(rel_dir, exception) is
+    # called for those (not for directories that vanished during the scan).
+    # Top-level names in exclude are ignored.
+    stack = [""]
+    while stack:
+        if cancel_event is not None and cancel_event.is_set():
+            return
+        rel_dir = stack.pop()
+        try:
+            it = os.scandir(os.path.join(root, rel_dir))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        except OSError as e:
+            if on_error is not None:
+                on_error(rel_dir, e)
+            continue
+        with it:
+            for entry in it:
+                if not rel_dir and entry.name in exclude:
+                    continue
+                rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                if is_dir:
+                    if not entry.is_symlink():
+                        stack.append(rel_path)
+                else:
+                    yield rel_path
+
+
+def scan_source(source_folder, destination_folder, cancel_event=None):
+    # Yield (src_fp, dst_fp, rel_path) for every file under source_folder
+    for rel_path in iter_files(source_folder, cancel_event, DESTINATION_EXCLUDE):
+        yield (os.path.join(source_folder, rel_path),
+               os.path.join(destination_folder, rel_path),
+               rel_path)
+
+
+def count_files(source_folder, cancel_event=None):
+    return sum(1 for _ in iter_files(source_folder, cancel_event, DESTINATION_EXCLUDE))
+
+
+def is_unchanged(entry, src_st, dst_fp, dst_st=None):
+    # A file is unchanged when its source stat matches the manifest and the
+    # destination copy is still there with the same size.
+    if dst_st is None:
+        try:
+            dst_st = os.stat(dst_fp)
+        except OSError:
+            return False
+    if dst_st.st_size != src_st.st_size:
+        return False
+    if entry is not None:
+        return entry == (src_st.st_size, src_st.st_mtime_ns, src_st.st_ino)
+    # No manifest entry yet (first run or a destination filled by an older
+    # version): copy2 preserves mtime, so a matching mtime means it is current.
+    return dst_st.st_mtime_ns == src_st.st_mtime_ns
+
+
+class DirMaker:
+    # Creates each destination directory once instead of checking it per file
+    def __init__(self):
+        self.made = set()
+
+    def ensure(self, dst_dir):
+        if dst_dir not in self.made:
+            os.makedirs(dst_dir, exist_ok=True)
+            self.made.add(dst_dir)
+
+
+def copy_job(src_fp, dst_fp, buffer_size, verify, cancel_event=None, throttle=None):
+    # Runs on a pool thread. Returns (method, digest); digest is None unless verifying.
+    if not verify:
+        return copy_file(src_fp, dst_fp, buffer_size, cancel_event=cancel_event,
+                         throttle=throttle), None
+    # Hash the source on the same read pass as the copy, then read the
+    # destination back from disk and compare
+    hasher = new_hasher()
+    method = copy_file(src_fp, dst_fp, buffer_size, hasher, cancel_event, throttle)
+    digest = hasher.hexdigest()
+    drop_cache(dst_fp)
+    if hash_file(dst_fp, throttle=throttle) != digest:
+        raise VerifyError("destination content does not match source after copy")
+    return method, digest
+
+
+def timed_job(job, *args):
+    # Runs job on a pool thread and adds how long it took to its result
+    start = time.perf_counter()
+    method, digest = job(*args)
+    return method, digest, time.perf_counter() - start
+
+
+def verify_job(src_fp, dst_fp, src_digest, dst_digest, throttle=None):
+    # Runs on a pool thread for files skipped as unchanged. Either digest is
+    # None when the hash cache had no current entry for that file.
+    if src_digest is None:
+        src_digest = hash_file(src_fp, throttle=throttle)
+    if dst_digest is None:
+        dst_digest = hash_file(dst_fp, throttle=throttle)
+    if src_digest != dst_digest:
+        raise VerifyError("destination content does not match source")
+    return None, src_digest
+
+
+def copy_files(files_to_copy, destination_folder, on_progress=None, cancel_event=None,
+               workers=DEFAULT_COPY_WORKERS, large_workers=DEFAULT_LARGE_FILE_WORKERS,
+               on_file=None, before_replace=None, buffer_size=DEFAULT_BUFFER_SIZE,
+               verify=False, stats=None, manifest=None, throttle=None, metrics=None):
+    # Copy only new or changed files. files_to_copy is any iterable of
+    # (src_fp, dst_fp, rel_path), normally the scan_source generator, so copying
+    # starts while the scan is still running.
+    # on_progress(stats) is called after every file; callers throttle it themselves.
+    # on_file(src_fp, dst_fp, error, method, size, seconds) is called for every
+    # file copied or failed (error is None on success, method is the fastcopy
+    # method used, seconds the time spent copying); skipped files are only counted.
+    # Setting cancel_event stops the run between files; copies already running
+    # stop at their next chunk and are resumed by the next run (see fastcopy).
+    # before_replace(dst_fp, rel_path), if given, is called before an existing
+    # destination file is overwritten (used by the Archive action).
+    # With verify, copied files are hashed while copying and checked against
+    # the destination, and unchanged files are checked using the hash cache.
+    # stats and manifest may be passed in by callers that also use them while
+    # files_to_copy is being consumed (see sync_files); a passed manifest is not closed.
+    # throttle (see throttle.py) limits the bytes per second of all copies and
+    # hashing together and sets the priority of the pool threads.
+    # metrics (see metrics.py) records where the time goes.
+    #
+    # The manifest and stats are only touched on the calling thread. Copies run
+    # on two pools: one for small files and one for files of LARGE_FILE_SIZE or
+    # more, so a single huge clip never holds up the small-file queue.
+    if stats is None:
+        stats = CopyStats()
+    if metrics is None:
+        metrics = NULL_METRICS
+    own_manifest = manifest is None
+    if own_manifest:
+        manifest = Manifest(destination_folder)
+    dirs = DirMaker()
+    initializer = throttle.enter_thread if throttle is not None else None
+    small_pool = ThreadPoolExecutor(max_workers=max(1, workers), initializer=initializer)
+    large_pool = ThreadPoolExecutor(max_workers=max(1, large_workers), initializer=initializer)
+    max_in_flight = max(1, workers) * 4 + max(1, large_workers)
+    in_flight = {}
+
+    def progress():
+        if on_progress:
+            metrics.enter("progress")
+            on_progress(stats)
+            metrics.leave()
+
+    def finish(future):
+        src_fp, dst_fp, rel_path, src_st, is_copy = in_flight.pop(future)
+        try:
+            method, digest, seconds = future.result()
+            metrics.observe("copy" if is_copy else "verify", seconds, src_st.st_size)
+            if digest is not None:
+                stats.verified += 1
+                manifest.put_hash(src_fp, src_st, digest)
+                manifest.put_hash(dst_fp, os.stat(dst_fp), digest)
+            if not is_copy:
+                return
+            manifest.put(rel_path, src_st)
+            stats.copied += 1
+            stats.bytes_copied += src_st.st_size
+            stats.methods[method] = stats.methods.get(method, 0) + 1
+            error = None
+        except CopyInterrupted:
+            # Cancelled part-way; the file resumes from its checkpoint next run
+            stats.cancelled = True
+            return
+        except Exception as e:
+            method = None if is_copy else "verify"
+            seconds = 0.0
+            error = e
+            stats.errors.append(f"{src_fp} -> {dst_fp}: {e}")
+            metrics.observe("error")
+            if not is_copy:
+                stats.verify_failures += 1
+            if isinstance(e, VerifyError):
+                # Make sure the next run copies this file again
+                manifest.delete(rel_path)
+        if on_file:
+            on_file(src_fp, dst_fp, error, method, src_st.st_size, seconds)
+        progress()
+
+    def submit(job, size, src_info, *args):
+        pool = large_pool if size >= LARGE_FILE_SIZE else small_pool
+        in_flight[pool.submit(timed_job, job, *args)] = src_info
+        metrics.queue(len(in_flight))
+
+    def drain(return_when):
+        metrics.enter("wait")
+        done, _ = wait(list(in_flight), return_when=return_when)
+        metrics.leave()
+        metrics.enter("manifest")
+        for future in done:
+            finish(future)
+        metrics.leave()
+        metrics.queue(len(in_flight))
+
+    try:
+        for src_fp, dst_fp, rel_path in metrics.timed(files_to_copy, "scan"):
+            if cancel_event is not None and cancel_event.is_set():
+                stats.cancelled = True
+                break
+            if len(in_flight) >= max_in_flight:
+                drain(FIRST_COMPLETED)
+            metrics.enter("stat")
+            try:
+                src_st = os.stat(src_fp)
+                entry = manifest.get(rel_path)
+                if is_unchanged(entry, src_st, dst_fp):
+                    stats.skipped += 1
+                    stats.bytes_skipped += src_st.st_size
+                    metrics.observe("skip", 0.0, src_st.st_size)
+                    if entry is None:
+                        manifest.put(rel_path, src_st)
+                    progress()
+                    if verify:
+                        src_digest = manifest.get_hash(src_fp, src_st)
+                        dst_digest = manifest.get_hash(dst_fp, os.stat(dst_fp))
+                        if src_digest is not None and src_digest == dst_digest:
+                            # Both hashes cached and still current: nothing to read
+                            stats.verified += 1
+                        else:
+                            stats.hashed += 1
+                            submit(verify_job, src_st.st_size,
+                                   (src_fp, dst_fp, rel_path, src_st, False),
+                                   src_fp, dst_fp, src_digest, dst_digest, throttle)
+                    continue
+                if before_replace is not None and os.path.lexists(dst_fp):
+                    metrics.switch("archive")
+                    before_replace(dst_fp, rel_path)
+                metrics.switch("mkdir")
+                dirs.ensure(os.path.dirname(dst_fp))
+            except Exception as e:
+                stats.errors.append(f"{src_fp} -> {dst_fp}: {e}")
+                metrics.observe("error")
+                if on_file:
+                    on_file(src_fp, dst_fp, e, None, 0, 0.0)
+                progress()
+                continue
+            finally:
+                metrics.leave()
+            if verify:
+                stats.hashed += 1
+            submit(copy_job, src_st.st_size, (src_fp, dst_fp, rel_path, src_st, True),
+                   src_fp, dst_fp, buffer_size, verify, cancel_event, throttle)
+        # Files already handed to the pools are finished even when cancelled
+        while in_flight:
+            drain(FIRST_COMPLETED)
+    finally:
+        small_pool.shutdown(wait=True)
+        large_pool.shutdown(wait=True)
+        if own_manifest:
+            manifest.close()
+    return stats
+
+
+def list_dir(path, exclude=()):
+    # Map name -> DirEntry for one directory; a missing directory is empty.
+    # None when the directory exists but cannot be read (permissions, I/O
+    # error, a share that went away): that is not the same as empty.
+    try:
+        with os.scandir(path) as it:
+            return {entry.name: entry for entry in it if entry.name not in exclude}
+    except (FileNotFoundError, NotADirectoryError):
+        return {}
+    except OSError:
+        return None
+
+
+def is_real_dir(entry):
+    try:
+        return entry.is_dir() and not entry.is_symlink()
+    except OSError:
+        return False
+
+
+def is_partial_of(name, src_entries):
+    for suffix in (CHECKPOINT_SUFFIX, PARTIAL_SUFFIX):
+        if name.endswith(suffix):
+            return name[:-len(suffix)] in src_entries
+    return False
+
+
+def plan_tree_removal(destination_folder, rel_dir):
+    # Delete ops for everything under rel_dir, deepest first, then the dir itself
+    root = os.path.join(destination_folder, rel_dir)
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        rel_base = os.path.relpath(dirpath, destination_folder)
+        for name in filenames:
+            yield "delete", os.path.join(rel_base, name)
+        for name in dirnames:
+            # Symlinked directories are not walked; remove the link itself
+            if os.path.islink(os.path.join(dirpath, name)):
+                yield "delete", os.path.join(rel_base, name)
+        yield "rmdir", rel_base
+
+
+def plan_sync(source_folder, destination_folder, manifest=None, cancel_event=None):
+    # Walk both trees together, one directory at a time, and yield
+    # (op, rel_path) for everything needed to make destination mirror source:
+    #
+    #   "mkdir"   directory missing at the destination
+    #   "create"  file missing at the destination
+    #   "update"  file that differs (same rule as Copy's is_unchanged)
+    #   "same"    file already up to date
+    #   "delete"  destination file not in the source
+    #   "rmdir"   destination directory not in the source (after its contents)
+    #   "error"   directory that could not be read on either side; nothing
+    #             under it is planned, so in particular nothing is deleted
+    #
+    # Each directory is listed once on each side, so nothing is looked up per
+    # file and memory stays proportional to the largest single directory.
+    # Within a directory deletions come first, so a file replaced by a folder
+    # of the same name (or the reverse) is cleared before it is recreated.
+    stack = [""]
+    while stack:
+        if cancel_event is not None and cancel_event.is_set():
+            return
+        rel_dir = stack.pop()
+        src_dir = os.path.join(source_folder, rel_dir)
+        dst_dir = os.path.join(destination_folder, rel_dir)
+        src_entries = list_dir(src_dir, DESTINATION_EXCLUDE if not rel_dir else ())
+        dst_entries = list_dir(dst_dir, DESTINATION_EXCLUDE if not rel_dir else ())
+        if src_entries is None or dst_entries is None:
+            yield "error", rel_dir
+            continue
+
+        for name in sorted(dst_entries):
+            if is_partial_of(name, src_entries):
+                # An interrupted copy that the next copy of that file resumes
+                continue
+            rel_path = os.path.join(rel_dir, name) if rel_dir else name
+            dst_is_dir = is_real_dir(dst_entries[name])
+            src_entry = src_entries.get(name)
+            if src_entry is not None and is_real_dir(src_entry) == dst_is_dir:
+                continue
+            if src_entry is not None and src_entry.is_symlink() and src_entry.is_dir():
+                # Symlinked source directories are never copied; leave the destination alone
+                continue
+            if dst_is_dir:
+                yield from plan_tree_removal(destination_folder, rel_path)
+            else:
+                yield "delete", rel_path
+
+        for name in sorted(src_entries):
+            src_entry = src_entries[name]
+            rel_path = os.path.join(rel_dir, name) if rel_dir else name
+            if src_entry.is_symlink() and src_entry.is_dir():
+                continue
+            if is_real_dir(src_entry):
+                dst_entry = dst_entries.get(name)
+                if dst_entry is None or not is_real_dir(dst_entry):
+                    yield "mkdir", rel_path
+                stack.append(rel_path)
+                continue
+            dst_entry = dst_entries.get(name)
+            if dst_entry is None or is_real_dir(dst_entry):
+                yield "create", rel_path
+                continue
+            try:
+                src_st = os.stat(src_entry.path)
+                dst_st = os.stat(dst_entry.path)
+            except OSError:
+                yield "update", rel_path
+                continue
+            entry = manifest.get(rel_path) if manifest is not None else None
+            if is_unchanged(entry, src_st, dst_entry.path, dst_st):
+                yield "same", rel_path
+            else:
+                yield "update", rel_path
+
+
+def plan_changes(source_folder, destination_folder, rel_paths, deletions=True):
+    # Like plan_sync, but only for rel_paths (changed paths reported by
+    # watch.py) and what is under them; nothing else is listed or compared.
+    # Paths inside a changed directory are covered by that directory, and
+    # bookkeeping entries at the source root are ignored. Files
+    # are always "update"; copy_files still skips the ones that are unchanged.
+    # Without deletions (Copy) only "mkdir" and "update" are yielded.
+    covered = set()
+    for rel_path in sorted(rel_paths):
+        parent = os.path.dirname(rel_path)
+        while parent and parent not in covered:
+            parent = os.path.dirname(parent)
+        if parent or rel_path.split(os.sep, 1)[0] in DESTINATION_EXCLUDE:
+            continue
+        src_fp = os.path.join(source_folder, rel_path)
+        dst_fp = os.path.join(destination_folder, rel_path)
+        dst_is_dir = os.path.isdir(dst_fp) and not os.path.islink(dst_fp)
+        if os.path.isdir(src_fp):
+            if os.path.islink(src_fp):
+                # Symlinked source directories are never copied
+                continue
+            covered.add(rel_path)
+            if deletions and os.path.lexists(dst_fp) and not dst_is_dir:
+                yield "delete", rel_path
+            yield "mkdir", rel_path
+            for sub_path in iter_files(src_fp):
+                yield "update", os.path.join(rel_path, sub_path)
+        elif os.path.lexists(src_fp):
+            if deletions and dst_is_dir:
+                yield from plan_tree_removal(destination_folder, rel_path)
+            yield "update", rel_path
+        elif deletions:
+            if dst_is_dir:
+                yield from plan_tree_removal(destination_folder, rel_path)
+            elif os.path.lexists(dst_fp):
+                yield "delete", rel_path
+
+
+def sync_files(source_folder, destination_folder, on_progress=None, cancel_event=None,
+               workers=DEFAULT_COPY_WORKERS, large_workers=DEFAULT_LARGE_FILE_WORKERS,
+               on_file=None, buffer_size=DEFAULT_BUFFER_SIZE, verify=False,
+               on_delete=None, before_replace=None, throttle=None, plan=None, metrics=None,
+               manifest=None):
+    # Make destination an exact mirror of source by running plan_sync. File
+    # copies go through copy_files (parallel pools, manifest, verify, progress);
+    # deletions and directory changes are applied on this thread as the plan
+    # is read, before any copy that depends on them is queued.
+    # on_delete(dst_fp, rel_path) replaces the plain os.remove for deleted
+    # files (the Archive action moves them into its store). Deletions are also
+    # reported to on_file, with src_fp None and method "delete".
+    # plan, if given, replaces the full plan_sync walk (see plan_changes).
+    # A manifest passed in (archive_files shares it with its ArchiveStore) is
+    # not closed.
+    stats = CopyStats()
+    own_manifest = manifest is None
+    if own_manifest:
+        manifest = Manifest(destination_folder)
+    if metrics is None:
+        metrics = NULL_METRICS
+
+    def files_from_plan():
+        if plan is None:
+            ops = plan_sync(source_folder, destination_folder, manifest, cancel_event)
+        else:
+            ops = plan
+        for op, rel_path in ops:
+            dst_fp = os.path.join(destination_folder, rel_path)
+            if op in ("create", "update", "same"):
+                yield os.path.join(source_folder, rel_path), dst_fp, rel_path
+                continue
+            metrics.enter("mkdir" if op == "mkdir" else "delete")
+            try:
+                if op == "delete":
+                    if on_delete is not None and not os.path.islink(dst_fp):
+                        on_delete(dst_fp, rel_path)
+                    else:
+                        os.remove(dst_fp)
+                    manifest.delete(rel_path)
+                    stats.deleted += 1
+                    metrics.observe("delete")
+                    if on_file:
+                        on_file(None, dst_fp, None, "delete", 0, 0.0)
+                elif op == "rmdir":
+                    os.rmdir(dst_fp)
+                elif op == "mkdir":
+                    os.makedirs(dst_fp, exist_ok=True)
+                elif op == "error":
+                    raise OSError(f"could not read {os.path.join(source_folder, rel_path)} or its "
+                                  f"destination folder; nothing under it was synced or deleted")
+            except Exception as e:
+                stats.errors.append(f"{dst_fp}: {e}")
+                metrics.observe("error")
+                if on_file:
+                    on_file(None, dst_fp, e, op, 0, 0.0)
+            finally:
+                metrics.leave()
+
+    try:
+        copy_files(files_from_plan(), destination_folder, on_progress, cancel_event,
+                   workers, large_workers, on_file, before_replace, buffer_size, verify,
+                   stats=stats, manifest=manifest, throttle=throttle, metrics=metrics)
+    finally:
+        if own_manifest:
+            manifest.close()
+    return stats
+
+
+def archive_files(source_folder, destination_folder, on_progress=None, cancel_event=None,
+                  workers=DEFAULT_COPY_WORKERS, large_workers=DEFAULT_LARGE_FILE_WORKERS,
+                  on_file=None, buffer_size=DEFAULT_BUFFER_SIZE, verify=False, throttle=None,
+                  plan=None, metrics=None):
+    # Mirror source to destination like Sync, but every destination file that
+    # is replaced or deleted is first moved into the ArchiveStore.
+    manifest = Manifest(destination_folder)
+    store = ArchiveStore(destination_folder, manifest)
+    try:
+        stats = sync_files(
+            source_folder, destination_folder, on_progress, cancel_event, workers, large_workers,
+            on_file, buffer_size, verify, on_delete=store.archive, before_replace=store.archive,
+            throttle=throttle, plan=plan, metrics=metrics, manifest=manifest,
+        )
+    finally:
+        manifest.close()
+    stats.archived = store.archived
+    stats.bytes_deduplicated = store.bytes_deduplicated
+    return stats
+
+
+def timed_pack(segment_fp, compression, batch, cancel_event, throttle):
+    # Runs pack_segment on a pool thread and adds how long it took
+    start = time.perf_counter()
+    rows, errors = pack_segment(segment_fp, compression, batch, cancel_event, throttle)
+    return rows, errors, time.perf_counter() - start
+
+
+def pack_files(source_folder, destination_folder, on_progress=None, cancel_event=None,
+               workers=DEFAULT_COPY_WORKERS, large_workers=DEFAULT_LARGE_FILE_WORKERS,
+               on_file=None, buffer_size=DEFAULT_BUFFER_SIZE, verify=False, throttle=None,
+               compression="none", pack_workers=DEFAULT_PACK_WORKERS, metrics=None):
+    # Archive into packed storage (see pack_store). New or changed files under
+    # PACK_FILE_LIMIT are batched into segments of about SEGMENT_BYTES, each
+    # written by one of pack_workers threads; bigger files go through
+    # copy_files unchanged, with replaced versions moved into the ArchiveStore.
+    # Once a scan completes without being cancelled or hitting an unreadable
+    # directory, files that are gone from the source are recorded as deleted
+    # (and archived if they were plain files). The paths seen are kept in a
+    # temporary table of the index, not in memory.
+    # verify only applies to the plain files; packed files get their hash
+    # recorded in the index as they are read.
+    stats = CopyStats()
+    if metrics is None:
+        metrics = NULL_METRICS
+    store = PackStore(destination_folder, compression)
+    manifest = Manifest(destination_folder)
+    archive = ArchiveStore(destination_folder, manifest)
+    initializer = throttle.enter_thread if throttle is not None else None
+    pool = ThreadPoolExecutor(max_workers=max(1, pack_workers), initializer=initializer)
+    method = "packed" if compression == "none" else f"packed+{compression}"
+    pending = {}
+    seen = []
+    scan_errors = []
+
+    def report(src_fp, dst_fp, error, method, size, seconds):
+        if error is not None:
+            stats.errors.append(f"{src_fp} -> {dst_fp}: {error}")
+            metrics.observe("error")
+        if on_file:
+            on_file(src_fp, dst_fp, error, method, size, seconds)
+
+    def finish(future):
+        segment_fp, batch = pending.pop(future)
+        try:
+            rows, errors, seconds = future.result()
+        except Exception as e:
+            for src_fp, rel_path in batch:
+                report(src_fp, segment_fp, e, None, 0, 0.0)
+            if on_progress:
+                on_progress(stats)
+            return
+        if rows:
+            store.add_packed(segment_fp, rows)
+            stats.segments += 1
+            metrics.observe("pack", seconds)
+        for rel_path, st, offset, digest in rows:
+            metrics.observe("packed", 0.0, st.st_size)
+            stats.copied += 1
+            stats.bytes_copied += st.st_size
+            stats.bytes_packed += st.st_size
+            stats.methods[method] = stats.methods.get(method, 0) + 1
+            report(os.path.join(source_folder, rel_path), segment_fp, None, method,
+                   st.st_size, seconds / len(rows))
+        for src_fp, e in errors:
+            report(src_fp, segment_fp, e, None, 0, 0.0)
+        if on_progress:
+            metrics.enter("progress")
+            on_progress(stats)
+            metrics.leave()
+
+    def submit(batch):
+        segment_fp = store.new_segment()
+        future = pool.submit(timed_pack, segment_fp, compression, batch, cancel_event, throttle)
+        pending[future] = (segment_fp, batch)
+        metrics.queue(len(pending))
+
+    def drain(futures):
+        metrics.enter("manifest")
+        for future in futures:
+            finish(future)
+        metrics.leave()
+        metrics.queue(len(pending))
+
+    def scan_error(rel_dir, e):
+        scan_errors.append(rel_dir)
+        report(os.path.join(source_folder, rel_dir), os.path.join(destination_folder, rel_dir),
+               e, None, 0, 0.0)
+
+    def plain_files():
+        # Feeds copy_files the files that are not packed, batching and
+        # submitting the others on the way
+        batch = []
+        batch_bytes = 0
+        for rel_path in iter_files(source_folder, cancel_event, DESTINATION_EXCLUDE, scan_error):
+            seen.append(rel_path)
+            if len(seen) >= SEEN_BATCH:
+                store.add_seen(seen)
+                seen.clear()
+            src_fp = os.path.join(source_folder, rel_path)
+            dst_fp = os.path.join(destination_folder, rel_path)
+            metrics.enter("stat")
+            try:
+                st = os.stat(src_fp)
+            except OSError as e:
+                metrics.leave()
+                report(src_fp, dst_fp, e, None, 0, 0.0)
+                continue
+            if st.st_size >= PACK_FILE_LIMIT:
+                metrics.leave()
+                yield src_fp, dst_fp, rel_path
+                continue
+            try:
+                current = store.current(rel_path)
+                if current == ("packed", st.st_size, st.st_mtime_ns):
+                    stats.skipped += 1
+                    stats.bytes_skipped += st.st_size
+                    metrics.observe("skip", 0.0, st.st_size)
+                    if on_progress:
+                        metrics.enter("progress")
+                        on_progress(stats)
+                        metrics.leave()
+                    continue
+                if os.path.lexists(dst_fp):
+                    # A plain copy from an earlier run (the file shrank, or the
+                    # destination was archived as snapshots before) becomes history
+                    metrics.switch("archive")
+                    archive.archive(dst_fp, rel_path)
+                    manifest.delete(rel_path)
+            except Exception as e:
+                report(src_fp, dst_fp, e, None, 0, 0.0)
+                continue
+            finally:
+                metrics.leave()
+            batch.append((src_fp, rel_path))
+            batch_bytes += st.st_size + TAR_HEADER_BYTES
+            if batch_bytes >= SEGMENT_BYTES:
+                submit(batch)
+                batch = []
+                batch_bytes = 0
+            drain([f for f in pending if f.done()])
+            # Keep the scan only a little ahead of the pack workers
+            while len(pending) >= max(1, pack_workers) * 2:
+                metrics.enter("wait")
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                metrics.leave()
+                drain(done)
+        if batch:
+            submit(batch)
+        store.add_seen(seen)
+        seen.clear()
+
+    def on_plain_file(src_fp, dst_fp, error, method, size, seconds):
+        if error is None:
+            try:
+                store.add_file(os.path.relpath(dst_fp, destination_folder), os.stat(src_fp))
+            except OSError:
+                pass
+        if on_file:
+            on_file(src_fp, dst_fp, error, method, size, seconds)
+
+    try:
+        copy_files(plain_files(), destination_folder, on_progress, cancel_event,
+                   workers, large_workers, on_plain_file, archive.archive, buffer_size, verify,
+                   stats=stats, manifest=manifest, throttle=throttle, metrics=metrics)
+        while pending:
+            metrics.enter("wait")
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            metrics.leave()
+            drain(done)
+        # Files under an unreadable directory look deleted, so nothing is
+        # recorded as deleted after one
+        if (not stats.cancelled and not scan_errors
+                and not (cancel_event is not None and cancel_event.is_set())):
+            for rel_path, kind in store.unseen_paths():
+                dst_fp = os.path.join(destination_folder, rel_path)
+                metrics.enter("delete")
+                try:
+                    if kind == "file" and os.path.lexists(dst_fp):
+                        archive.archive(dst_fp, rel_path)
+                        manifest.delete(rel_path)
+                    store.add_deleted(rel_path)
+                    stats.deleted += 1
+                    metrics.observe("delete")
+                    report(None, dst_fp, None, "delete", 0, 0.0)
+                except Exception as e:
+                    report(None, dst_fp, e, "delete", 0, 0.0)
+                finally:
+                    metrics.leave()
+    finally:
+        pool.shutdown(wait=True)
+        store.close()
+        manifest.close()
+    stats.archived = archive.archived
+    stats.bytes_deduplicated = archive.bytes_deduplicated
+    return stats
+
+
+def plan_unavailable(action, settings):
+    # Why there is no dry run for this action, or None. Packed Archive decides
+    # per file whether to pack it, so the plan_sync ops do not describe it.
+    if action == "Archive" and settings.get("archive_format", "snapshots") == "packed":
+        return "A dry run is not available for packed Archive"
+    return None
+
+
+def dry_run(source_folder, destination_folder, cancel_event=None, on_op=None, action="Sync",
+            settings=None):
+    # Compute action's plan without changing anything. on_op(op, rel_path) is
+    # called for every op except "same"; returns the count of each op. Sync
+    # and snapshot Archive follow plan_sync (Archive moves what Sync would
+    # delete or update into a snapshot); Copy never deletes, so its plan has
+    # no "delete" or "rmdir". Raises ValueError when plan_unavailable says so.
+    problem = plan_unavailable(action, settings or {})
+    if problem:
+        raise ValueError(problem)
+    skipped = ("delete", "rmdir") if action == "Copy" else ()
+    counts = {}
+    manifest = None
+    if os.path.exists(os.path.join(destination_folder, MANIFEST_NAME)):
+        manifest = Manifest(destination_folder)
+    try:
+        for op, rel_path in plan_sync(source_folder, destination_folder, manifest, cancel_event):
+            if op in skipped:
+                continue
+            counts[op] = counts.get(op, 0) + 1
+            if on_op is not None and op != "same":
+                on_op(op, rel_path)
+    finally:
+        if manifest is not None:
+            manifest.close()
+    return counts
+
+
+def run_backup(action, source_folder, destination_folder, settings, on_progress=None,
+               cancel_event=None, on_file=None, throttle=None, paths=None, metrics=None):
+    # Run one Sync, Copy or Archive with the engine options from settings.
+    # Shared by the GUI worker and the command line. paths limits the run to
+    # those source paths, relative to source_folder (see watch.py); None means
+    # the whole tree, and packed Archive always scans the whole tree.
+    # Without a throttle, one is built from the bandwidth and priority
+    # settings; the calling thread (which scans the source) gets the same
+    # priority as the pools. metrics (see metrics.py) is optional.
+    if throttle is None:
+        throttle = Throttle.from_settings(settings)
+    if throttle is not None:
+        throttle.enter_thread()
+    if metrics is None:
+        metrics = NULL_METRICS
+    workers = settings.get("copy_workers", DEFAULT_COPY_WORKERS)
+    large_workers = settings.get("large_file_workers", DEFAULT_LARGE_FILE_WORKERS)
+    verify = bool(settings.get("verify", False))
+    buffer_size = int(settings.get("copy_buffer_mb", DEFAULT_BUFFER_MB) * 1024 * 1024)
+    packed = action == "Archive" and settings.get("archive_format", "snapshots") == "packed"
+    pack_workers = settings.get("pack_workers", DEFAULT_PACK_WORKERS)
+    metrics.begin(max(1, workers) + max(1, large_workers) + (max(1, pack_workers) if packed else 0))
+    try:
+        plan = None
+        if paths is not None:
+            plan = plan_changes(source_folder, destination_folder, paths, action != "Copy")
+        if action == "Sync":
+            return sync_files(
+                source_folder, destination_folder, on_progress, cancel_event,
+                workers, large_workers,
+                on_file=on_file, buffer_size=buffer_size, verify=verify, throttle=throttle,
+                plan=plan, metrics=metrics,
+            )
+        if packed:
+            return pack_files(
+                source_folder, destination_folder, on_progress, cancel_event,
+                workers, large_workers,
+                on_file=on_file, buffer_size=buffer_size, verify=verify, throttle=throttle,
+                compression=settings.get("pack_compression", "none"),
+                pack_workers=pack_workers, metrics=metrics,
+            )
+        if action == "Archive":
+            return archive_files(
+                source_folder, destination_folder, on_progress, cancel_event,
+                workers, large_workers,
+                on_file=on_file, buffer_size=buffer_size, verify=verify, throttle=throttle,
+                plan=plan, metrics=metrics,
+            )
+        if action == "Copy":
+            if plan is None:
+                files = scan_source(source_folder, destination_folder, cancel_event)
+            else:
+                files = ((os.path.join(source_folder, rel_path),
+                          os.path.join(destination_folder, rel_path), rel_path)
+                         for op, rel_path in plan if op == "update")
+            return copy_files(
+                files,
+                destination_folder, on_progress, cancel_event,
+                workers, large_workers,
+                on_file=on_file, buffer_size=buffer_size, verify=verify, throttle=throttle,
+                metrics=metrics,
+            )
+        raise ValueError(f"Unknown backup action: {action}")
+    finally:
+        metrics.end()
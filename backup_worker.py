@@ -0,0 +1,296 @@
+# backup_worker.py
+#
+# Runs a backup on a QThread so the main window stays responsive.
+
+import threading
+import time
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from backup_engine import count_files, run_backup, dry_run
+from catalog import Catalog
+from jobs import run_jobs
+from metrics import Metrics, Profiler, write_metrics
+from run_log import RunLog
+from throttle import Throttle
+from watch import watch
+
+# Minimum time between progress signals, in seconds
+PROGRESS_INTERVAL = 0.1
+# Number of planned operations kept for the dry-run preview dialog
+PLAN_PREVIEW_LIMIT = 5000
+
+
+class BackupWorker(QThread):
+    # files_done, total_files (0 while still counting), bytes_per_second,
+    # eta_seconds (-1 when unknown), bandwidth limit in bytes per second (0 = none)
+    progress = pyqtSignal(int, int, float, float, float)
+    # Short status text, e.g. "Scanning source..."
+    status = pyqtSignal(str)
+    # One-line summary of the run's metrics for the stats panel
+    stats_text = pyqtSignal(str)
+    # Emitted once at the end with the worker itself; read stats/error from it
+    done = pyqtSignal(object)
+
+    def __init__(self, action, source_folder, destination_folder, settings=None,
+                 log_path=None, parent=None):
+        super().__init__(parent)
+        self.action = action
+        self.source_folder = source_folder
+        self.destination_folder = destination_folder
+        self.settings = settings or {}
+        self.cancel_event = threading.Event()
+        # Bandwidth limit and priority from settings, or None; built in run()
+        self.throttle = None
+        # Always measured for the stats panel; the "progress" phase is the
+        # time spent emitting signals to the GUI
+        self.metrics = Metrics()
+        self.profile_file = None
+        self.metrics_error = None
+        # The log is written while running; None disables it
+        self.log_path = log_path
+        self.log_error = None
+        self.stats = None
+        self.error = None
+        self.total_files = 0
+        self._start_time = 0.0
+        self._last_emit = 0.0
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        self._start_time = time.monotonic()
+        log = RunLog(self.log_path, self.action, self.source_folder, self.destination_folder,
+                     bool(self.settings.get("verify", False)))
+        log.open()
+        # Count the source on a side thread so the bar can become determinate,
+        # while the backup itself consumes a second, streaming scan.
+        counter = threading.Thread(target=self.count_source, daemon=True)
+        counter.start()
+        self.status.emit("Scanning and copying files...")
+        profiler = None
+        try:
+            self.throttle = Throttle.from_settings(self.settings)
+            profiler = Profiler.from_settings(self.settings)
+            if profiler is not None:
+                profiler.start()
+            self.stats = run_backup(
+                self.action, self.source_folder, self.destination_folder, self.settings,
+                self.on_progress, self.cancel_event, log.file, self.throttle,
+                metrics=self.metrics,
+            )
+        except Exception as e:
+            self.error = e
+        finally:
+            if profiler is not None:
+                self.profile_file = profiler.stop(self.metrics)
+        if self.settings.get("metrics_file"):
+            try:
+                write_metrics(self.metrics, self.settings["metrics_file"])
+            except OSError as e:
+                self.metrics_error = e
+        log.close(self.stats)
+        self.log_error = log.error
+        counter.join()
+        if self.stats is not None:
+            self.emit_progress(self.stats)
+        self.done.emit(self)
+
+    def count_source(self):
+        self.total_files = count_files(self.source_folder, self.cancel_event)
+        if not self.cancel_event.is_set():
+            self.status.emit("Copying files...")
+
+    def on_progress(self, stats):
+        # Called from copy_files after every file; only forward at a fixed rate
+        now = time.monotonic()
+        if now - self._last_emit >= PROGRESS_INTERVAL:
+            self._last_emit = now
+            self.emit_progress(stats)
+
+    def emit_progress(self, stats):
+        elapsed = max(time.monotonic() - self._start_time, 1e-6)
+        done = stats.files_done
+        rate = stats.bytes_copied / elapsed
+        limit = 0.0
+        if self.throttle is not None:
+            # Show the current rate rather than the average, so a schedule
+            # change or a throttled large file is visible straight away
+            rate = self.throttle.observed_rate()
+            limit = self.throttle.limit
+        # total_files stays 0 until the counting scan finishes
+        total = self.total_files
+        eta = (total - done) * elapsed / done if done and total else -1.0
+        self.progress.emit(done, total, rate, eta, limit)
+        self.stats_text.emit(self.metrics.summary())
+
+
+class PlanWorker(QThread):
+    # Computes an action's plan (dry run) off the GUI thread.
+    # done carries the worker; read counts, ops and error from it.
+    done = pyqtSignal(object)
+
+    def __init__(self, action, source_folder, destination_folder, settings,
+                 max_ops=PLAN_PREVIEW_LIMIT, parent=None):
+        super().__init__(parent)
+        self.action = action
+        self.source_folder = source_folder
+        self.destination_folder = destination_folder
+        self.settings = settings
+        self.max_ops = max_ops
+        self.cancel_event = threading.Event()
+        self.counts = {}
+        self.ops = []
+        self.error = None
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        def on_op(op, rel_path):
+            if len(self.ops) < self.max_ops:
+                self.ops.append((op, rel_path))
+        try:
+            self.counts = dry_run(self.source_folder, self.destination_folder,
+                                  self.cancel_event, on_op, self.action, self.settings)
+        except Exception as e:
+            self.error = e
+        self.done.emit(self)
+
+
+class JobsWorker(QThread):
+    # Runs several named jobs through jobs.run_jobs; jobs on different disks
+    # run at the same time. job_status carries (job name, status text).
+    job_status = pyqtSignal(str, str)
+    # Emitted once at the end with the worker itself; read results from it
+    done = pyqtSignal(object)
+
+    def __init__(self, jobs, settings, parent=None):
+        super().__init__(parent)
+        self.jobs = jobs
+        self.settings = settings
+        self.cancel_event = threading.Event()
+        self.results = []
+        self._last_emit = {}
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        self.results = run_jobs(self.jobs, self.settings, self.cancel_event,
+                                self.on_start, self.on_result, self.on_progress)
+        self.done.emit(self)
+
+    def on_start(self, job):
+        self.job_status.emit(job.get("name", ""), "running...")
+
+    def on_progress(self, job, stats):
+        # Called from each device's thread; throttled per job
+        name = job.get("name", "")
+        now = time.monotonic()
+        if now - self._last_emit.get(name, 0.0) >= PROGRESS_INTERVAL:
+            self._last_emit[name] = now
+            self.job_status.emit(name, f"{stats.files_done} files done")
+
+    def on_result(self, job, result):
+        text = result["status"]
+        if "error" in result:
+            text += f": {result['error']}"
+        elif "copied" in result:
+            text += f" ({result['copied']} copied, {result['skipped']} skipped)"
+        self.job_status.emit(job.get("name", ""), text)
+
+
+class WatchWorker(QThread):
+    # Runs watch.watch until cancelled: a full run, then a run for every
+    # batch of changed files. result carries each run's jobs.run_job result.
+    status = pyqtSignal(str)
+    result = pyqtSignal(object)
+    done = pyqtSignal(object)
+
+    def __init__(self, settings, parent=None):
+        super().__init__(parent)
+        self.settings = settings
+        self.cancel_event = threading.Event()
+        # Accumulates over every run of the session, for the stats panel
+        self.metrics = Metrics()
+        self.last_result = None
+        self.error = None
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            self.last_result = watch(self.settings, self.cancel_event,
+                                     self.result.emit, on_status=self.status.emit,
+                                     metrics=self.metrics)
+        except Exception as e:
+            self.error = e
+        self.done.emit(self)
+
+
+class CatalogWorker(QThread):
+    # Brings a destination's restore catalog up to date off the GUI thread
+    # (the first refresh of a large destination reads every snapshot).
+    done = pyqtSignal(object)
+
+    def __init__(self, destination_folder, parent=None):
+        super().__init__(parent)
+        self.destination_folder = destination_folder
+        self.touched = 0
+        self.error = None
+
+    def run(self):
+        try:
+            catalog = Catalog(self.destination_folder)
+            try:
+                self.touched = catalog.refresh()
+            finally:
+                catalog.close()
+        except Exception as e:
+            self.error = e
+        self.done.emit(self)
+
+
+class RestoreWorker(QThread):
+    # Restores catalog entries into a folder with Catalog.restore.
+    # progress carries (files done, total files).
+    progress = pyqtSignal(int, int)
+    done = pyqtSignal(object)
+
+    def __init__(self, destination_folder, entries, target_folder, strip="", parent=None):
+        super().__init__(parent)
+        self.destination_folder = destination_folder
+        self.entries = entries
+        self.target_folder = target_folder
+        self.strip = strip
+        self.cancel_event = threading.Event()
+        self.files_done = 0
+        self.errors = []
+        self.error = None
+        self._last_emit = 0.0
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            catalog = Catalog(self.destination_folder)
+            try:
+                self.errors = catalog.restore(self.entries, self.target_folder, self.strip,
+                                              cancel_event=self.cancel_event,
+                                              on_file=self.on_file)
+            finally:
+                catalog.close()
+        except Exception as e:
+            self.error = e
+        self.done.emit(self)
+
+    def on_file(self, entry, target_fp, error):
+        self.files_done += 1
+        now = time.monotonic()
+        if now - self._last_emit >= PROGRESS_INTERVAL:
+            self._last_emit = now
+            self.progress.emit(self.files_done, len(self.entries))
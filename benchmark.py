@@ -0,0 +1,251 @@
+# benchmark.py
+#
+# Benchmarks the backup engine on synthetic trees generated in a temporary
+# directory. Each workload is timed in separate phases:
+#
+#   scan     enumerate the source (iter_files)
+#   plan     compute the Sync plan against an empty destination (dry_run)
+#   copy     first Copy into the empty destination
+#   recopy   Copy again with nothing changed (manifest skip path)
+#   verify   Copy again with verify on and a cold hash cache
+#   sync     Sync into a fresh destination
+#
+#   python benchmark.py                                  all workloads, default scale
+#   python benchmark.py --workloads small,huge --scale 0.2 --output bench.json
+#   python benchmark.py --compare bench.json             fail if slower than a saved run
+#
+# Results are written as JSON so engine settings and versions can be compared.
+#
+# Memory is measured per phase by sampling the process's resident set size
+# every RSS_SAMPLE_SECONDS on a side thread (Linux, from /proc/self/statm):
+# "rss_start_mb" when the phase starts, "rss_peak_mb" the highest sample
+# during it and "rss_growth_mb" the difference, which is what shows a phase
+# using more memory. Spikes shorter than the sampling interval can be missed.
+# Elsewhere the fields are null.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from backup_engine import (
+    iter_files, dry_run, copy_files, scan_source, sync_files,
+    DEFAULT_COPY_WORKERS, DEFAULT_LARGE_FILE_WORKERS, DEFAULT_BUFFER_MB
+)
+
+PHASES = ("scan", "plan", "copy", "recopy", "verify", "sync")
+# File count, file size (None = MIXED_SIZES), directory depth and fanout at scale 1.0
+WORKLOADS = {
+    "small": {"files": 20000, "size": 4 * 1024, "depth": 2, "fanout": 20},
+    "huge": {"files": 3, "size": 256 * 1024 * 1024, "depth": 0, "fanout": 1},
+    "deep": {"files": 5000, "size": 16 * 1024, "depth": 25, "fanout": 2},
+    "mixed": {"files": 8000, "size": None, "depth": 4, "fanout": 8},
+}
+# Size cycle used by the mixed workload: many small sidecars plus some large clips
+MIXED_SIZES = [2 * 1024] * 60 + [64 * 1024] * 30 + [4 * 1024 * 1024] * 9 + [64 * 1024 * 1024]
+# Default slowdown, as a fraction, that --compare reports as a regression
+REGRESSION_THRESHOLD = 0.2
+RSS_SAMPLE_SECONDS = 0.01
+STATM_PATH = "/proc/self/statm"
+
+
+def rss_bytes():
+    # Current resident set size, or None where /proc is not available
+    try:
+        with open(STATM_PATH) as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class RssSampler:
+    # Highest RSS seen while running, sampled on a daemon thread
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.start_rss = rss_bytes()
+        self.peak = self.start_rss
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        if self.start_rss is not None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.sample()
+        return False
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        rss = rss_bytes()
+        if rss is not None and rss > self.peak:
+            self.peak = rss
+
+    def as_dict(self):
+        if self.start_rss is None:
+            return {"rss_start_mb": None, "rss_peak_mb": None, "rss_growth_mb": None}
+        mb = 1024 * 1024
+        return {"rss_start_mb": round(self.start_rss / mb, 1),
+                "rss_peak_mb": round(self.peak / mb, 1),
+                "rss_growth_mb": round((self.peak - self.start_rss) / mb, 1)}
+
+
+def write_file(path, size, block):
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining:
+            n = min(len(block), remaining)
+            f.write(block[:n])
+            remaining -= n
+
+
+def generate_tree(root, spec, scale):
+    # Create the workload's files under root; returns (file count, total bytes)
+    count = max(1, int(spec["files"] * scale))
+    block = os.urandom(1024 * 1024)
+    total = 0
+    for i in range(count):
+        parts = []
+        n = i
+        for _ in range(spec["depth"]):
+            parts.append(f"d{n % spec['fanout']}")
+            n //= spec["fanout"]
+        folder = os.path.join(root, *parts)
+        os.makedirs(folder, exist_ok=True)
+        size = spec["size"]
+        if size is None:
+            size = MIXED_SIZES[i % len(MIXED_SIZES)]
+        elif spec["files"] < 10:
+            # Few huge files: scale their size instead of their number
+            size = max(1024 * 1024, int(size * scale))
+        write_file(os.path.join(folder, f"file{i:07d}.bin"), size, block)
+        total += size
+    return count, total
+
+
+def timed(phase, func, files, bytes_moved):
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+    return {
+        "phase": phase,
+        "seconds": round(seconds, 4),
+        "files": files,
+        "bytes": bytes_moved,
+        "files_per_second": round(files / seconds, 1) if seconds else None,
+        "mb_per_second": round(bytes_moved / seconds / (1024 * 1024), 1) if seconds else None,
+        **rss.as_dict(),
+    }, result
+
+
+def run_workload(name, spec, args, work_dir):
+    source = os.path.join(work_dir, name, "source")
+    os.makedirs(source)
+    files, total = generate_tree(source, spec, args.scale)
+    options = {"workers": args.workers, "large_workers": args.large_workers,
+               "buffer_size": args.buffer_mb * 1024 * 1024}
+    results = []
+
+    def phase(phase_name, func, bytes_moved):
+        if phase_name in args.phases:
+            record, _ = timed(phase_name, func, files, bytes_moved)
+            record["workload"] = name
+            results.append(record)
+            print(f"{name:<8} {phase_name:<7} {record['seconds']:>9.3f}s "
+                  f"{record['files_per_second'] or 0:>12.1f} files/s "
+                  f"{record['mb_per_second'] or 0:>9.1f} MB/s "
+                  f"{record['rss_growth_mb'] or 0:>+8.1f} MB RSS", flush=True)
+
+    copy_dst = os.path.join(work_dir, name, "copy")
+    sync_dst = os.path.join(work_dir, name, "sync")
+    os.makedirs(copy_dst)
+    os.makedirs(sync_dst)
+    phase("scan", lambda: sum(1 for _ in iter_files(source)), 0)
+    phase("plan", lambda: dry_run(source, copy_dst), 0)
+    phase("copy", lambda: copy_files(scan_source(source, copy_dst), copy_dst, **options), total)
+    phase("recopy", lambda: copy_files(scan_source(source, copy_dst), copy_dst, **options), 0)
+    phase("verify", lambda: copy_files(scan_source(source, copy_dst), copy_dst,
+                                       verify=True, **options), total)
+    phase("sync", lambda: sync_files(source, sync_dst, **options), total)
+    shutil.rmtree(os.path.join(work_dir, name), ignore_errors=True)
+    return results
+
+
+def compare(results, baseline_path, threshold):
+    # Print the change against a saved run; return True if any phase regressed
+    with open(baseline_path) as f:
+        baseline = {(r["workload"], r["phase"]): r for r in json.load(f)["results"]}
+    regressed = False
+    for r in results:
+        old = baseline.get((r["workload"], r["phase"]))
+        if not old or not old["seconds"]:
+            continue
+        change = (r["seconds"] - old["seconds"]) / old["seconds"]
+        flag = "REGRESSION" if change > threshold else ""
+        regressed = regressed or bool(flag)
+        print(f"{r['workload']:<8} {r['phase']:<7} {old['seconds']:>9.3f}s -> "
+              f"{r['seconds']:>9.3f}s {change:+.1%} {flag}")
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the backup engine on synthetic trees.")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS),
+                        help=f"comma-separated subset of {', '.join(WORKLOADS)}")
+    parser.add_argument("--phases", default=",".join(PHASES),
+                        help=f"comma-separated subset of {', '.join(PHASES)}")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiplies file counts (and huge file sizes)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_COPY_WORKERS)
+    parser.add_argument("--large-workers", type=int, default=DEFAULT_LARGE_FILE_WORKERS)
+    parser.add_argument("--buffer-mb", type=int, default=DEFAULT_BUFFER_MB)
+    parser.add_argument("--dir", help="where to create the trees (default: system temp dir); "
+                                      "point it at the drive you want to measure")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="JSON file from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="slowdown fraction treated as a regression (default 0.2)")
+    args = parser.parse_args(argv)
+    args.phases = set(args.phases.split(","))
+
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="backup-bench-", dir=args.dir)
+    try:
+        for name in args.workloads.split(","):
+            results.extend(run_workload(name, WORKLOADS[name], args, work_dir))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {"scale": args.scale, "workers": args.workers,
+                     "large_workers": args.large_workers, "buffer_mb": args.buffer_mb},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    if args.compare and compare(results, args.compare, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,401 @@
+# catalog.py
+#
+# Restore catalog: one SQLite index ("<destination>/.backup_catalog.db") of
+# every version of every file that can be restored from a destination:
+#
+#   "current"   the plain file at <destination>/<path>, read from the manifest
+#   "snapshot"  a version the Archive action moved into .backup_archive/snapshots
+#   "packed"    a version in a packed Archive segment (.backup_packs)
+#
+# Each version is valid from "since" until "until" (NULL while current).
+# Versions start when they were backed up: the run time for packed versions,
+# the manifest's backed_up_at for current and snapshot versions (the file's
+# mtime for files copied before backed_up_at was recorded). A snapshot
+# version ends when it was archived and packed versions end at the next run
+# that changed the path; otherwise a version ends where the next one starts.
+# Listing a folder at a time X is then one indexed query on (parent, since),
+# however many versions the destination holds.
+#
+# refresh() brings the catalog up to date incrementally: manifest changes are
+# found with one join, snapshot folders are only walked once (the latest one
+# again, in case its run was still going) and pack index rows are read from
+# where the previous refresh stopped.
+#
+# Nothing in here imports Qt.
+
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from archive_store import ARCHIVE_DIR_NAME, SNAPSHOT_TIME_FORMAT
+from backup_engine import MANIFEST_NAME, CATALOG_NAME, Manifest
+from fastcopy import copy_file
+from pack_store import PACK_DIR_NAME, INDEX_NAME, extract_members
+
+DEFAULT_RESTORE_WORKERS = 4
+# Length of a snapshot folder name without its -NN suffix ("2025-08-08_101500")
+SNAPSHOT_NAME_LENGTH = 17
+# Catalogs of an older version are rebuilt from scratch
+CATALOG_VERSION = 3
+# Matches any character that can follow os.sep, to turn a prefix into a range
+PATH_RANGE_END = chr(ord(os.sep) + 1)
+
+
+def subtree_range(folder):
+    # (low, high) such that low <= path < high for every path under folder
+    if not folder:
+        return "", "\U0010ffff"
+    return folder + os.sep, folder + PATH_RANGE_END
+
+
+def glob_prefix(pattern):
+    # Literal part of a glob pattern before its first wildcard
+    for i, ch in enumerate(pattern):
+        if ch in "*?[":
+            return pattern[:i]
+    return pattern
+
+
+def snapshot_time(name):
+    # Start of the run that made snapshot folder name ("<timestamp>[-NN]"),
+    # or None if it is not a snapshot folder
+    base, suffix = name[:SNAPSHOT_NAME_LENGTH], name[SNAPSHOT_NAME_LENGTH:]
+    if suffix and not (suffix[0] == "-" and suffix[1:].isdigit()):
+        return None
+    try:
+        return time.mktime(time.strptime(base, SNAPSHOT_TIME_FORMAT))
+    except ValueError:
+        return None
+
+
+def parse_time(text):
+    # "YYYY-MM-DD", "YYYY-MM-DD HH:MM" or "YYYY-MM-DD HH:MM:SS", local time
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(text, fmt))
+        except ValueError:
+            pass
+    raise ValueError(f"Unrecognised time: {text} (use YYYY-MM-DD [HH:MM[:SS]])")
+
+
+class Catalog:
+    def __init__(self, destination):
+        self.destination = destination
+        self.conn = sqlite3.connect(os.path.join(destination, CATALOG_NAME))
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS versions ("
+            "path TEXT, parent TEXT, kind TEXT, since REAL, until REAL, archived_at REAL, "
+            "location TEXT, compression TEXT, offset INTEGER, size INTEGER, mtime_ns INTEGER)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS versions_path ON versions (path, since)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS versions_parent ON versions (parent, since)")
+        # Every directory that has ever held a version, for browsing
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent)")
+        # Progress of refresh(): indexed snapshot folders and the last pack row read
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value) WITHOUT ROWID"
+        )
+        if self.get_state("version") != CATALOG_VERSION:
+            # Version 1 started current and snapshot versions at the file's
+            # mtime, version 2 ended snapshot versions at the start of their run
+            for table in ("versions", "dirs", "state"):
+                self.conn.execute(f"DELETE FROM {table}")
+            self.set_state("version", CATALOG_VERSION)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def get_state(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_state(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value))
+
+    # Refresh
+
+    def refresh(self):
+        # Returns the number of paths whose versions changed
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS touched (path TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM touched")
+        self.refresh_current()
+        self.refresh_snapshots()
+        self.refresh_packed()
+        touched = self.conn.execute("SELECT COUNT(*) FROM touched").fetchone()[0]
+        self.fix_intervals()
+        self.add_dirs()
+        self.conn.commit()
+        return touched
+
+    def insert(self, rows):
+        # rows: (path, kind, since, archived_at, location, compression, offset, size, mtime_ns)
+        rows = list(rows)
+        self.conn.executemany(
+            "INSERT INTO versions (path, parent, kind, since, until, archived_at, location, "
+            "compression, offset, size, mtime_ns) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(path, os.path.dirname(path), kind, since, archived_at, archived_at, location,
+              compression, offset, size, mtime_ns)
+             for path, kind, since, archived_at, location, compression, offset, size, mtime_ns
+             in rows],
+        )
+        self.conn.executemany("INSERT OR IGNORE INTO touched (path) VALUES (?)",
+                              [(row[0],) for row in rows])
+
+    def refresh_current(self):
+        manifest_fp = os.path.join(self.destination, MANIFEST_NAME)
+        if not os.path.exists(manifest_fp):
+            return
+        # Brings an older manifest's tables up to date
+        Manifest(self.destination).close()
+        self.conn.commit()
+        self.conn.execute("ATTACH DATABASE ? AS m", (manifest_fp,))
+        try:
+            # Gone from, or changed in, the manifest
+            self.conn.execute(
+                "INSERT OR IGNORE INTO touched (path) SELECT v.path FROM versions AS v "
+                "WHERE v.kind = 'current' AND NOT EXISTS (SELECT 1 FROM m.files AS f "
+                "WHERE f.path = v.path AND f.size = v.size AND f.mtime_ns = v.mtime_ns)"
+            )
+            self.conn.execute(
+                "DELETE FROM versions WHERE kind = 'current' "
+                "AND path IN (SELECT path FROM touched)"
+            )
+            added = self.conn.execute(
+                "SELECT f.path, f.size, f.mtime_ns, f.backed_up_at FROM m.files AS f "
+                "WHERE NOT EXISTS (SELECT 1 FROM versions AS v "
+                "WHERE v.path = f.path AND v.kind = 'current')"
+            ).fetchall()
+            self.insert((path, "current", mtime_ns / 1e9 if backed_up_at is None else backed_up_at,
+                         None, None, None, None, size, mtime_ns)
+                        for path, size, mtime_ns, backed_up_at in added)
+        finally:
+            self.conn.commit()
+            self.conn.execute("DETACH DATABASE m")
+
+    def refresh_snapshots(self):
+        snapshots_dir = os.path.join(self.destination, ARCHIVE_DIR_NAME, "snapshots")
+        try:
+            names = sorted(os.listdir(snapshots_dir))
+        except OSError:
+            return
+        for i, name in enumerate(names):
+            latest = i == len(names) - 1
+            if self.get_state("snapshot:" + name) and not latest:
+                continue
+            run_start = snapshot_time(name)
+            if run_start is None:
+                continue
+            # When each version in this snapshot had been backed up
+            backed_up = self.archived_times(name)
+            known = set()
+            if latest:
+                known = {row[0] for row in self.conn.execute(
+                    "SELECT path FROM versions WHERE kind = 'snapshot' AND location = ?", (name,))}
+            root = os.path.join(snapshots_dir, name)
+            rows = []
+            for dirpath, dirnames, filenames in os.walk(root):
+                for filename in filenames:
+                    fp = os.path.join(dirpath, filename)
+                    path = os.path.relpath(fp, root)
+                    if path in known:
+                        continue
+                    try:
+                        st = os.stat(fp)
+                    except OSError:
+                        continue
+                    since, moved_at = backed_up.get(path, (None, None))
+                    if moved_at is None:
+                        moved_at = run_start
+                    if since is None:
+                        since = st.st_mtime_ns / 1e9
+                    rows.append((path, "snapshot", min(since, moved_at),
+                                 moved_at, name, None, None, st.st_size, st.st_mtime_ns))
+            self.insert(rows)
+            self.set_state("snapshot:" + name, 1)
+
+    def archived_times(self, snapshot):
+        # {path: (backed_up_at, archived_at)} the manifest recorded for one
+        # snapshot; either may be None
+        manifest_fp = os.path.join(self.destination, MANIFEST_NAME)
+        if not os.path.exists(manifest_fp):
+            return {}
+        conn = sqlite3.connect(manifest_fp)
+        try:
+            return {path: (backed_up_at, archived_at) for path, backed_up_at, archived_at
+                    in conn.execute("SELECT path, backed_up_at, archived_at FROM archived "
+                                    "WHERE snapshot = ?", (snapshot,))}
+        except sqlite3.OperationalError:
+            # Manifest from before the archived table (refresh_current adds it)
+            return {}
+        finally:
+            conn.close()
+
+    def refresh_packed(self):
+        index_fp = os.path.join(self.destination, PACK_DIR_NAME, INDEX_NAME)
+        if not os.path.exists(index_fp):
+            return
+        last = self.get_state("pack_rowid", 0)
+        # ATTACH and DETACH cannot run inside a transaction
+        self.conn.commit()
+        self.conn.execute("ATTACH DATABASE ? AS p", (index_fp,))
+        try:
+            rows = self.conn.execute(
+                "SELECT rowid, path, run, kind, segment, compression, offset, size, mtime_ns "
+                "FROM p.entries WHERE rowid > ? ORDER BY rowid", (last,)
+            ).fetchall()
+        finally:
+            self.conn.execute("DETACH DATABASE p")
+        # Plain ("file") and "deleted" rows only mark where the packed version
+        # before them ends; the plain file itself comes from the manifest
+        self.insert(
+            (path, "packed" if kind == "packed" else "marker", run,
+             None if kind == "packed" else run, segment, compression, offset, size, mtime_ns)
+            for rowid, path, run, kind, segment, compression, offset, size, mtime_ns in rows
+        )
+        if rows:
+            self.set_state("pack_rowid", rows[-1][0])
+
+    def fix_intervals(self):
+        # Versions of one path must not overlap: each ends when it was
+        # archived or when the next one starts, whichever is first. Only
+        # touched paths are looked at, in one pass.
+        rows = self.conn.execute(
+            "SELECT v.rowid, v.until, v.archived_at, LEAD(v.since) OVER ("
+            "PARTITION BY v.path ORDER BY v.since, v.rowid) "
+            "FROM versions AS v JOIN touched AS t ON v.path = t.path"
+        )
+        updates = []
+        for rowid, until, archived_at, next_since in rows:
+            ends = [t for t in (archived_at, next_since) if t is not None]
+            end = min(ends) if ends else None
+            if end != until:
+                updates.append((end, rowid))
+        self.conn.executemany("UPDATE versions SET until = ? WHERE rowid = ?", updates)
+
+    def add_dirs(self):
+        new_dirs = {}
+        for (path,) in self.conn.execute("SELECT path FROM touched"):
+            parent = os.path.dirname(path)
+            while parent and parent not in new_dirs:
+                new_dirs[parent] = os.path.dirname(parent)
+                parent = os.path.dirname(parent)
+        self.conn.executemany("INSERT OR IGNORE INTO dirs (path, parent) VALUES (?, ?)",
+                              new_dirs.items())
+
+    # Queries. at is seconds since the epoch; None means now.
+
+    def entry(self, row):
+        keys = ("path", "kind", "since", "until", "location", "compression", "offset",
+                "size", "mtime_ns")
+        return dict(zip(keys, row))
+
+    def select(self, where, params, at=None, limit=None):
+        at = time.time() if at is None else at
+        sql = ("SELECT path, kind, since, until, location, compression, offset, size, mtime_ns "
+               f"FROM versions WHERE {where} AND kind != 'marker' AND since <= ? "
+               "AND (until IS NULL OR until > ?) ORDER BY path")
+        params = list(params) + [at, at]
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [self.entry(row) for row in self.conn.execute(sql, params)]
+
+    def has_files(self, folder, at=None):
+        low, high = subtree_range(folder)
+        return bool(self.select("path >= ? AND path < ?", (low, high), at, limit=1))
+
+    def list_dir(self, folder="", at=None):
+        # (subfolders, files) directly inside folder as it was at time at
+        subfolders = [path for (path,) in self.conn.execute(
+            "SELECT path FROM dirs WHERE parent = ? ORDER BY path", (folder,))
+            if self.has_files(path, at)]
+        return subfolders, self.select("parent = ?", (folder,), at)
+
+    def search(self, pattern, at=None, limit=1000):
+        # Files whose path matches a glob pattern (e.g. "Footage/*.mov") at
+        # time at. A literal prefix in the pattern narrows the index range.
+        # Paths are stored with os.sep, so "/" works as the separator everywhere.
+        pattern = pattern.replace("/", os.sep)
+        low = glob_prefix(pattern)
+        high = low + "\U0010ffff"
+        return [entry for entry in self.select("path >= ? AND path < ? AND path GLOB ?",
+                                               (low, high, pattern), at, limit)]
+
+    def versions(self, path):
+        # Every stored version of one file, oldest first
+        return [self.entry(row) for row in self.conn.execute(
+            "SELECT path, kind, since, until, location, compression, offset, size, mtime_ns "
+            "FROM versions WHERE path = ? AND kind != 'marker' ORDER BY since", (path,))]
+
+    def subtree(self, folder, at=None):
+        # Every file in folder (or the file itself) at time at
+        low, high = subtree_range(folder)
+        return self.select("(path = ? OR (path >= ? AND path < ?))", (folder, low, high), at)
+
+    # Restore
+
+    def restore_files(self, jobs):
+        # Runs on a pool thread. jobs is a list of (entry, target_fp) that
+        # are either one plain/snapshot file or all from the same segment.
+        for entry, target_fp in jobs:
+            os.makedirs(os.path.dirname(target_fp) or ".", exist_ok=True)
+        entry = jobs[0][0]
+        if entry["kind"] == "packed":
+            segment_fp = os.path.join(self.destination, PACK_DIR_NAME, "segments", entry["location"])
+            extract_members(segment_fp, entry["compression"],
+                            [(e["offset"], e["size"], e["mtime_ns"], target_fp)
+                             for e, target_fp in jobs])
+            return
+        if entry["kind"] == "snapshot":
+            src_fp = os.path.join(self.destination, ARCHIVE_DIR_NAME, "snapshots",
+                                  entry["location"], entry["path"])
+        else:
+            src_fp = os.path.join(self.destination, entry["path"])
+        copy_file(src_fp, jobs[0][1])
+
+    def restore(self, entries, target_folder, strip="", workers=DEFAULT_RESTORE_WORKERS,
+                cancel_event=None, on_file=None):
+        # Restore entries (from subtree, search or list_dir) under
+        # target_folder, in parallel. Files from one segment are extracted
+        # together in a single pass, so a compressed segment is only
+        # decompressed once. strip is removed from the front of each path, so
+        # a folder can be restored without its parents. on_file(entry,
+        # target_fp, error) is called on this thread for each file.
+        # Returns the error messages.
+        batches = []
+        segments = {}
+        for entry in entries:
+            path = entry["path"]
+            if strip and path.startswith(strip + os.sep):
+                path = path[len(strip) + 1:]
+            job = (entry, os.path.join(target_folder, path))
+            if entry["kind"] == "packed":
+                if entry["location"] not in segments:
+                    segments[entry["location"]] = []
+                    batches.append(segments[entry["location"]])
+                segments[entry["location"]].append(job)
+            else:
+                batches.append([job])
+        errors = []
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = [(batch, pool.submit(self.restore_files, batch)) for batch in batches]
+            for batch, future in futures:
+                if cancel_event is not None and cancel_event.is_set() and future.cancel():
+                    continue
+                error = None
+                try:
+                    future.result()
+                except Exception as e:
+                    error = e
+                for entry, target_fp in batch:
+                    if error is not None:
+                        errors.append(f"{entry['path']}: {error}")
+                    if on_file:
+                        on_file(entry, target_fp, error)
+        return errors
@@ -0,0 +1,269 @@
+# fastcopy.py
+#
+# File copy that lets the kernel move the data where it can. Methods are tried
+# in this order and the one used is returned so callers can log it:
+#
+#   "reflink"          FICLONE clone on Btrfs/XFS (no data is copied at all)
+#   "copy_file_range"  in-kernel copy, Linux
+#   "sendfile"         in-kernel copy, older Linux kernels
+#   "buffered"         readinto() loop with a large, tunable buffer
+#
+# When a hasher is passed the data has to pass through userspace anyway, so
+# the kernel methods are skipped and the buffered loop hashes the source as it
+# is read ("buffered+hash").
+#
+# Data is written to "<dst>.partial", fsynced, and renamed over dst only once
+# it is complete and its metadata is set, so dst is never left half-written.
+# For files of CHECKPOINT_BYTES or more, the partial file is also fsynced every
+# CHECKPOINT_BYTES and its offset recorded in "<dst>.partial.ckpt"; a later
+# copy of the same (unchanged) source resumes from there after checking the
+# last RESUME_CHECK_BYTES against the source. A copy also stops at the next
+# chunk when cancel_event is set, leaving a checkpoint behind.
+#
+# When a throttle (see throttle.py) is passed, every chunk is charged to it
+# and the kernel methods move THROTTLED_CHUNK at a time so the limit stays smooth.
+
+import errno
+import json
+import os
+import shutil
+import sys
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+DEFAULT_BUFFER_SIZE = 8 * 1024 * 1024
+# Largest amount handed to a single copy_file_range/sendfile call
+KERNEL_CHUNK = 64 * 1024 * 1024
+# Chunk used instead when a bandwidth limit is set
+THROTTLED_CHUNK = 1024 * 1024
+# Linux ioctl number for FICLONE (_IOW(0x94, 9, int))
+FICLONE = 0x40049409
+
+PARTIAL_SUFFIX = ".partial"
+CHECKPOINT_SUFFIX = ".partial.ckpt"
+CHECKPOINT_BYTES = 256 * 1024 * 1024
+RESUME_CHECK_BYTES = 1024 * 1024
+
+# Errors meaning "this method is not available here", as opposed to a real I/O failure
+UNSUPPORTED_ERRNOS = {
+    errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY,
+    getattr(errno, "ENOTSUP", errno.EOPNOTSUPP),
+}
+
+# (source device, destination device) pairs where a method already failed,
+# so it is not retried for every file of a run
+_unsupported = {"reflink": set(), "copy_file_range": set(), "sendfile": set()}
+
+IS_LINUX = sys.platform.startswith("linux")
+
+
+class _MethodFallback(Exception):
+    # A kernel method copied nothing (some procfs, FUSE and CIFS files report
+    # 0 bytes at the start); copy_file moves on to the next method
+    pass
+
+
+class CopyInterrupted(Exception):
+    # Raised when cancel_event stops a copy part-way; the partial file and
+    # its checkpoint are kept so the next run resumes it
+    pass
+
+
+class Checkpoint:
+    # Tracks how far a copy has got, fsyncs and records the offset every
+    # CHECKPOINT_BYTES, charges each chunk to the throttle, and stops the copy
+    # when cancel_event is set.
+    def __init__(self, ckpt_fp, src_st, dst_fd, offset, cancel_event=None, throttle=None):
+        self.ckpt_fp = ckpt_fp
+        self.src_st = src_st
+        self.dst_fd = dst_fd
+        self.cancel_event = cancel_event
+        self.throttle = throttle
+        self.enabled = src_st.st_size >= CHECKPOINT_BYTES
+        self.saved = offset
+        self.offset = offset
+        self.chunk = KERNEL_CHUNK if throttle is None else THROTTLED_CHUNK
+        # Whether the copy loops need to call this after every chunk at all
+        self.active = self.enabled or cancel_event is not None or throttle is not None
+
+    def save(self, offset):
+        os.fsync(self.dst_fd)
+        tmp_fp = self.ckpt_fp + ".tmp"
+        with open(tmp_fp, "w") as f:
+            json.dump({"size": self.src_st.st_size, "mtime_ns": self.src_st.st_mtime_ns,
+                       "offset": offset}, f)
+        os.replace(tmp_fp, self.ckpt_fp)
+        self.saved = offset
+
+    def __call__(self, offset):
+        # Called by the copy loops after every chunk with the bytes written so far
+        if self.throttle is not None:
+            self.throttle.consume(offset - self.offset, self.cancel_event)
+        self.offset = offset
+        cancelled = self.cancel_event is not None and self.cancel_event.is_set()
+        if self.enabled and (cancelled or offset - self.saved >= CHECKPOINT_BYTES):
+            self.save(offset)
+        if cancelled:
+            raise CopyInterrupted("copy interrupted; it will resume on the next run")
+
+
+def resume_offset(fsrc, src_st, tmp_fp, ckpt_fp):
+    # Offset an interrupted copy of this source can continue from, or 0
+    try:
+        with open(ckpt_fp) as f:
+            ckpt = json.load(f)
+        offset = min(int(ckpt["offset"]), os.path.getsize(tmp_fp))
+    except (OSError, ValueError, KeyError, TypeError):
+        return 0
+    if ckpt.get("size") != src_st.st_size or ckpt.get("mtime_ns") != src_st.st_mtime_ns:
+        return 0
+    if offset <= 0 or offset > src_st.st_size:
+        return 0
+    # Only trust the partial file if its last bytes still match the source
+    check = min(RESUME_CHECK_BYTES, offset)
+    fsrc.seek(offset - check)
+    with open(tmp_fp, "rb") as ftmp:
+        ftmp.seek(offset - check)
+        if ftmp.read(check) != fsrc.read(check):
+            return 0
+    return offset
+
+
+def _reflink(src_fd, dst_fd, offset, size, checkpoint):
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def _check_copied(name, offset, copied, size):
+    # Called when a kernel method returned 0 before reaching size
+    if copied == offset:
+        raise _MethodFallback(name)
+    raise OSError(f"{name} stopped at {copied} of {size} bytes; the source may have shrunk")
+
+
+def _copy_file_range(src_fd, dst_fd, offset, size, checkpoint):
+    copied = offset
+    while copied < size:
+        n = os.copy_file_range(src_fd, dst_fd, min(size - copied, checkpoint.chunk), copied, copied)
+        if n == 0:
+            _check_copied("copy_file_range", offset, copied, size)
+        copied += n
+        checkpoint(copied)
+
+
+def _sendfile(src_fd, dst_fd, offset, size, checkpoint):
+    copied = offset
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    while copied < size:
+        n = os.sendfile(dst_fd, src_fd, copied, min(size - copied, checkpoint.chunk))
+        if n == 0:
+            _check_copied("sendfile", offset, copied, size)
+        copied += n
+        checkpoint(copied)
+
+
+def _kernel_methods():
+    methods = []
+    if IS_LINUX and fcntl is not None:
+        methods.append(("reflink", _reflink))
+    if hasattr(os, "copy_file_range"):
+        methods.append(("copy_file_range", _copy_file_range))
+    if IS_LINUX and hasattr(os, "sendfile"):
+        methods.append(("sendfile", _sendfile))
+    return methods
+
+
+KERNEL_METHODS = _kernel_methods()
+
+
+def _buffered(fsrc, fdst, buffer_size, hasher, offset, checkpoint):
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    copied = offset
+    while True:
+        n = fsrc.readinto(buf)
+        if not n:
+            break
+        if hasher is not None:
+            hasher.update(view[:n])
+        fdst.write(view[:n])
+        copied += n
+        if checkpoint.active:
+            fdst.flush()
+            checkpoint(copied)
+
+
+def _hash_prefix(fsrc, hasher, offset, buffer_size):
+    # Feed the already-copied part of the source to the hasher when resuming
+    fsrc.seek(0)
+    remaining = offset
+    while remaining:
+        chunk = fsrc.read(min(buffer_size, remaining))
+        if not chunk:
+            break
+        hasher.update(chunk)
+        remaining -= len(chunk)
+
+
+def copy_file(src_fp, dst_fp, buffer_size=DEFAULT_BUFFER_SIZE, hasher=None, cancel_event=None,
+              throttle=None):
+    # Copy data and metadata from src_fp to dst_fp; return the method used
+    tmp_fp = dst_fp + PARTIAL_SUFFIX
+    ckpt_fp = dst_fp + CHECKPOINT_SUFFIX
+    with open(src_fp, "rb") as fsrc:
+        src_st = os.fstat(fsrc.fileno())
+        offset = 0
+        if os.path.exists(tmp_fp):
+            offset = resume_offset(fsrc, src_st, tmp_fp, ckpt_fp)
+        if hasher is not None and offset:
+            _hash_prefix(fsrc, hasher, offset, buffer_size)
+        fdst = open(tmp_fp, "r+b" if offset else "wb")
+        try:
+            src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+            checkpoint = Checkpoint(ckpt_fp, src_st, dst_fd, offset, cancel_event, throttle)
+            method = None
+            devices = (src_st.st_dev, os.fstat(dst_fd).st_dev)
+            methods = KERNEL_METHODS if hasher is None else ()
+            for name, func in methods:
+                if devices in _unsupported[name] or (name == "reflink" and offset):
+                    continue
+                # Start (again) from the resume offset with nothing after it
+                fdst.truncate(offset)
+                fsrc.seek(offset)
+                fdst.seek(offset)
+                try:
+                    func(src_fd, dst_fd, offset, src_st.st_size, checkpoint)
+                    method = name
+                    break
+                except _MethodFallback:
+                    continue
+                except OSError as e:
+                    if e.errno not in UNSUPPORTED_ERRNOS:
+                        raise
+                    _unsupported[name].add(devices)
+            if method is None:
+                fdst.truncate(offset)
+                fsrc.seek(offset)
+                fdst.seek(offset)
+                _buffered(fsrc, fdst, buffer_size, hasher, offset, checkpoint)
+                method = "buffered" if hasher is None else "buffered+hash"
+            if offset:
+                method += "+resumed"
+            # On disk before the rename, so a crash cannot leave a dst (already
+            # recorded in the manifest) with missing data
+            fdst.flush()
+            os.fsync(dst_fd)
+            fdst.close()
+        except BaseException:
+            fdst.close()
+            # Without a checkpoint there is nothing to resume from
+            if not os.path.exists(ckpt_fp):
+                os.remove(tmp_fp)
+            raise
+    shutil.copystat(src_fp, tmp_fp)
+    os.replace(tmp_fp, dst_fp)
+    if os.path.exists(ckpt_fp):
+        os.remove(ckpt_fp)
+    return method
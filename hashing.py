@@ -0,0 +1,49 @@
+# hashing.py
+#
+# Content hashing shared by the verify mode and the Archive store.
+# BLAKE2b is always available; hashlib releases the GIL while hashing, so
+# the copy pools hash files in parallel across cores.
+
+import hashlib
+import os
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class VerifyError(Exception):
+    pass
+
+
+def new_hasher():
+    return hashlib.blake2b(digest_size=32)
+
+
+def hash_file(path, chunk_size=HASH_CHUNK_SIZE, throttle=None):
+    # throttle, if given, is charged for every chunk read (see throttle.py)
+    h = new_hasher()
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    with open(path, "rb") as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+            if throttle is not None:
+                throttle.consume(n)
+    return h.hexdigest()
+
+
+def drop_cache(path):
+    # Flush path and ask the OS to drop it from the page cache, so reading it
+    # back checks what reached the disk. Only possible where posix_fadvise exists.
+    if not hasattr(os, "posix_fadvise"):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -5,14 +5,30 @@ HELP_LOG_TEXT = (
     "<b>How to Specify Log File:</b><br><br>"
     "Open the Settings dialog from the File menu.<br>"
     "Click the 'Browse...' button to choose a folder and enter a file name for your log file. "
-    "You must provide a file name (e.g., backup_log.txt).<br>"
-    "After selecting or entering the file name, click OK to save your choice."
+    "You must provide a file name (e.g., backup_log.jsonl).<br>"
+    "After selecting or entering the file name, click OK to save your choice.<br><br>"
+    "The log is written in JSON Lines format: one line per copied, deleted or failed file "
+    "(with its size, time taken and copy method) and a summary line at the end of every run. "
+    "Each run is appended to the file; once it grows past 50 MB it is renamed to "
+    "'.1', '.2', ... and a new file is started."
 )
 
 HELP_ACTIONS_TITLE = "Backup Actions"
 HELP_ACTIONS_TEXT = (
     "<b>Backup Actions:</b><br><br>"
-    "<b>Sync:</b> Makes the destination an exact mirror of the source. Files/folders not in the source are deleted from the destination.<br>"
+    "<b>Sync:</b> Makes the destination an exact mirror of the source. Files/folders not in the source are deleted from the destination. "
+    "Use the 'Preview' button to see what would be created, updated and deleted before running it.<br>"
     "<b>Copy:</b> Copies all files from source to destination, but does not delete anything at the destination.<br>"
-    "<b>Archive:</b> (Not yet implemented) Will eventually move replaced or deleted files to an archive folder before syncing."
+    "<b>Archive:</b> Mirrors the source like Sync, but first moves every replaced or deleted file into "
+    "the '.backup_archive' folder at the destination, in a snapshot folder named after the run's date and time. "
+    "Identical file contents are stored only once, no matter how many snapshots contain them. "
+    "With 'Packed' archive storage (File > Settings), files under 4 MB are instead stored in a few large, "
+    "optionally compressed tar files in '.backup_packs', which is much faster for trees with many small files; "
+    "every version is kept and listed in an index so single files can be restored.<br><br>"
+    "<b>Bandwidth limit:</b> Set in File > Settings. It caps the total copy rate of all actions so a running "
+    "backup does not slow down the computer; 'Low' or 'Idle' priority also lowers the disk and CPU priority of the copy. "
+    "Different limits for different times of day can be added as 'bandwidth_schedule' in settings.json.<br><br>"
+    "<b>Restore:</b> File > Restore... shows the destination as it was at any date and time, including "
+    "archived and packed versions. Open folders, search with patterns like 'Footage/*.mov', and restore "
+    "the selected files and folders into any folder."
 )
@@ -0,0 +1,209 @@
+# jobs.py
+#
+# Named backup jobs and a scheduler that runs them. Jobs live in settings.json
+# under "jobs"; each one overrides the top-level settings for its run:
+#
+#   "jobs": [
+#       {"name": "Pennsylvania", "action": "Copy",
+#        "source_dir": "C:/Video Projects/2025 - Pennsylvania",
+#        "destination_dir": "D:/2025 - Pennsylvania",
+#        "create_log": true, "log_dir": "D:/logs/pennsylvania.jsonl"}
+#   ]
+#
+# Jobs whose destinations are on different physical disks run at the same
+# time; jobs that share a disk run one after another, in the order listed,
+# so they don't fight over the same drive heads or USB link.
+#
+# Nothing in here imports Qt.
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backup_engine import run_backup
+from metrics import Metrics, Profiler, PROFILE_MODES, write_metrics
+from run_log import RunLog
+from throttle import Throttle
+
+ACTIONS = ("Sync", "Copy", "Archive")
+# Keys a job may set, mapped to the settings key they override
+JOB_KEYS = {
+    "action": "selected_action",
+    "source_dir": "source_dir",
+    "destination_dir": "destination_dir",
+    "create_log": "create_log",
+    "log_dir": "log_dir",
+    "verify": "verify",
+    "copy_workers": "copy_workers",
+}
+
+
+def find_job(settings, name):
+    for job in settings.get("jobs", []):
+        if job.get("name") == name:
+            return job
+    return None
+
+
+def job_settings(settings, job):
+    # Top-level settings with the job's own values laid over them
+    merged = dict(settings)
+    for key, target in JOB_KEYS.items():
+        if key in job:
+            merged[target] = job[key]
+    return merged
+
+
+def job_from_settings(name, settings):
+    # Job profile holding the current top-level settings (used by "Save as Job")
+    return {
+        "name": name,
+        "action": settings.get("selected_action", "Sync"),
+        "source_dir": settings.get("source_dir", ""),
+        "destination_dir": settings.get("destination_dir", ""),
+        "create_log": settings.get("create_log", False),
+        "log_dir": settings.get("log_dir", ""),
+        "verify": settings.get("verify", False),
+    }
+
+
+def physical_device(path):
+    # Identifier for the disk that holds path. On Linux partitions are mapped
+    # to their parent disk through /sys, so two partitions of one drive count
+    # as the same device; elsewhere the volume (st_dev) is used.
+    try:
+        dev = os.stat(path).st_dev
+    except OSError:
+        return path
+    if not hasattr(os, "major"):  # Windows
+        return dev
+    sys_path = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+    if os.path.exists(sys_path):
+        real = os.path.realpath(sys_path)
+        if os.path.exists(os.path.join(real, "partition")):
+            real = os.path.dirname(real)
+        return os.path.basename(real)
+    return dev
+
+
+def group_by_device(jobs):
+    # {device: [jobs in listed order]}; each group runs sequentially
+    groups = {}
+    for job in jobs:
+        groups.setdefault(physical_device(job.get("destination_dir", "")), []).append(job)
+    return groups
+
+
+def check_job(settings):
+    # Error message for a job that cannot start, or None
+    action = settings.get("selected_action")
+    if action not in ACTIONS:
+        return f"Unknown action: {action}"
+    for name in ("source", "destination"):
+        folder = settings.get(f"{name}_dir", "")
+        if not folder or not os.path.isdir(folder):
+            return f"The {name} folder does not exist: {folder}"
+    profile = settings.get("profile") or ""
+    if profile and profile not in PROFILE_MODES:
+        return f"Unknown profile mode: {profile} (use {' or '.join(PROFILE_MODES)})"
+    return None
+
+
+def run_job(settings, cancel_event=None, on_progress=None, name=None, paths=None, metrics=None,
+            throttle=None):
+    # Run one backup with its log and return a JSON-ready result dict with
+    # "status" one of ok, errors, cancelled, failed or usage. paths limits
+    # the run to those source paths (see backup_engine.run_backup). throttle
+    # is shared with other jobs running at the same time; without one the
+    # job builds its own from settings.
+    # metrics (see metrics.py) is created when settings ask for a metrics
+    # file or a profile; its numbers are added to the result as "metrics".
+    action = settings["selected_action"]
+    source_folder = settings["source_dir"]
+    destination_folder = settings["destination_dir"]
+    result = {"action": action, "source": source_folder, "destination": destination_folder}
+    if name is not None:
+        result = {"job": name, **result}
+    error = check_job(settings)
+    if error:
+        result.update(status="usage", error=error)
+        return result
+
+    log_path = settings["log_dir"] if settings.get("create_log") else None
+    log = RunLog(log_path, action, source_folder, destination_folder,
+                 bool(settings.get("verify", False)))
+    log.open()
+    metrics_file = settings.get("metrics_file") or ""
+    profiler = Profiler.from_settings(settings)
+    if metrics is None and (metrics_file or profiler is not None):
+        metrics = Metrics()
+    start = time.monotonic()
+    stats = None
+    if profiler is not None:
+        profiler.start()
+    try:
+        stats = run_backup(action, source_folder, destination_folder, settings,
+                           on_progress, cancel_event, log.file, throttle, paths=paths,
+                           metrics=metrics)
+    except Exception as e:
+        result.update(status="failed", error=str(e))
+    finally:
+        if profiler is not None:
+            result["profile_file"] = profiler.stop(metrics)
+    log.close(stats)
+    result["seconds"] = round(time.monotonic() - start, 3)
+    if metrics is not None:
+        result["metrics"] = metrics.as_dict()
+    if metrics_file:
+        try:
+            write_metrics(metrics, metrics_file)
+        except OSError as e:
+            result["metrics_error"] = str(e)
+    if log.error is not None:
+        result["log_error"] = str(log.error)
+    if stats is not None:
+        result.update(stats.as_dict())
+        if stats.cancelled:
+            result["status"] = "cancelled"
+        elif stats.errors:
+            result["status"] = "errors"
+        else:
+            result["status"] = "ok"
+    return result
+
+
+def run_jobs(jobs, settings, cancel_event=None, on_start=None, on_result=None,
+             on_progress=None):
+    # Run jobs with one thread per destination device. on_start(job) and
+    # on_result(job, result) are called from those threads as jobs begin and
+    # end; on_progress(job, stats) is passed through to the engine.
+    # Returns the results in the order the jobs were given.
+    # All jobs share one throttle, so jobs running side by side stay within
+    # bandwidth_limit_mb together (jobs cannot override the limit).
+    if cancel_event is None:
+        cancel_event = threading.Event()
+    throttle = Throttle.from_settings(settings)
+    results = {}
+
+    def run_group(group):
+        for job in group:
+            if cancel_event.is_set():
+                result = {"job": job.get("name"), "status": "cancelled", "error": "not started"}
+            else:
+                if on_start:
+                    on_start(job)
+                progress = None
+                if on_progress:
+                    progress = lambda stats, job=job: on_progress(job, stats)
+                result = run_job(job_settings(settings, job), cancel_event, progress,
+                                 name=job.get("name"), throttle=throttle)
+            results[id(job)] = result
+            if on_result:
+                on_result(job, result)
+
+    groups = group_by_device(jobs)
+    with ThreadPoolExecutor(max_workers=max(1, len(groups))) as pool:
+        for future in [pool.submit(run_group, group) for group in groups.values()]:
+            future.result()
+    return [results[id(job)] for job in jobs]
@@ -0,0 +1,435 @@
+# metrics.py
+#
+# Instrumentation for finding out where a slow backup spends its time.
+# A Metrics object is passed to the engine (run_backup(..., metrics=...)) and
+# records:
+#
+#   phases      time the coordinating thread spends in each step, exclusive
+#               of nested steps: "scan" (enumerating/planning), "stat"
+#               (stat and manifest lookups), "mkdir", "archive" (moving old
+#               versions away), "delete", "wait" (blocked on the copy pools),
+#               "manifest" (recording finished files) and "progress" (the
+#               on_progress callback, i.e. GUI updates)
+#   histograms  per-file latency of work done on the pools: "copy", "verify"
+#               and "pack" (one observation per segment)
+#   counters    files and bytes per operation, including "skip" and "error"
+#   queue       files handed to the pools and not finished yet (in flight)
+#
+# Counters and histograms accumulate over every run that uses the same
+# Metrics (a watch session), as Prometheus expects; the phases and queue
+# gauges describe the latest run. Without metrics the engine uses
+# NULL_METRICS, whose methods do nothing, so the copy loop keeps its speed.
+#
+# Exports: as_dict() (JSON), prometheus_text() (Prometheus text format),
+# write_metrics() to a file (".prom" for the textfile collector, JSON
+# otherwise) and MetricsServer, a local http://127.0.0.1:<port>/metrics
+# endpoint. Profiler adds an optional cProfile or tracemalloc capture of a run.
+# http.server, cProfile and tracemalloc are only imported when used, since
+# the engine imports this module for every run.
+#
+# Nothing in here imports Qt.
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+PHASES = ("scan", "stat", "mkdir", "archive", "delete", "wait", "manifest", "progress")
+# Operations with a latency histogram
+TIMED_OPS = ("copy", "verify", "pack")
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+           30.0, 60.0, 300.0)
+PROFILE_MODES = ("cprofile", "tracemalloc")
+METRICS_FILE_MODE = 0o644
+# Lines of allocation statistics written by a tracemalloc capture
+TRACEMALLOC_TOP = 30
+TRACEMALLOC_FRAMES = 10
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation (None when
+        # empty, inf when beyond the last bucket)
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], self.counts)),
+        }
+
+
+class Metrics:
+    # Phases are only entered on the thread running the engine (the pools'
+    # timings reach it through their futures), so no locking is needed there;
+    # readers on other threads take copies.
+    def __init__(self):
+        self.phase_seconds = {name: 0.0 for name in PHASES}
+        self.stack = []
+        self.histograms = {op: Histogram() for op in TIMED_OPS}
+        self.files = {}
+        self.bytes = {}
+        self.queue_depth = 0
+        self.queue_max = 0
+        self.queue_samples = 0
+        self.queue_total = 0
+        self.workers = 0
+        self.runs = 0
+        self.running = False
+        self.run_start = 0.0
+        self.run_seconds = 0.0
+        # totals() when the current run began, for its rates
+        self.run_base = (0, 0, 0.0)
+        # Set by Profiler for tracemalloc captures
+        self.peak_memory = None
+
+    def begin(self, workers=0):
+        # Called by run_backup at the start of every run
+        self.phase_seconds = {name: 0.0 for name in PHASES}
+        self.stack = []
+        self.queue_depth = self.queue_max = self.queue_samples = self.queue_total = 0
+        self.workers = workers
+        self.runs += 1
+        self.running = True
+        self.run_start = time.perf_counter()
+        self.run_seconds = 0.0
+        self.run_base = self.totals()
+
+    def end(self):
+        self.run_seconds = time.perf_counter() - self.run_start
+        self.running = False
+
+    def totals(self):
+        # (files, bytes copied, seconds the pools spent) so far; segments
+        # ("pack") are not files
+        files = sum(n for op, n in dict(self.files).items() if op != "pack")
+        busy = sum(h.sum for h in self.histograms.values())
+        return files, self.bytes.get("copy", 0), busy
+
+    def run_rates(self):
+        # (files per second, bytes copied per second, share of the pool
+        # threads' time spent working) for the current or last run
+        elapsed = self.elapsed()
+        if not elapsed:
+            return 0.0, 0.0, None
+        files, copied, busy = (now - base for now, base in zip(self.totals(), self.run_base))
+        pool_busy = busy / (elapsed * self.workers) if self.workers else None
+        return files / elapsed, copied / elapsed, pool_busy
+
+    def elapsed(self):
+        return time.perf_counter() - self.run_start if self.running else self.run_seconds
+
+    def enter(self, phase):
+        # Time from here until leave() counts towards phase and not towards
+        # the phase that was running
+        now = time.perf_counter()
+        if self.stack:
+            top = self.stack[-1]
+            self.phase_seconds[top[0]] += now - top[1]
+        self.stack.append([phase, now])
+
+    def leave(self):
+        if not self.stack:
+            return
+        now = time.perf_counter()
+        phase, start = self.stack.pop()
+        self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + now - start
+        if self.stack:
+            self.stack[-1][1] = now
+
+    def switch(self, phase):
+        # leave() the current phase and enter() another
+        self.leave()
+        self.enter(phase)
+
+    def timed(self, iterable, phase):
+        # Yield from iterable, counting the time spent producing each item
+        # (walking the tree, planning) towards phase
+        it = iter(iterable)
+        while True:
+            self.enter(phase)
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                self.leave()
+            yield item
+
+    def observe(self, op, seconds=0.0, size=0):
+        self.files[op] = self.files.get(op, 0) + 1
+        self.bytes[op] = self.bytes.get(op, 0) + size
+        if op in self.histograms:
+            self.histograms[op].observe(seconds)
+
+    def queue(self, depth):
+        self.queue_depth = depth
+        self.queue_max = max(self.queue_max, depth)
+        self.queue_samples += 1
+        self.queue_total += depth
+
+    def as_dict(self):
+        elapsed = self.elapsed()
+        files_per_second, bytes_per_second, pool_busy = self.run_rates()
+        return {
+            "runs": self.runs,
+            "running": self.running,
+            "seconds": round(elapsed, 3),
+            "phases": {name: round(seconds, 4) for name, seconds in dict(self.phase_seconds).items()},
+            "files": dict(self.files),
+            "bytes": dict(self.bytes),
+            "files_per_second": round(files_per_second, 1),
+            "copy_bytes_per_second": round(bytes_per_second),
+            "pool_busy": round(pool_busy, 3) if pool_busy is not None else None,
+            "queue": {
+                "depth": self.queue_depth,
+                "max": self.queue_max,
+                "mean": round(self.queue_total / self.queue_samples, 1) if self.queue_samples else 0.0,
+            },
+            "latency": {op: h.as_dict() for op, h in self.histograms.items()},
+            "peak_memory": self.peak_memory,
+        }
+
+    def prometheus_text(self, prefix="backup"):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{prefix}_{name}{{{label_text}}} {value}" if label_text
+                             else f"{prefix}_{name} {value}")
+
+        metric("runs_total", "counter", "Backup runs started", [((), self.runs)])
+        metric("running", "gauge", "1 while a run is in progress", [((), int(self.running))])
+        metric("run_seconds", "gauge", "Wall time of the current or last run",
+               [((), round(self.elapsed(), 3))])
+        metric("phase_seconds", "gauge",
+               "Time the engine thread spent in each phase of the current or last run",
+               [((("phase", name),), round(seconds, 6))
+                for name, seconds in dict(self.phase_seconds).items()])
+        metric("files_total", "counter", "Files handled, by operation",
+               [((("op", op),), n) for op, n in sorted(dict(self.files).items())])
+        metric("bytes_total", "counter", "Bytes handled, by operation",
+               [((("op", op),), n) for op, n in sorted(dict(self.bytes).items())])
+        metric("queue_depth", "gauge", "Files handed to the copy pools and not finished",
+               [((), self.queue_depth)])
+        metric("queue_depth_max", "gauge", "Highest queue depth of the current or last run",
+               [((), self.queue_max)])
+        lines.append(f"# HELP {prefix}_file_seconds Time per file (per segment for pack) "
+                     "on the worker pools")
+        lines.append(f"# TYPE {prefix}_file_seconds histogram")
+        for op, h in self.histograms.items():
+            cumulative = 0
+            for bound, n in zip([str(b) for b in BUCKETS] + ["+Inf"], h.counts):
+                cumulative += n
+                lines.append(f'{prefix}_file_seconds_bucket{{op="{op}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_file_seconds_sum{{op="{op}"}} {round(h.sum, 6)}')
+            lines.append(f'{prefix}_file_seconds_count{{op="{op}"}} {h.count}')
+        if self.peak_memory is not None:
+            metric("peak_traced_memory_bytes", "gauge", "Peak memory traced by tracemalloc",
+                   [((), self.peak_memory)])
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        # One line for the GUI's stats panel
+        phases = sorted(dict(self.phase_seconds).items(), key=lambda item: -item[1])
+        parts = [", ".join(f"{name} {seconds:.1f}s" for name, seconds in phases[:3] if seconds >= 0.05)]
+        copy = self.histograms["copy"]
+        if copy.count:
+            parts.append(f"copy p50 {format_seconds(copy.quantile(0.5))} "
+                         f"p95 {format_seconds(copy.quantile(0.95))}")
+        parts.append(f"queue {self.queue_depth} (max {self.queue_max})")
+        files_per_second, bytes_per_second, pool_busy = self.run_rates()
+        parts.append(f"{files_per_second:.0f} files/s")
+        if pool_busy is not None:
+            parts.append(f"pools {pool_busy:.0%} busy")
+        return " | ".join(part for part in parts if part)
+
+
+class NullMetrics(Metrics):
+    # Stands in when nothing is being measured
+    def begin(self, workers=0):
+        pass
+
+    def end(self):
+        pass
+
+    def enter(self, phase):
+        pass
+
+    def leave(self):
+        pass
+
+    def switch(self, phase):
+        pass
+
+    def timed(self, iterable, phase):
+        return iterable
+
+    def observe(self, op, seconds=0.0, size=0):
+        pass
+
+    def queue(self, depth):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    if seconds == float("inf"):
+        return f">{BUCKETS[-1]:.0f}s"
+    return f"{seconds * 1000:.0f}ms" if seconds < 1 else f"{seconds:.1f}s"
+
+
+def write_metrics(metrics, path):
+    # Prometheus text for ".prom" files (node_exporter's textfile collector),
+    # JSON otherwise. Written atomically, so a scraper never reads half a file.
+    if path.endswith(".prom"):
+        text = metrics.prometheus_text()
+    else:
+        text = json.dumps(metrics.as_dict(), indent=2) + "\n"
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_fp = tempfile.mkstemp(dir=folder, prefix=".metrics-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        # mkstemp creates the file readable by its owner only; a collector
+        # usually runs as another user
+        os.chmod(tmp_fp, METRICS_FILE_MODE)
+        os.replace(tmp_fp, path)
+    except BaseException:
+        if os.path.exists(tmp_fp):
+            os.remove(tmp_fp)
+        raise
+
+
+class MetricsServer:
+    # Serves metrics.prometheus_text() at http://127.0.0.1:<port>/metrics from
+    # a daemon thread. Only bound to localhost.
+    def __init__(self, metrics, port, host="127.0.0.1"):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        self.metrics = metrics
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = server.metrics.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class Profiler:
+    # Optional capture around one run, from settings.json:
+    #
+    #   "profile": "cprofile"       pstats file of the engine thread (view with
+    #                               python -m pstats, snakeviz, ...)
+    #   "profile": "tracemalloc"    text report of the biggest allocation sites
+    #   "profile_file": "..."       where to write it (default: temp directory)
+    #
+    # cProfile only sees the thread that runs the engine; time on the copy
+    # pools shows up in the metrics' latency histograms instead.
+    def __init__(self, mode, path=None):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode} (use {' or '.join(PROFILE_MODES)})")
+        self.mode = mode
+        if not path:
+            suffix = ".prof" if mode == "cprofile" else ".txt"
+            stamp = time.strftime("%Y-%m-%d_%H%M%S")
+            path = os.path.join(tempfile.gettempdir(), f"backup-{mode}-{stamp}{suffix}")
+        self.path = path
+        self.profile = None
+        self.started_tracemalloc = False
+
+    @classmethod
+    def from_settings(cls, settings):
+        # None when no profile is configured
+        mode = settings.get("profile") or ""
+        if not mode:
+            return None
+        return cls(mode, settings.get("profile_file") or None)
+
+    def start(self):
+        import tracemalloc
+        if self.mode == "cprofile":
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.started_tracemalloc = True
+        else:
+            tracemalloc.reset_peak()
+
+    def stop(self, metrics=None):
+        # Write the capture and return its path (None if there was nothing to write)
+        import tracemalloc
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if self.mode == "cprofile":
+            self.profile.disable()
+            self.profile.dump_stats(self.path)
+            return self.path
+        if not tracemalloc.is_tracing():
+            # Stopped by a capture of another job that ran at the same time
+            return None
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+        if metrics is not None:
+            metrics.peak_memory = peak
+        with open(self.path, "w") as f:
+            f.write(f"Traced memory: {current} bytes at the end, {peak} bytes peak\n\n")
+            for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP]:
+                f.write(f"{stat}\n")
+        return self.path
@@ -0,0 +1,266 @@
+# pack_store.py
+#
+# Packed storage for the Archive action ("archive_format": "packed" in
+# settings.json). Instead of one destination file per source file, small
+# files are streamed into tar segments, optionally compressed:
+#
+#   <destination>/.backup_packs/segments/2025-08-08_101500_123456-00001.tar[.gz|.zst|.lz4]
+#   <destination>/.backup_packs/index.db
+#
+# Files of PACK_FILE_LIMIT or more pass through as ordinary files. Every run
+# adds new segments only, so older versions stay in older segments: each
+# segment name is reserved by creating an empty file with O_EXCL, and the
+# finished segment only ever replaces that reservation. The
+# index records one row per version of every path:
+#
+#   kind "packed"   in segment, data at offset (in the uncompressed stream)
+#   kind "file"     stored as a plain file at <destination>/<path>
+#   kind "deleted"  removed from the source at that run
+#
+# and is what the catalog (catalog.py) uses to read files back with
+# extract_members() without unpacking anything else: a plain seek for
+# uncompressed segments, otherwise at most one segment is decompressed up to
+# the files.
+#
+# zstd needs the "zstandard" package and lz4 the "lz4" package; "none" and
+# "gzip" only need the standard library.
+
+import gzip
+import os
+import sqlite3
+import tarfile
+import time
+
+from hashing import new_hasher
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+PACK_DIR_NAME = ".backup_packs"
+INDEX_NAME = "index.db"
+# Files smaller than this are packed; bigger ones (media) are copied as they are
+PACK_FILE_LIMIT = 4 * 1024 * 1024
+# Uncompressed data per segment; also bounds what a restore has to decompress
+SEGMENT_BYTES = 64 * 1024 * 1024
+DEFAULT_PACK_WORKERS = 2
+# Segment file extension for each compression
+COMPRESSIONS = {"none": ".tar", "gzip": ".tar.gz", "zstd": ".tar.zst", "lz4": ".tar.lz4"}
+SEGMENT_PARTIAL_SUFFIX = ".partial"
+RESTORE_CHUNK_SIZE = 1024 * 1024
+
+
+def check_compression(compression):
+    # Raise ValueError when compression is unknown or its package is missing
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown pack compression: {compression}")
+    if compression == "zstd" and zstandard is None:
+        raise ValueError("zstd compression needs the zstandard package (pip install zstandard)")
+    if compression == "lz4" and lz4_frame is None:
+        raise ValueError("lz4 compression needs the lz4 package (pip install lz4)")
+
+
+def open_segment(path, mode, compression):
+    # Binary file object for reading ("rb") or writing ("wb") a segment
+    if compression == "gzip":
+        return gzip.open(path, mode, compresslevel=6)
+    if compression == "zstd":
+        raw = open(path, mode)
+        if mode == "wb":
+            return zstandard.ZstdCompressor(level=3).stream_writer(raw)
+        return zstandard.ZstdDecompressor().stream_reader(raw)
+    if compression == "lz4":
+        return lz4_frame.open(path, mode)
+    return open(path, mode)
+
+
+class HashingReader:
+    # Wraps a file so tarfile's reads also feed a hasher
+    def __init__(self, f, hasher):
+        self.f = f
+        self.hasher = hasher
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.hasher.update(data)
+        return data
+
+
+def pack_segment(segment_fp, compression, files, cancel_event=None, throttle=None):
+    # Runs on a pool thread. Writes files, a list of (src_fp, rel_path), into
+    # the segment reserved by PackStore.new_segment (the reservation is
+    # removed again if nothing is packed) and returns (rows, errors): rows
+    # are (rel_path, st, offset, digest) for every packed file and errors
+    # (src_fp, exception) for files that could not be opened. A read error
+    # part-way through a file fails the whole segment, since the tar stream
+    # can no longer be trusted.
+    # Stops early, keeping what was packed so far, when cancel_event is set.
+    rows = []
+    errors = []
+    tmp_fp = segment_fp + SEGMENT_PARTIAL_SUFFIX
+    try:
+        with open_segment(tmp_fp, "wb", compression) as out:
+            with tarfile.open(fileobj=out, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+                for src_fp, rel_path in files:
+                    if cancel_event is not None and cancel_event.is_set():
+                        break
+                    try:
+                        f = open(src_fp, "rb")
+                    except OSError as e:
+                        errors.append((src_fp, e))
+                        continue
+                    with f:
+                        st = os.fstat(f.fileno())
+                        info = tar.gettarinfo(arcname=rel_path.replace(os.sep, "/"), fileobj=f)
+                        hasher = new_hasher()
+                        tar.addfile(info, HashingReader(f, hasher))
+                    # addfile leaves tar.offset just past the data, padded to 512
+                    blocks = (info.size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE
+                    rows.append((rel_path, st, tar.offset - blocks * tarfile.BLOCKSIZE,
+                                 hasher.hexdigest()))
+                    if throttle is not None:
+                        throttle.consume(info.size, cancel_event)
+    except BaseException:
+        for fp in (tmp_fp, segment_fp):
+            if os.path.exists(fp):
+                os.remove(fp)
+        raise
+    if rows:
+        # Replaces the empty file new_segment created, never another run's segment
+        os.replace(tmp_fp, segment_fp)
+    else:
+        os.remove(tmp_fp)
+        os.remove(segment_fp)
+    return rows, errors
+
+
+def extract_members(segment_fp, compression, members, chunk_size=RESTORE_CHUNK_SIZE):
+    # Copy files out of one segment in a single pass. members is a list of
+    # (offset, size, mtime_ns, target_fp), offsets in the segment's tar stream.
+    check_compression(compression)
+    with open_segment(segment_fp, "rb", compression) as src:
+        position = 0
+        for offset, size, mtime_ns, target_fp in sorted(members):
+            if compression == "none":
+                src.seek(offset)
+            else:
+                # Compressed streams cannot seek; read forward to the file
+                skip = offset - position
+                while skip > 0:
+                    data = src.read(min(chunk_size, skip))
+                    if not data:
+                        break
+                    skip -= len(data)
+            remaining = size
+            with open(target_fp, "wb") as out:
+                while remaining > 0:
+                    data = src.read(min(chunk_size, remaining))
+                    if not data:
+                        break
+                    out.write(data)
+                    remaining -= len(data)
+            if remaining:
+                raise OSError(f"{os.path.basename(segment_fp)} ends before the end of {target_fp}")
+            os.utime(target_fp, ns=(mtime_ns, mtime_ns))
+            position = offset + size
+
+
+class PackStore:
+    # Segment naming and the index. Only used from the coordinator thread;
+    # pack_segment does the writing on the pool threads.
+    def __init__(self, destination, compression="none"):
+        check_compression(compression)
+        self.destination = destination
+        self.compression = compression
+        self.root = os.path.join(destination, PACK_DIR_NAME)
+        self.segments_dir = os.path.join(self.root, "segments")
+        os.makedirs(self.segments_dir, exist_ok=True)
+        self.run_time = time.time()
+        self.run_name = (time.strftime("%Y-%m-%d_%H%M%S", time.localtime(self.run_time))
+                         + f"_{int(self.run_time * 1e6) % 1000000:06d}")
+        self.next_segment = 1
+        self.conn = sqlite3.connect(os.path.join(self.root, INDEX_NAME))
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "path TEXT, run REAL, kind TEXT, segment TEXT, compression TEXT, "
+            "offset INTEGER, size INTEGER, mtime_ns INTEGER, digest TEXT)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_path_run ON entries (path, run)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_run ON entries (run)")
+        # Paths found by this run's scan, for unseen_paths
+        self.conn.execute("CREATE TEMP TABLE seen (path TEXT PRIMARY KEY)")
+        self.bytes_packed = 0
+        self.segments_written = 0
+
+    def new_segment(self):
+        # Path of a new segment, reserved by creating it empty; a name that is
+        # taken already is skipped
+        while True:
+            name = f"{self.run_name}-{self.next_segment:05d}{COMPRESSIONS[self.compression]}"
+            self.next_segment += 1
+            segment_fp = os.path.join(self.segments_dir, name)
+            try:
+                os.close(os.open(segment_fp, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+            except FileExistsError:
+                continue
+            return segment_fp
+
+    def current(self, rel_path):
+        # Latest (kind, size, mtime_ns) recorded for rel_path, or None
+        row = self.conn.execute(
+            "SELECT kind, size, mtime_ns FROM entries WHERE path = ? "
+            "ORDER BY run DESC, rowid DESC LIMIT 1", (rel_path,)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def add_seen(self, rel_paths):
+        self.conn.executemany("INSERT OR IGNORE INTO seen VALUES (?)",
+                              [(rel_path,) for rel_path in rel_paths])
+
+    def unseen_paths(self):
+        # Every path whose latest row is not a deletion and that add_seen was
+        # not called with this run, with its kind
+        return self.conn.execute(
+            "SELECT path, kind FROM entries AS e WHERE rowid = ("
+            "SELECT rowid FROM entries WHERE path = e.path "
+            "ORDER BY run DESC, rowid DESC LIMIT 1) AND kind != 'deleted' "
+            "AND path NOT IN (SELECT path FROM seen)"
+        ).fetchall()
+
+    def add_packed(self, segment_fp, rows):
+        segment = os.path.basename(segment_fp)
+        self.conn.executemany(
+            "INSERT INTO entries VALUES (?, ?, 'packed', ?, ?, ?, ?, ?, ?)",
+            [(rel_path, self.run_time, segment, self.compression, offset,
+              st.st_size, st.st_mtime_ns, digest) for rel_path, st, offset, digest in rows],
+        )
+        self.bytes_packed += sum(row[1].st_size for row in rows)
+        self.segments_written += 1
+        self.conn.commit()
+
+    def add_file(self, rel_path, st):
+        self.conn.execute(
+            "INSERT INTO entries VALUES (?, ?, 'file', NULL, NULL, NULL, ?, ?, NULL)",
+            (rel_path, self.run_time, st.st_size, st.st_mtime_ns),
+        )
+
+    def add_deleted(self, rel_path):
+        self.conn.execute(
+            "INSERT INTO entries VALUES (?, ?, 'deleted', NULL, NULL, NULL, NULL, NULL, NULL)",
+            (rel_path, self.run_time),
+        )
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
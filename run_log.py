@@ -0,0 +1,151 @@
+# run_log.py
+#
+# JSON Lines log written while a backup runs. Every run appends to the log
+# file; when it grows past LOG_MAX_BYTES it is rotated to "<log>.1", "<log>.2"
+# and so on, keeping LOG_BACKUPS old files. Records:
+#
+#   {"type": "run_start", "time": ..., "action": ..., "source": ..., "destination": ...}
+#   {"type": "file", "src": ..., "dst": ..., "bytes": ..., "seconds": ...,
+#    "method": ..., "status": "copied" | "deleted" | "error", "error": ...}
+#   {"type": "summary", "time": ..., "seconds": ..., "files_per_second": ...,
+#    "bytes_per_second": ..., plus the run's CopyStats}
+#
+# Records are formatted and written on a background thread, so a slow log
+# drive never holds up the copy loop; file() only puts a tuple on a queue.
+
+import json
+import os
+import queue
+import threading
+import time
+
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUPS = 5
+# Buffer used for the log file; the writer also flushes every LOG_FLUSH_INTERVAL seconds
+LOG_BUFFER_SIZE = 1024 * 1024
+LOG_FLUSH_INTERVAL = 2.0
+
+
+def rotate(path, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+    # Same scheme as logging.handlers.RotatingFileHandler, done once per run
+    try:
+        if os.path.getsize(path) < max_bytes:
+            return
+    except OSError:
+        return
+    for i in range(backups - 1, 0, -1):
+        older = f"{path}.{i}"
+        if os.path.exists(older):
+            os.replace(older, f"{path}.{i + 1}")
+    os.replace(path, f"{path}.1")
+
+
+class RunLog:
+    def __init__(self, path, action, source_folder, destination_folder, verify=False):
+        self.path = path
+        self.action = action
+        self.source_folder = source_folder
+        self.destination_folder = destination_folder
+        self.verify = verify
+        self.error = None
+        self.queue = None
+        self.thread = None
+        self.start_time = 0.0
+
+    def open(self):
+        if not self.path:
+            return
+        try:
+            rotate(self.path)
+            handle = open(self.path, 'a', encoding='utf-8', buffering=LOG_BUFFER_SIZE)
+        except Exception as e:
+            self.error = e
+            return
+        self.start_time = time.monotonic()
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.write_records, args=(handle,), daemon=True)
+        self.thread.start()
+        self.queue.put({
+            "type": "run_start",
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "action": self.action,
+            "source": self.source_folder,
+            "destination": self.destination_folder,
+            "verify": self.verify,
+        })
+
+    def file(self, src_fp, dst_fp, error, method, size, seconds):
+        # Matches the on_file callback of backup_engine.copy_files. Only queues
+        # the raw values; the writer thread builds the record.
+        if self.queue is not None:
+            self.queue.put((src_fp, dst_fp, error, method, size, seconds))
+
+    def write_records(self, handle):
+        last_flush = time.monotonic()
+        try:
+            while True:
+                try:
+                    item = self.queue.get(timeout=LOG_FLUSH_INTERVAL)
+                except queue.Empty:
+                    item = ()
+                if item is None:
+                    break
+                if isinstance(item, tuple) and item:
+                    item = self.file_record(*item)
+                if item:
+                    handle.write(json.dumps(item) + "\n")
+                if time.monotonic() - last_flush >= LOG_FLUSH_INTERVAL:
+                    handle.flush()
+                    last_flush = time.monotonic()
+        except Exception as e:
+            self.error = e
+            # Keep draining so file() callers never block on a dead writer
+            while self.queue.get() is not None:
+                pass
+        finally:
+            try:
+                handle.close()
+            except Exception as e:
+                self.error = e
+
+    def file_record(self, src_fp, dst_fp, error, method, size, seconds):
+        if error is not None:
+            status = "error"
+        elif method == "delete":
+            status = "deleted"
+        else:
+            status = "copied"
+        record = {
+            "type": "file",
+            "src": src_fp,
+            "dst": dst_fp,
+            "bytes": size,
+            "seconds": round(seconds, 6),
+            "method": method,
+            "status": status,
+        }
+        if error is not None:
+            record["error"] = str(error)
+        return record
+
+    def close(self, stats=None):
+        if self.queue is None:
+            return
+        elapsed = time.monotonic() - self.start_time
+        summary = {
+            "type": "summary",
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "action": self.action,
+            "seconds": round(elapsed, 3),
+            "completed": stats is not None,
+        }
+        if stats is not None:
+            summary.update(stats.as_dict())
+            summary["files_per_second"] = round(stats.files_done / elapsed, 2) if elapsed else 0.0
+            summary["bytes_per_second"] = round(stats.bytes_copied / elapsed) if elapsed else 0
+            summary["error_messages"] = stats.errors[:100]
+        self.queue.put(summary)
+        self.queue.put(None)
+        self.thread.join()
+        self.queue = None
+        self.thread = None
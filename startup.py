@@ -0,0 +1,74 @@
+# startup.py
+#
+# Launch timing for the GUI. BackupQT.py marks each step of its startup
+# (imports, QApplication, stylesheet, settings, widgets, first event loop
+# pass) and can print the result:
+#
+#   python BackupQT.py --startup-report          JSON timings on stderr once the window is up
+#   python BackupQT.py --startup-report --quit   ... then exit; exit code 1 when over the target
+#   python BackupQT.py --startup-report --quit --startup-target 800
+#
+# The report also lists whether the backup engine was imported during
+# startup; it should only be loaded when first used (or by preload_modules
+# after the window is shown).
+#
+# Nothing in here imports Qt.
+
+import importlib
+import json
+import sys
+import threading
+import time
+
+# Cold launch budget for the main window, in milliseconds
+STARTUP_TARGET_MS = 1000
+# Modules only needed once a backup, preview, restore or job runs
+DEFERRED_MODULES = ("backup_engine", "backup_worker", "catalog", "jobs", "pack_store", "watch")
+
+
+class StartupTimer:
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.last = self.start
+        self.steps = []
+
+    def mark(self, name):
+        # Time since the previous mark is recorded as step name
+        now = time.perf_counter()
+        self.steps.append((name, now - self.last))
+        self.last = now
+
+    def total_ms(self):
+        return (self.last - self.start) * 1000
+
+    def report(self, target_ms=STARTUP_TARGET_MS):
+        total = self.total_ms()
+        return {
+            "startup_ms": round(total, 1),
+            "target_ms": target_ms,
+            "over_target": total > target_ms,
+            "steps_ms": {name: round(seconds * 1000, 1) for name, seconds in self.steps},
+            "deferred_loaded": [name for name in DEFERRED_MODULES if name in sys.modules],
+            "modules": len(sys.modules),
+        }
+
+    def print_report(self, target_ms=STARTUP_TARGET_MS, file=None):
+        report = self.report(target_ms)
+        print(json.dumps(report), file=file or sys.stderr, flush=True)
+        return report
+
+
+def preload_modules(names=("backup_worker",)):
+    # Import modules on a daemon thread while the window sits idle, so the
+    # first click on Backup does not pay for them. Importing them later on
+    # the GUI thread simply waits for this thread to finish.
+    def run():
+        for name in names:
+            try:
+                importlib.import_module(name)
+            except Exception:
+                # The real import at first use reports the error
+                pass
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
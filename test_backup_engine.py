@@ -0,0 +1,408 @@
+# test_backup_engine.py
+#
+# Tests for the backup engine. Run with "python -m pytest" or
+# "python -m unittest test_backup_engine".
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import archive_store
+import backup_engine
+import fastcopy
+import pack_store
+from archive_store import ARCHIVE_DIR_NAME
+from catalog import Catalog
+from hashing import hash_file
+
+
+class UnreadableSourceTest(unittest.TestCase):
+    # A source folder that cannot be listed must not be mistaken for an
+    # empty one, or Sync (and packed Archive) deletes everything under it
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.src = os.path.join(self.root, "src")
+        self.dst = os.path.join(self.root, "dst")
+        for name in ("clip1.mov", "clip2.mov", "sub/clip3.mov"):
+            path = os.path.join(self.src, "proj", name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(name)
+        with open(os.path.join(self.src, "notes.txt"), "w") as f:
+            f.write("notes")
+        os.makedirs(self.dst)
+        backup_engine.sync_files(self.src, self.dst)
+        self.unreadable = os.path.join(self.src, "proj")
+        real_scandir = os.scandir
+
+        def scandir(path="."):
+            if isinstance(path, str) and os.path.abspath(path) == self.unreadable:
+                raise PermissionError(13, "Permission denied", path)
+            return real_scandir(path)
+        patcher = mock.patch.object(backup_engine.os, "scandir", scandir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def dst_files(self):
+        return sorted(os.path.relpath(os.path.join(dirpath, name), self.dst)
+                      for dirpath, dirnames, filenames in os.walk(self.dst)
+                      for name in filenames if not name.startswith("."))
+
+    def test_dry_run_plans_no_deletions(self):
+        counts = backup_engine.dry_run(self.src, self.dst)
+        self.assertEqual(counts.get("delete", 0), 0)
+        self.assertEqual(counts.get("rmdir", 0), 0)
+        self.assertEqual(counts.get("error"), 1)
+
+    def test_sync_keeps_files_and_reports_error(self):
+        before = self.dst_files()
+        stats = backup_engine.sync_files(self.src, self.dst)
+        self.assertEqual(self.dst_files(), before)
+        self.assertEqual(stats.deleted, 0)
+        self.assertEqual(len(stats.errors), 1)
+        self.assertIn(self.unreadable, stats.errors[0])
+
+    def test_missing_source_folder_is_still_deleted(self):
+        shutil.rmtree(self.unreadable)
+        stats = backup_engine.sync_files(self.src, self.dst)
+        self.assertEqual(self.dst_files(), ["notes.txt"])
+        self.assertEqual(stats.deleted, 3)
+        self.assertEqual(stats.errors, [])
+
+    def test_packed_archive_records_no_deletions(self):
+        settings = {"archive_format": "packed"}
+        backup_engine.run_backup("Archive", self.src, self.dst, settings)
+        stats = backup_engine.run_backup("Archive", self.src, self.dst, settings)
+        self.assertEqual(stats.deleted, 0)
+        self.assertEqual(len(stats.errors), 1)
+        self.assertIn(self.unreadable, stats.errors[0])
+
+
+class DryRunTest(unittest.TestCase):
+    # Each action's preview only lists what that action will do
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.src = os.path.join(self.root, "src")
+        self.dst = os.path.join(self.root, "dst")
+        os.makedirs(os.path.join(self.dst, "old"))
+        os.makedirs(self.src)
+        for path in (os.path.join(self.src, "new.txt"), os.path.join(self.dst, "old", "gone.txt")):
+            with open(path, "w") as f:
+                f.write("data")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_copy_plans_no_deletions(self):
+        ops = []
+        counts = backup_engine.dry_run(self.src, self.dst, on_op=lambda op, path: ops.append(op),
+                                       action="Copy")
+        self.assertEqual(counts, {"create": 1})
+        self.assertEqual(ops, ["create"])
+        counts = backup_engine.dry_run(self.src, self.dst, action="Sync")
+        self.assertEqual(counts, {"create": 1, "delete": 1, "rmdir": 1})
+
+    def test_packed_archive_has_no_preview(self):
+        settings = {"archive_format": "packed"}
+        self.assertIsNotNone(backup_engine.plan_unavailable("Archive", settings))
+        with self.assertRaises(ValueError):
+            backup_engine.dry_run(self.src, self.dst, action="Archive", settings=settings)
+        self.assertIsNone(backup_engine.plan_unavailable("Archive", {}))
+
+
+class CancelAfter:
+    # cancel_event stand-in that becomes set after a number of checks
+    def __init__(self, checks):
+        self.checks = checks
+
+    def is_set(self):
+        self.checks -= 1
+        return self.checks < 0
+
+
+class CopyResumeTest(unittest.TestCase):
+    # An interrupted copy leaves a checkpoint and the next copy continues
+    # from it, on both the kernel and the buffered paths
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.src = os.path.join(self.root, "src.bin")
+        self.dst = os.path.join(self.root, "dst.bin")
+        self.data = os.urandom(256 * 1024)
+        with open(self.src, "wb") as f:
+            f.write(self.data)
+        for name, value in (("CHECKPOINT_BYTES", 32 * 1024), ("KERNEL_CHUNK", 16 * 1024),
+                            ("RESUME_CHECK_BYTES", 4 * 1024)):
+            patcher = mock.patch.object(fastcopy, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def interrupt(self, **kwargs):
+        with self.assertRaises(fastcopy.CopyInterrupted):
+            fastcopy.copy_file(self.src, self.dst, buffer_size=16 * 1024,
+                               cancel_event=CancelAfter(5), **kwargs)
+        self.assertFalse(os.path.exists(self.dst))
+        self.assertTrue(os.path.exists(self.dst + fastcopy.PARTIAL_SUFFIX))
+        self.assertTrue(os.path.exists(self.dst + fastcopy.CHECKPOINT_SUFFIX))
+
+    def check_copied(self, method):
+        self.assertTrue(method.endswith("+resumed"), method)
+        with open(self.dst, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(os.stat(self.dst).st_mtime_ns, os.stat(self.src).st_mtime_ns)
+        for suffix in (fastcopy.PARTIAL_SUFFIX, fastcopy.CHECKPOINT_SUFFIX):
+            self.assertFalse(os.path.exists(self.dst + suffix))
+
+    def test_kernel_copy_resumes(self):
+        methods = [(name, func) for name, func in fastcopy.KERNEL_METHODS if name != "reflink"]
+        if not methods:
+            self.skipTest("no copy_file_range or sendfile here")
+        with mock.patch.object(fastcopy, "KERNEL_METHODS", methods):
+            self.interrupt()
+            self.check_copied(fastcopy.copy_file(self.src, self.dst))
+
+    def test_buffered_copy_resumes_with_the_whole_hash(self):
+        self.interrupt(hasher=hashlib.sha256())
+        hasher = hashlib.sha256()
+        method = fastcopy.copy_file(self.src, self.dst, buffer_size=16 * 1024, hasher=hasher)
+        self.assertEqual(method, "buffered+hash+resumed")
+        self.check_copied(method)
+        self.assertEqual(hasher.hexdigest(), hashlib.sha256(self.data).hexdigest())
+
+    def test_changed_source_starts_over(self):
+        with mock.patch.object(fastcopy, "KERNEL_METHODS", []):
+            self.interrupt()
+            os.utime(self.src, ns=(1, 1))
+            self.assertEqual(fastcopy.copy_file(self.src, self.dst), "buffered")
+        with open(self.dst, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+
+class ManifestSkipTest(unittest.TestCase):
+    # copy_files skips a file only while the manifest and destination agree
+    # it is current
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.src = os.path.join(self.root, "src")
+        self.dst = os.path.join(self.root, "dst")
+        os.makedirs(self.src)
+        os.makedirs(self.dst)
+        self.src_fp = os.path.join(self.src, "a.txt")
+        self.dst_fp = os.path.join(self.dst, "a.txt")
+        with open(self.src_fp, "w") as f:
+            f.write("data")
+        self.assertEqual(self.copy().copied, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def copy(self):
+        stats = backup_engine.run_backup("Copy", self.src, self.dst, {})
+        self.assertEqual(stats.errors, [])
+        return stats
+
+    def test_unchanged_file_is_skipped(self):
+        stats = self.copy()
+        self.assertEqual((stats.copied, stats.skipped), (0, 1))
+
+    def test_touched_source_is_copied_again(self):
+        st = os.stat(self.src_fp)
+        os.utime(self.src_fp, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+        self.assertEqual(self.copy().copied, 1)
+        self.assertEqual(self.copy().skipped, 1)
+
+    def test_damaged_or_missing_copy_is_copied_again(self):
+        with open(self.dst_fp, "w") as f:
+            f.write("da")
+        self.assertEqual(self.copy().copied, 1)
+        os.remove(self.dst_fp)
+        self.assertEqual(self.copy().copied, 1)
+        with open(self.dst_fp) as f:
+            self.assertEqual(f.read(), "data")
+
+    def test_without_manifest_a_matching_mtime_is_skipped(self):
+        os.remove(os.path.join(self.dst, backup_engine.MANIFEST_NAME))
+        self.assertEqual(self.copy().skipped, 1)
+
+
+class PlanSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.src = os.path.join(self.root, "src")
+        self.dst = os.path.join(self.root, "dst")
+        for path in ("src/x/f.txt", "src/y", "dst/x", "dst/y/g.txt", "dst/y/sub/h.txt"):
+            path = os.path.join(self.root, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_file_and_folder_swapped(self):
+        # x was a file and is now a folder; y was a folder and is now a file
+        ops = list(backup_engine.plan_sync(self.src, self.dst))
+        self.assertEqual(ops, [
+            ("delete", "x"),
+            ("delete", os.path.join("y", "sub", "h.txt")),
+            ("rmdir", os.path.join("y", "sub")),
+            ("delete", os.path.join("y", "g.txt")),
+            ("rmdir", "y"),
+            ("mkdir", "x"),
+            ("create", "y"),
+            ("create", os.path.join("x", "f.txt")),
+        ])
+        stats = backup_engine.sync_files(self.src, self.dst)
+        self.assertEqual(stats.errors, [])
+        self.assertTrue(os.path.isfile(os.path.join(self.dst, "x", "f.txt")))
+        self.assertTrue(os.path.isfile(os.path.join(self.dst, "y")))
+        self.assertEqual(backup_engine.dry_run(self.src, self.dst), {"same": 2})
+
+
+class BackupOfBackupTest(unittest.TestCase):
+    # The source is itself a destination (backup drive to offsite drive);
+    # its bookkeeping must not be copied over the target's own
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.first = os.path.join(self.root, "first")
+        self.src = os.path.join(self.root, "src")
+        self.dst = os.path.join(self.root, "dst")
+        for folder in (self.first, self.src, self.dst):
+            os.makedirs(folder)
+        for content in ("old", "a"):
+            with open(os.path.join(self.first, "a.txt"), "w") as f:
+                f.write(content)
+            os.utime(os.path.join(self.first, "a.txt"), (1e9 + len(content),) * 2)
+            backup_engine.run_backup("Archive", self.first, self.src, {})
+        catalog = Catalog(self.src)
+        catalog.refresh()
+        catalog.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_sync_skips_source_bookkeeping(self):
+        for _ in range(2):
+            stats = backup_engine.sync_files(self.src, self.dst)
+            self.assertEqual(stats.errors, [])
+        self.assertEqual(stats.copied, 0)
+        self.assertEqual(stats.skipped, 1)
+        self.assertEqual(backup_engine.count_files(self.src), 1)
+        for name in (ARCHIVE_DIR_NAME, backup_engine.CATALOG_NAME):
+            self.assertFalse(os.path.exists(os.path.join(self.dst, name)))
+
+    def test_copy_and_dry_run_skip_source_bookkeeping(self):
+        backup_engine.run_backup("Copy", self.src, self.dst, {})
+        self.assertEqual(sorted(os.listdir(self.dst)), [backup_engine.MANIFEST_NAME, "a.txt"])
+        self.assertEqual(backup_engine.dry_run(self.src, self.dst), {"same": 1})
+
+
+class ArchiveStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.src = os.path.join(self.root, "src")
+        self.dst = os.path.join(self.root, "dst")
+        os.makedirs(self.src)
+        os.makedirs(self.dst)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_runs_in_the_same_second_keep_every_version(self):
+        # Each run replaces a.txt; runs sharing a snapshot folder used to
+        # copy the new version through a hardlink into an older object
+        path = os.path.join(self.src, "a.txt")
+        for i in range(4):
+            with open(path, "w") as f:
+                f.write(f"content-{i}")
+            os.utime(path, (1e9 + i, 1e9 + i))
+            stats = backup_engine.run_backup("Archive", self.src, self.dst, {})
+            self.assertEqual(stats.errors, [])
+        archive = os.path.join(self.dst, ARCHIVE_DIR_NAME)
+        objects = [os.path.join(dirpath, name)
+                   for dirpath, dirnames, filenames in os.walk(os.path.join(archive, "objects"))
+                   for name in filenames]
+        self.assertEqual(len(objects), 3)
+        for fp in objects:
+            self.assertEqual(hash_file(fp), os.path.basename(fp))
+        self.assertEqual(len(os.listdir(os.path.join(archive, "snapshots"))), 3)
+
+    def test_packed_runs_at_the_same_time_keep_every_segment(self):
+        path = os.path.join(self.src, "g.txt")
+        now = time.time()
+        with mock.patch.object(pack_store.time, "time", lambda: now):
+            for i in range(2):
+                with open(path, "w") as f:
+                    f.write(f"gen{i}")
+                os.utime(path, (1e9 + i, 1e9 + i))
+                backup_engine.run_backup("Archive", self.src, self.dst,
+                                         {"archive_format": "packed"})
+        store = pack_store.PackStore(self.dst)
+        try:
+            rows = store.conn.execute(
+                "SELECT segment, offset, size FROM entries WHERE path = 'g.txt' ORDER BY rowid"
+            ).fetchall()
+        finally:
+            store.close()
+        self.assertEqual(len({segment for segment, offset, size in rows}), 2)
+        for i, (segment, offset, size) in enumerate(rows):
+            target = os.path.join(self.root, f"restored{i}")
+            pack_store.extract_members(os.path.join(store.segments_dir, segment), "none",
+                                       [(offset, size, 0, target)])
+            with open(target) as f:
+                self.assertEqual(f.read(), f"gen{i}")
+
+
+class CatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.src = os.path.join(self.root, "src")
+        self.dst = os.path.join(self.root, "dst")
+        os.makedirs(self.src)
+        os.makedirs(self.dst)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_snapshot_version_ends_when_it_was_archived(self):
+        # A long run reaches a file well after it started (and named its
+        # snapshot folder); the old version was still current until then
+        path = os.path.join(self.src, "a.txt")
+        with open(path, "w") as f:
+            f.write("old")
+        backup_engine.run_backup("Archive", self.src, self.dst, {})
+        now = time.time()
+        manifest = backup_engine.Manifest(self.dst)
+        manifest.conn.execute("UPDATE files SET backed_up_at = ?", (now - 7200,))
+        manifest.close()
+        with open(path, "w") as f:
+            f.write("new!")
+        run_start = time.strftime(archive_store.SNAPSHOT_TIME_FORMAT, time.localtime(now - 3600))
+        with mock.patch.object(archive_store.time, "strftime", lambda fmt: run_start):
+            stats = backup_engine.run_backup("Archive", self.src, self.dst, {})
+        self.assertEqual(stats.archived, 1)
+        catalog = Catalog(self.dst)
+        try:
+            catalog.refresh()
+            subfolders, files = catalog.list_dir("", now - 1800)
+        finally:
+            catalog.close()
+        self.assertEqual([(e["path"], e["kind"], e["size"]) for e in files],
+                         [("a.txt", "snapshot", 3)])
+
+
+if __name__ == "__main__":
+    unittest.main()
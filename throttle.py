@@ -0,0 +1,186 @@
+# throttle.py
+#
+# Bandwidth limit and priority for backups that run while people are working.
+# Configured in settings.json:
+#
+#   "bandwidth_limit_mb": 40,            MB/s for all copy workers together, 0 = unlimited
+#   "bandwidth_schedule": [              optional time-of-day overrides, first match wins
+#       {"start": "08:00", "end": "18:00", "limit_mb": 20, "days": ["Mon", "Tue", "Wed", "Thu", "Fri"]},
+#       {"start": "22:00", "end": "06:00", "limit_mb": 0}
+#   ],
+#   "io_priority": "low"                 "normal", "low" or "idle"
+#
+# The limit is a single token bucket shared by every worker thread, so the
+# total rate stays the same however many workers are copying. Windows that
+# end before they start (22:00-06:00) run over midnight.
+#
+# Priority is applied per thread: on Linux the copy threads get a higher nice
+# value and an ionice class (best-effort level 7 for "low", idle for "idle");
+# on Windows they enter background processing mode, which lowers both CPU and
+# I/O priority. Elsewhere only the nice value is changed. Threads created by a
+# lowered thread inherit its priority on Linux, so the GUI thread is never
+# affected.
+
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+PRIORITIES = ("normal", "low", "idle")
+# Nice value used for each priority
+NICE_VALUES = {"normal": 0, "low": 10, "idle": 19}
+# Largest amount of data allowed through at once after an idle period
+BURST_SECONDS = 0.5
+# How often the schedule is looked at again
+SCHEDULE_CHECK_SECONDS = 10.0
+# Window over which the observed rate is measured
+RATE_WINDOW_SECONDS = 2.0
+# Longest single sleep, so cancelling a throttled copy stays responsive
+MAX_SLEEP = 0.25
+DAY_NAMES = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+# ioprio_set(2) constants and syscall numbers
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASS_BE = 2
+IOPRIO_CLASS_IDLE = 3
+SYS_IOPRIO_SET = {"x86_64": 251, "i686": 289, "i386": 289, "aarch64": 30, "armv7l": 314,
+                  "ppc64le": 273, "riscv64": 30}
+# SetThreadPriority mode on Windows
+THREAD_MODE_BACKGROUND_BEGIN = 0x00010000
+
+
+def parse_time(text):
+    # "HH:MM" -> minutes after midnight
+    hours, minutes = text.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def parse_schedule(entries):
+    # settings.json schedule -> [(start_min, end_min, days or None, bytes_per_second)]
+    schedule = []
+    for entry in entries or []:
+        days = entry.get("days")
+        if days is not None:
+            days = {DAY_NAMES.index(day[:3].lower()) for day in days}
+        schedule.append((parse_time(entry["start"]), parse_time(entry["end"]), days,
+                         float(entry.get("limit_mb", 0)) * 1024 * 1024))
+    return schedule
+
+
+def scheduled_limit(schedule, default, now=None):
+    # Limit in bytes per second at local time now (a struct_time)
+    now = now or time.localtime()
+    minute = now.tm_hour * 60 + now.tm_min
+    for start, end, days, limit in schedule:
+        if start <= end:
+            inside = start <= minute < end
+            day = now.tm_wday
+        else:
+            # Runs over midnight; the part after midnight belongs to the day before
+            inside = minute >= start or minute < end
+            day = now.tm_wday if minute >= start else (now.tm_wday - 1) % 7
+        if inside and (days is None or day in days):
+            return limit
+    return default
+
+
+def set_thread_priority(priority):
+    # Lower the CPU and I/O priority of the calling thread; errors are ignored
+    # because a backup should still run where the OS refuses
+    if priority not in NICE_VALUES or priority == "normal":
+        return
+    if sys.platform == "win32":
+        try:
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetThreadPriority(kernel32.GetCurrentThread(), THREAD_MODE_BACKGROUND_BEGIN)
+        except (ImportError, AttributeError, OSError):
+            pass
+        return
+    try:
+        # On Linux PRIO_PROCESS with who=0 means the calling thread
+        os.setpriority(os.PRIO_PROCESS, 0, NICE_VALUES[priority])
+    except (AttributeError, OSError):
+        pass
+    number = SYS_IOPRIO_SET.get(os.uname().machine)
+    if not sys.platform.startswith("linux") or number is None:
+        return
+    if priority == "idle":
+        ioprio = IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT
+    else:
+        ioprio = (IOPRIO_CLASS_BE << IOPRIO_CLASS_SHIFT) | 7
+    try:
+        import ctypes
+        ctypes.CDLL(None, use_errno=True).syscall(number, IOPRIO_WHO_PROCESS, 0, ioprio)
+    except (ImportError, OSError):
+        pass
+
+
+class Throttle:
+    # Token bucket shared by all copy threads. consume(n) is called with every
+    # chunk read or written and blocks until the current limit allows it.
+    # Also remembers the configured priority for the pools' worker threads.
+    def __init__(self, limit=0.0, schedule=(), priority="normal"):
+        self.default_limit = limit
+        self.schedule = schedule
+        self.priority = priority
+        self.lock = threading.Lock()
+        self.limit = scheduled_limit(schedule, limit)
+        self.tokens = self.limit * BURST_SECONDS
+        self.last_fill = time.monotonic()
+        self.next_schedule_check = self.last_fill + SCHEDULE_CHECK_SECONDS
+        # (time, bytes) samples from the last RATE_WINDOW_SECONDS, and their total
+        self.samples = deque()
+        self.window_bytes = 0
+
+    @classmethod
+    def from_settings(cls, settings):
+        # None when no limit, schedule or priority is configured, so the copy
+        # loops keep their unthrottled fast path
+        limit = float(settings.get("bandwidth_limit_mb", 0) or 0) * 1024 * 1024
+        schedule = parse_schedule(settings.get("bandwidth_schedule"))
+        priority = settings.get("io_priority", "normal")
+        if not limit and not schedule and priority == "normal":
+            return None
+        return cls(limit, schedule, priority)
+
+    def enter_thread(self):
+        # Used as the pools' thread initializer
+        set_thread_priority(self.priority)
+
+    def consume(self, n, cancel_event=None):
+        with self.lock:
+            now = time.monotonic()
+            if now >= self.next_schedule_check:
+                self.limit = scheduled_limit(self.schedule, self.default_limit)
+                self.next_schedule_check = now + SCHEDULE_CHECK_SECONDS
+            self.samples.append((now, n))
+            self.window_bytes += n
+            self.expire_samples(now)
+            if not self.limit:
+                return
+            self.tokens = min(self.tokens + (now - self.last_fill) * self.limit,
+                              self.limit * BURST_SECONDS)
+            self.last_fill = now
+            # Go into debt rather than splitting n; later callers wait it off
+            self.tokens -= n
+            wait = -self.tokens / self.limit if self.tokens < 0 else 0.0
+        deadline = time.monotonic() + wait
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (cancel_event is not None and cancel_event.is_set()):
+                return
+            time.sleep(min(remaining, MAX_SLEEP))
+
+    def expire_samples(self, now):
+        cutoff = now - RATE_WINDOW_SECONDS
+        while self.samples and self.samples[0][0] < cutoff:
+            self.window_bytes -= self.samples.popleft()[1]
+
+    def observed_rate(self):
+        # Bytes per second actually let through over the last RATE_WINDOW_SECONDS
+        with self.lock:
+            self.expire_samples(time.monotonic())
+            return self.window_bytes / RATE_WINDOW_SECONDS
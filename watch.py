@@ -0,0 +1,267 @@
+# watch.py
+#
+# Continuous backup. Instead of walking the whole source on every run, the
+# source is watched for changes and only the changed paths are copied:
+#
+#   1. start watching (so nothing that changes during step 2 is missed)
+#   2. one full run of the action to reconcile source and destination
+#   3. collect changed paths; once nothing has changed for
+#      "watch_debounce_seconds", or "watch_max_delay_seconds" after the first
+#      change, run the action for just those paths
+#   4. if the watcher loses events (inotify queue overflow, or no watch could
+#      be added for a new directory), start a new watcher and go back to 2
+#
+# On Linux changes come from inotify (through ctypes, no extra packages).
+# Elsewhere, or when inotify runs out of watches, the source is polled every
+# "watch_poll_seconds" by comparing file sizes and mtimes, which still reads
+# no file data and copies only what changed.
+#
+# Nothing in here imports Qt.
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from jobs import run_job
+
+DEFAULT_DEBOUNCE_SECONDS = 5.0
+DEFAULT_MAX_DELAY_SECONDS = 60.0
+DEFAULT_POLL_SECONDS = 60.0
+# Longest wait for events, so cancelling stays responsive
+WAIT_SECONDS = 0.5
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class WatchUnavailable(Exception):
+    # inotify cannot be used here (not Linux, or out of watches)
+    pass
+
+
+class InotifyWatcher:
+    # One inotify watch per source directory. wait() returns the changed
+    # paths, relative to the source, and whether events were lost.
+    def __init__(self, root):
+        if not sys.platform.startswith("linux"):
+            raise WatchUnavailable("inotify is only available on Linux")
+        self.root = root
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise WatchUnavailable(os.strerror(ctypes.get_errno()))
+        self.dirs = {}
+        try:
+            self.add_tree("")
+        except WatchUnavailable:
+            os.close(self.fd)
+            raise
+
+    def add_watch(self, rel_dir):
+        path = os.fsencode(os.path.join(self.root, rel_dir))
+        wd = self.libc.inotify_add_watch(self.fd, path, WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise WatchUnavailable("out of inotify watches (fs.inotify.max_user_watches)")
+            # Gone already or unreadable; its parent's events still cover it
+            return
+        self.dirs[wd] = rel_dir
+
+    def add_tree(self, rel_dir):
+        # Watch rel_dir and every real directory under it
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            self.add_watch(current)
+            try:
+                with os.scandir(os.path.join(self.root, current)) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(os.path.join(current, entry.name) if current else entry.name)
+            except OSError:
+                pass
+
+    def remove_tree(self, rel_dir):
+        prefix = rel_dir + os.sep
+        for wd, current in list(self.dirs.items()):
+            if current == rel_dir or current.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.dirs[wd]
+
+    def wait(self, timeout):
+        changed = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return changed, False
+        overflow = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, pos)
+                name = data[pos + EVENT_HEADER.size:pos + EVENT_HEADER.size + length]
+                pos += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                if mask & IN_IGNORED:
+                    self.dirs.pop(wd, None)
+                    continue
+                rel_dir = self.dirs.get(wd)
+                if rel_dir is None or mask & IN_DELETE_SELF:
+                    continue
+                name = os.fsdecode(name.rstrip(b"\0"))
+                rel_path = os.path.join(rel_dir, name) if rel_dir else name
+                changed.add(rel_path)
+                if mask & IN_ISDIR and mask & IN_MOVED_FROM:
+                    # Its watches would keep reporting the old path
+                    self.remove_tree(rel_path)
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self.add_tree(rel_path)
+                    except WatchUnavailable:
+                        # The watch set is incomplete; watch() replaces this watcher
+                        overflow = True
+        return changed, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    # Fallback: compares (size, mtime_ns) of every source file every interval
+    def __init__(self, root, interval=DEFAULT_POLL_SECONDS, cancel_event=None):
+        self.root = root
+        self.interval = interval
+        self.cancel_event = cancel_event
+        self.state = self.snapshot()
+        self.next_poll = time.monotonic() + interval
+
+    def snapshot(self):
+        # {rel_path: (size, mtime_ns)} for files, None for directories, so a
+        # removed directory is reported and removed as a whole
+        state = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                break
+            rel_dir = os.path.relpath(dirpath, self.root)
+            rel_dir = "" if rel_dir == os.curdir else rel_dir
+            for name in dirnames:
+                state[os.path.join(rel_dir, name)] = None
+            for name in filenames:
+                try:
+                    st = os.stat(os.path.join(dirpath, name))
+                except OSError:
+                    continue
+                state[os.path.join(rel_dir, name)] = (st.st_size, st.st_mtime_ns)
+        return state
+
+    def wait(self, timeout):
+        remaining = self.next_poll - time.monotonic()
+        if remaining > timeout:
+            time.sleep(timeout)
+            return set(), False
+        time.sleep(max(remaining, 0))
+        self.next_poll = time.monotonic() + self.interval
+        state = self.snapshot()
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            return set(), False
+        changed = {p for p, v in state.items() if p not in self.state or self.state[p] != v}
+        changed.update(p for p in self.state if p not in state)
+        self.state = state
+        return changed, False
+
+    def close(self):
+        pass
+
+
+def make_watcher(root, settings, cancel_event=None):
+    # inotify where possible, polling otherwise; returns (watcher, kind)
+    try:
+        return InotifyWatcher(root), "inotify"
+    except (WatchUnavailable, OSError, AttributeError):
+        interval = float(settings.get("watch_poll_seconds", DEFAULT_POLL_SECONDS))
+        return PollingWatcher(root, interval, cancel_event), "polling"
+
+
+def watch(settings, cancel_event, on_result=None, on_progress=None, on_status=None,
+          metrics=None):
+    # Run settings' action continuously until cancel_event is set.
+    # on_result(result) gets the jobs.run_job result of every run, with
+    # "batch" set to "reconcile" or "changes" and "paths" to the number of
+    # changed paths. on_status(text) reports what the watcher is doing.
+    # metrics, if given, accumulates over every run (see metrics.py).
+    debounce = float(settings.get("watch_debounce_seconds", DEFAULT_DEBOUNCE_SECONDS))
+    max_delay = float(settings.get("watch_max_delay_seconds", DEFAULT_MAX_DELAY_SECONDS))
+    watcher, kind = make_watcher(settings["source_dir"], settings, cancel_event)
+
+    def run(batch, paths=None):
+        if on_status:
+            on_status("Reconciling the whole source..." if paths is None
+                      else f"Backing up {len(paths)} changed paths...")
+        result = run_job(settings, cancel_event, on_progress, paths=paths, metrics=metrics)
+        result["batch"] = batch
+        result["watcher"] = kind
+        if paths is not None:
+            result["paths"] = len(paths)
+        if on_result:
+            on_result(result)
+        if on_status:
+            on_status(f"Watching for changes ({kind})...")
+        return result
+
+    try:
+        result = run("reconcile")
+        if result["status"] in ("usage", "failed"):
+            return result
+        pending = set()
+        first = last = 0.0
+        while not cancel_event.is_set():
+            changed, overflow = watcher.wait(WAIT_SECONDS)
+            now = time.monotonic()
+            if overflow:
+                # Events were lost, and with them possibly the creation of
+                # directories that are now not watched. Rebuild the watch set
+                # (polling if inotify is out of watches), then only a full
+                # run can be trusted.
+                pending.clear()
+                watcher.close()
+                watcher, kind = make_watcher(settings["source_dir"], settings, cancel_event)
+                result = run("reconcile")
+                continue
+            if changed:
+                if not pending:
+                    first = now
+                pending |= changed
+                last = now
+            if pending and (now - last >= debounce or now - first >= max_delay):
+                paths, pending = pending, set()
+                result = run("changes", paths)
+        return result
+    finally:
+        watcher.close()